@@ -57,7 +57,15 @@ AVAILABLE_STEPS = {
 # Tagging settings
 TAG_MODEL_NAME = "EVA02_Large" # 模型名稱，例如 "wd14-vit-v2", "wd14-convnext-v2", "wd14-swinv2-v2", "mld-caformer", "mld-tresnet", "wd-v1-4-moat-tagger-v2", "wd-v1-4-vit-tagger-v2", "wd-v1-4-convnext-tagger-v2", "wd-v1-4-swin-tagger-v2", "Meta-CAFL", "Z3D-E", "ViT-bigG-14" , "EVA02_Large"
 TAG_GENERAL_THRESHOLD = 0.35 # 通用標籤閾值
-TAG_CHARACTER_THRESHOLD = 0.85 # 角色標籤閾值 (imgutils 內部使用，此處為參考)
+TAG_CHARACTER_THRESHOLD = 0.85 # 角色標籤閾值
+TAG_BATCH_SIZE = 8 # 每次 ONNX 推論送入的圖片數量 (批量標記時使用)
+TAG_IO_WORKERS = None # 批量標記時預先載入/解碼圖片的執行緒數量，None則依CPU核心數自動決定
+TAG_ONNX_PROVIDER = None # 標記模型的 ONNX provider，例如 "cuda"、"cpu"，None則自動偵測 (有 CUDA 時優先使用)
+TAG_DEVICE_ID = 0 # 使用 CUDA 時的 GPU 編號
+TAG_QUANTIZED_MODEL_DIR = None # INT8 量化模型目錄 ({模型名稱}.int8.onnx，可用 quantize_tagger_model 產生)，CPU 推論時若存在則優先使用，None則停用
+TAG_WARMUP_ON_STARTUP = False # 啟動 UI 時是否在背景預先載入標記模型並執行一次推論，避免第一次標記等待模型載入
+TAG_ENABLE_PHASH_CACHE = False # 是否以感知雜湊 (dHash) 快取推論結果，與先前標記過的圖片幾乎相同 (縮放、重新編碼) 的圖片直接沿用其標籤
+TAG_PHASH_MAX_DISTANCE = 4 # 視為相同圖片的最大漢明距離 (64 位元雜湊)，0 則只接受完全相同的雜湊
 TAG_CUSTOM_CHARACTER_TAG = "" # 自訂角色標籤，例如 "1girl, solo"
 TAG_CUSTOM_ARTIST_NAME = ""   # 自訂繪師名稱
 TAG_ENABLE_WILDCARD = False   # 是否啟用 wildcard 功能
@@ -78,11 +86,24 @@ UPSCALE_BATCH_SIZE = 1 # 批次大小
 UPSCALE_MIN_SIZE_THRESHOLD = None # 最小尺寸閾值，小於此值才放大 (e.g., 1024, 如果寬或高小於1024則放大)
 UPSCALE_OUTPUT_SUBDIR = "upscaled" # 放大圖片存放的子目錄名稱 (如果沒有覆寫原檔)
 UPSCALE_OVERWRITE_ORIGINAL = False # 是否覆寫原始檔案
+UPSCALE_JPEG_DRAFT = True # 大於目標尺寸兩倍以上的 JPEG 以 draft 模式縮小解碼，但不小於目標尺寸 (需同時設定目標寬高)
+# 批量放大時同時處理的圖片數量 (共用同一個模型)。None 時 CPU 上為 2、可用 CUDA 時為 1
+# 注意記憶體: 每張處理中的圖片會以放大後解析度保存 float32 分塊輸出與拼接緩衝區，
+# x4 模型放大 1024x1024 的輸入約需 600 MB，總峰值約為此數值乘上同時處理的張數
+UPSCALE_WORKERS = None
+UPSCALE_CROSS_IMAGE_TILE_BATCHING = True # 批量放大時將不同圖片的分塊合併成批次推論 (UPSCALE_BATCH_SIZE > 1 且多執行緒時生效)
+UPSCALE_RESIZE_REDUCING_GAP = 3.0 # 縮小時先以整數倍快速縮小再做 LANCZOS (Pillow reducing_gap)，None則單次完整重採樣
 
 # File Utils settings
 GRADIO_TEMP_DIR = os.path.join(BASE_DIR, 'temp_previews') # Gradio 預覽圖片的臨時目錄
 TEMP_PROCESSING_DIR = os.path.join(BASE_DIR, 'temp_processing') # 處理過程中的臨時檔案目錄
 URL_DOWNLOAD_TIMEOUT = 30 # URL 下載超時時間 (秒)
+HTTP_DOWNLOAD_CHUNK_SIZE = 64 * 1024 # URL 下載時每次讀取的區塊大小 (bytes)
+PREVIEW_USE_TMPFS = True # Linux 上預覽圖片是否寫入 /dev/shm (tmpfs)，空間不足時自動改用 GRADIO_TEMP_DIR
+PREVIEW_TMPFS_DIR = os.path.join('/dev/shm', 'waifuc_previews') # tmpfs 預覽目錄 (已加入 Gradio allowed_paths)
+PREVIEW_TMPFS_MIN_FREE = 512 * 1024 * 1024 # /dev/shm 剩餘空間低於此值 (bytes) 時不使用 tmpfs
+PREVIEW_MAX_AGE_SECONDS = 300 # tmpfs 預覽圖片保留時間 (秒)，逾時由背景執行緒清除
+ALLOWED_PREVIEW_PATHS = [INPUT_DIR, OUTPUT_DIR, GRADIO_TEMP_DIR, STATIC_DIR] # 可直接提供給 Gradio 預覽、無需重新編碼的來源目錄
 
 # 啟用/停用各處理步驟的開關
 ENABLE_VALIDATION = True
@@ -99,11 +120,20 @@ os.makedirs(TEMP_PROCESSING_DIR, exist_ok=True)
 # Face detection settings
 FACE_DETECTION_CONFIDENCE_THRESHOLD = 0.3  # 降低閾值以偵測更多臉部
 FACE_DETECTION_MODEL = "default"  # 可能需要嘗試不同模型
+FACE_DETECTION_BATCH_SIZE = 8  # 批量人臉偵測時每批載入的圖片數量
+FACE_DETECTION_IO_WORKERS = None  # 預先載入/解碼圖片的執行緒數量，None則依CPU核心數自動決定
+FACE_DETECTION_DRAFT_SIZE = 1280  # JPEG 以縮小模式解碼時的最小邊長，None則以原尺寸解碼
+FACE_DETECTION_WORKERS = 1  # 批量人臉偵測的工作進程數量 (>1 時每個進程各自載入一個模型，適用於 CPU 推論)
 
 # LPIPS clustering settings
 LPIPS_CLUSTERING_THRESHOLD = 0.3  # 進一步降低閾值以獲得更細緻的聚類
 LPIPS_MIN_SAMPLES = 2  # 最小樣本數
-LPIPS_BATCH_SIZE = 100  # 批次大小
+LPIPS_BATCH_SIZE = 100  # 批次大小 (僅在圖片數超過 LPIPS_MAX_ONESHOT 時使用)
+LPIPS_MAX_ONESHOT = 5000  # 不分批、一次聚類的最大圖片數 (超過則分批，批次間的重複圖片無法偵測)，None則不限制
+LPIPS_BATCH_WORKERS = None  # 分批聚類時同時處理的批次數量，None則為 min(4, CPU核心數)，GPU 推論時最多 2
+LPIPS_PREFETCH_IMAGES = True  # 逐批聚類時是否在背景執行緒預先解碼下一批圖片
+LPIPS_DEDUP_BY_CONTENT = False  # 聚類前是否以檔案內容雜湊去除完全相同的圖片 (需完整讀取每個檔案)
+LPIPS_DEDUP_BY_PHASH = False  # 聚類前是否以感知雜湊 (dHash) 合併重新編碼/縮放過的同一張圖片，只有代表圖片送入 LPIPS
 
 # Crop settings
 CROP_ENABLE_HEAD = True
@@ -121,11 +151,15 @@ FACE_DETECTION_TARGET_FACE_COUNT = 1  # 訓練需要的人臉數量 (0=無人臉
 FACE_DETECTION_FILTER_MODE = "keep_target"  # 過濾模式: "keep_target"(保留目標), "exclude_target"(排除目標), "classify_all"(只分類不過濾)
 FACE_DETECTION_EXCLUDED_DIR = "excluded_faces"  # 不符合要求的圖片存放目錄
 FACE_DETECTION_TRAINING_DIR = "training_faces"  # 符合訓練要求的圖片存放目錄
+FACE_DETECTION_NEED_DISTRIBUTION = True  # classify_all 模式下是否仍需偵測人臉以統計分佈 (False則直接移動全部圖片)
+FACE_DETECTION_DETAILS_LOG = None  # 批量分類的處理詳情 JSONL 輸出路徑，None則保留在記憶體結果中
 
 # LPIPS clustering settings
 LPIPS_AUTO_ELIMINATE_DUPLICATES = True  # 是否自動淘汰重複圖片
 LPIPS_ELIMINATED_DIR = None  # 淘汰圖片存放目錄，None則自動創建
+LPIPS_QUALITY_WORKERS = None  # 評估聚類內圖片品質時的執行緒數量，None則為 min(16, 聚類圖片數)
 
 # Tag service settings
 TAG_AUTO_SAVE_TO_FILE = True  # 是否自動保存標籤到文件
 TAG_OUTPUT_DIR = None  # 標籤文件輸出目錄，None則與圖片同目錄
+TAG_CACHE_PATH = None  # 批量標記的標籤快取 (sqlite) 檔案路徑，內容與標籤設定未變的圖片直接使用快取結果，None則停用
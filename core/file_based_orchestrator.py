@@ -11,6 +11,8 @@ import logging
 from typing import Optional, List, Dict, Tuple
 from pathlib import Path
 
+from PIL import Image
+
 from config import settings as default_settings
 
 
@@ -230,8 +232,6 @@ class FileBasedOrchestrator:
     def _validate_file_service(self, input_path: str, work_dir: str, step_name: str) -> Tuple[str, Dict]:
         """檔案驗證服務 - 檢查檔案完整性"""
         try:
-            from PIL import Image
-            
             # 嘗試打開並驗證圖片
             with Image.open(input_path) as img:
                 img.verify()
@@ -259,8 +259,6 @@ class FileBasedOrchestrator:
     def _transparency_file_service(self, input_path: str, work_dir: str, step_name: str) -> Tuple[str, Dict]:
         """透明背景處理服務"""
         try:
-            from PIL import Image
-            
             output_filename = f"{step_name}_{os.path.basename(input_path)}"
             output_path = os.path.join(work_dir, output_filename)
             
@@ -296,11 +294,13 @@ class FileBasedOrchestrator:
     def _face_detect_file_service(self, input_path: str, work_dir: str, step_name: str) -> Tuple[str, Dict]:
         """人臉檢測服務 - 基於檔案"""
         try:
-            # 這裡直接對應原始face_detection.py的邏輯
+            # 使用人臉偵測服務的統一實現 (結果包含 bbox/confidence/area/center)
             # 但為了簡化，這個版本只是檢測而不移動檔案
-            from imgutils.detect import detect_faces
+            # 偵測失敗時會拋出例外，回報 failed 而不是 0 張人臉
+            from services.face_detection_service import detect_faces_or_raise
             
-            result = detect_faces(input_path)
+            with Image.open(input_path) as img:
+                result = detect_faces_or_raise(img, self.logger, self.config)
             face_count = len(result)
             
             # 在工作目錄中創建副本（可選：可以在圖片上畫框）
@@ -452,24 +452,17 @@ class FileBasedOrchestrator:
     def _tag_file_service(self, input_path: str, work_dir: str, step_name: str) -> Tuple[str, Dict]:
         """圖片標記服務 - 生成標籤檔案"""
         try:
-            from imgutils.tagging import get_wd14_tags
+            from services.tag_service import tag_image_service_entry
             
             model_name = getattr(self.config, 'TAG_MODEL_NAME', 'EVA02_Large')
             
-            # 使用imgutils生成標籤
-            rating, features, chars = get_wd14_tags(input_path, model_name=model_name)
-            
-            # 處理標籤（簡化版，可以增強）
-            tag_parts = []
-            if chars:
-                tag_parts.extend(chars.keys())
-            if features:
-                # 過濾高信心度的特徵
-                threshold = getattr(self.config, 'TAG_GENERAL_THRESHOLD', 0.35)
-                filtered_features = [tag for tag, conf in features.items() if conf >= threshold]
-                tag_parts.extend(filtered_features)
+            # 直接傳入檔案路徑，使用標記服務的快取模型與標籤設定 (閾值、排除、自訂標籤)
+            tags_dict, message = tag_image_service_entry(None, self.logger, self.config, image_path=input_path)
+            if not tags_dict["tag_list"] and message.startswith(("Tagging failed", "Tagging error")):
+                raise RuntimeError(message)
             
-            tags_string = ", ".join(tag_parts)
+            tags_string = tags_dict["tags"]
+            tag_count = tags_dict["tag_count"]
             
             # 保存標籤檔案（對應原始tag.py的輸出）
             tag_filename = os.path.splitext(os.path.basename(input_path))[0] + ".txt"
@@ -487,9 +480,9 @@ class FileBasedOrchestrator:
                 "status": "tagged",
                 "tags": tags_string,
                 "tag_file": tag_output_path,
-                "tag_count": len(tag_parts),
+                "tag_count": tag_count,
                 "model": model_name,
-                "message": f"Generated {len(tag_parts)} tags using {model_name}"
+                "message": f"Generated {tag_count} tags using {model_name}"
             }
             
         except Exception as e:
@@ -186,6 +186,8 @@ class Orchestrator:
             tags_data = intermediate_results["tags"]
             if isinstance(tags_data, dict):
                 tags_string = tags_data.get("tags", "")
+                if tags_data.get("wildcard"):
+                    tags_string += f"\nWildcard: {tags_data['wildcard']}"
             else:
                 tags_string = str(tags_data)
 
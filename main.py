@@ -1,6 +1,7 @@
 import sys
 import os
 import logging # 導入標準 logging 模組
+import threading
 
 # --- 設定 Python Path ---
 # 確保專案根目錄 (waifuc_) 在 sys.path 中，以便進行絕對導入
@@ -59,6 +60,10 @@ def start_application():
             sys.exit(1)
 
     main_logger.info(f"準備啟動 {settings.GRADIO_TITLE}...")
+    if getattr(settings, 'TAG_WARMUP_ON_STARTUP', False) and getattr(settings, 'ENABLE_TAGGING', False):
+        # 在背景執行緒預熱標記模型，不延遲 UI 啟動 (只在啟用時才載入標記服務)
+        from services.tag_service import warmup_tagger
+        threading.Thread(target=warmup_tagger, args=(main_logger, settings), name="tagger-warmup", daemon=True).start()
     try:
         app_ui = create_ui() # create_ui 應使用 settings 中的配置
         
@@ -70,6 +75,7 @@ def start_application():
             server_name=settings.GRADIO_SERVER_NAME,
             server_port=settings.GRADIO_SERVER_PORT,
             share=settings.GRADIO_SHARE,
+            allowed_paths=[settings.PREVIEW_TMPFS_DIR] if getattr(settings, 'PREVIEW_USE_TMPFS', False) else None, # tmpfs 預覽目錄
             # prevent_thread_lock=True # 在 Windows 上如果遇到問題可以嘗試啟用
         )
         main_logger.info("Gradio 應用程式已成功關閉。") # launch() 是阻塞的，這行在關閉後執行
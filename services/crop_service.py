@@ -4,28 +4,41 @@ import tempfile
 import shutil
 from PIL import Image
 from waifuc.action import ThreeStageSplitAction
-from waifuc.export import SaveExporter
 from waifuc.source import LocalSource
 from utils.error_handler import safe_execute
 
 # Expect logger and config to be passed.
 
-def _safe_waifuc_process_internal(pil_image: Image.Image, logger, config=None):
+_CROP_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+def _crop_type_from_filename(filename):
     """
-    Internal wrapper for waifuc processing using a temporary directory.
-    Takes a PIL image, saves it temporarily, processes it with waifuc,
-    and returns a list of PIL images from the waifuc output.
+    Infer the crop type (head, halfbody, person) from a waifuc output filename suffix.
+    """
+    if "_head" in filename:
+        return "head"
+    if "_halfbody" in filename:
+        return "halfbody"
+    if "_person" in filename: # General person crop if not more specific
+        return "person"
+    return "unknown"
+
+def crop_image_iter(pil_image: Image.Image, logger, config=None):
+    """
+    Generator variant of the waifuc crop: yields one
+    {"image": PIL.Image, "type": str, "original_filename": str} dict at a time.
+    The waifuc pipeline is iterated directly instead of exported to a temporary output
+    directory, so each crop is handed over in memory as soon as waifuc produces it and
+    only the crop currently being consumed is held; callers can save and close it before
+    the next one is produced. The temporary input directory is removed when the generator
+    is exhausted or closed. Errors are raised to the caller.
     """
     temp_input_dir = None
-    temp_output_dir = None
-    cropped_images_pil = []
-    status_message = ""
 
     try:
-        # Create temporary directories for waifuc input and output
+        # Create a temporary directory for the waifuc input
         temp_input_dir = tempfile.mkdtemp()
-        temp_output_dir = tempfile.mkdtemp()
-        logger.debug(f"[CropService-Internal] Created temp dirs: Input '{temp_input_dir}', Output '{temp_output_dir}'")
+        logger.debug(f"[CropService-Internal] Created temp input dir: '{temp_input_dir}'")
 
         # Save the input PIL image to the temporary input directory
         # Waifuc typically operates on files, so we need to save the PIL image first.
@@ -38,57 +51,48 @@ def _safe_waifuc_process_internal(pil_image: Image.Image, logger, config=None):
         # Configure and run waifuc processing
         source = LocalSource(temp_input_dir) # Source is the directory containing the temp image
         # The ThreeStageSplitAction will find characters/subjects and crop them.
-        # It saves outputs with suffixes like _person1_head, _person1_halfbody, etc.
-        source.attach(ThreeStageSplitAction()).export(SaveExporter(temp_output_dir))
-        logger.info(f"[CropService-Internal] Waifuc ThreeStageSplitAction completed on '{temp_input_dir}' to '{temp_output_dir}'")
-
-        # Collect cropped images from the temporary output directory
-        output_files = os.listdir(temp_output_dir)
-        if not output_files:
-            status_message = "Waifuc processing ran but produced no output files."
-            logger.warning(f"[CropService-Internal] {status_message}")
-            # Return empty list, message will indicate no output
-        else:
-            for filename in output_files:
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')):
-                    file_path = os.path.join(temp_output_dir, filename)
-                    try:
-                        img = Image.open(file_path)
-                        # We might want to associate the type of crop (head, halfbody, person)
-                        # with the image. This can be inferred from the filename suffix.
-                        crop_type = "unknown"
-                        if "_head" in filename:
-                            crop_type = "head"
-                        elif "_halfbody" in filename:
-                            crop_type = "halfbody"
-                        elif "_person" in filename: # General person crop if not more specific
-                            crop_type = "person"
-                        
-                        cropped_images_pil.append({"image": img.copy(), "type": crop_type, "original_filename": filename})
-                        logger.debug(f"[CropService-Internal] Loaded cropped image: {filename} (type: {crop_type})")
-                        img.close() # Close file handle after copying
-                    except Exception as e_load:
-                        logger.error(f"[CropService-Internal] Failed to load cropped image '{file_path}': {e_load}")
-            status_message = f"Successfully processed and loaded {len(cropped_images_pil)} cropped image(s)."
-
-        return cropped_images_pil, status_message
+        # Its items carry filenames with suffixes like _person1_head, _person1_halfbody, etc.
+        # (the names SaveExporter would write), which give the crop type.
+        crop_count = 0
+        for item in source.attach(ThreeStageSplitAction()):
+            filename = item.meta.get('filename', '')
+            crop_type = _crop_type_from_filename(filename)
+            logger.debug(f"[CropService-Internal] Produced cropped image: {filename} (type: {crop_type})")
+            crop_count += 1
+            yield {"image": item.image, "type": crop_type, "original_filename": filename}
+        logger.info(f"[CropService-Internal] Waifuc ThreeStageSplitAction completed on '{temp_input_dir}' with {crop_count} crop(s)")
 
-    except Exception as e:
-        logger.error(f"[CropService-Internal] Error during waifuc processing: {e}", exc_info=True)
-        # Re-raise to be caught by safe_execute, which will log it with prefix
-        raise
     finally:
-        # Clean up temporary directories
+        # Clean up the temporary directory
         try:
             if temp_input_dir and os.path.exists(temp_input_dir):
                 shutil.rmtree(temp_input_dir)
                 logger.debug(f"[CropService-Internal] Cleaned up temp input dir: {temp_input_dir}")
-            if temp_output_dir and os.path.exists(temp_output_dir):
-                shutil.rmtree(temp_output_dir)
-                logger.debug(f"[CropService-Internal] Cleaned up temp output dir: {temp_output_dir}")
         except Exception as e_cleanup:
             logger.error(f"[CropService-Internal] Error cleaning up temp directories: {e_cleanup}")
 
+def _safe_waifuc_process_internal(pil_image: Image.Image, logger, config=None):
+    """
+    Internal wrapper for waifuc processing using a temporary directory.
+    Takes a PIL image, saves it temporarily, processes it with waifuc,
+    and returns a list of PIL images from the waifuc output.
+    """
+    try:
+        cropped_images_pil = list(crop_image_iter(pil_image, logger, config))
+    except Exception as e:
+        logger.error(f"[CropService-Internal] Error during waifuc processing: {e}", exc_info=True)
+        # Re-raise to be caught by safe_execute, which will log it with prefix
+        raise
+
+    if not cropped_images_pil:
+        status_message = "Waifuc processing ran but produced no output files."
+        logger.warning(f"[CropService-Internal] {status_message}")
+        # Return empty list, message will indicate no output
+    else:
+        status_message = f"Successfully processed and loaded {len(cropped_images_pil)} cropped image(s)."
+
+    return cropped_images_pil, status_message
+
 def crop_image_service(image_pil: Image.Image, crop_data, logger, config=None):
     """
     Service to crop an image using waifuc's ThreeStageSplitAction.
@@ -140,6 +144,33 @@ def crop_image_service(image_pil: Image.Image, crop_data, logger, config=None):
     # The main return for success is a list of dicts: {"image": PIL.Image, "type": str, "original_filename": str}
     return cropped_images_data, message
 
+def _save_crop_to_category(crop_image, crop_type, base_output_dir, original_filename, logger):
+    """
+    保存單張裁切圖片到對應類型的資料夾，返回保存路徑
+    """
+    # 創建分類資料夾
+    category_dir = os.path.join(base_output_dir, f"crop_{crop_type}")
+    os.makedirs(category_dir, exist_ok=True)
+    
+    # 生成文件名
+    base_name, ext = os.path.splitext(original_filename)
+    ext = ext or '.png'
+    save_filename = f"{base_name}_{crop_type}{ext}"
+    save_path = os.path.join(category_dir, save_filename)
+    
+    # 處理重名文件
+    if os.path.exists(save_path):
+        counter = 1
+        while os.path.exists(save_path):
+            save_filename = f"{base_name}_{crop_type}_{counter}{ext}"
+            save_path = os.path.join(category_dir, save_filename)
+            counter += 1
+    
+    # 保存圖片
+    crop_image.save(save_path)
+    logger.info(f"[CropService] Saved {crop_type} crop to: {save_path}")
+    return save_path
+
 def save_crops_to_categories(cropped_images_data, base_output_dir, original_filename, logger, config=None):
     """
     將裁切後的圖片按類型分類存儲到不同資料夾
@@ -148,35 +179,11 @@ def save_crops_to_categories(cropped_images_data, base_output_dir, original_file
         saved_paths = {}
         
         for crop_data in cropped_images_data:
-            crop_image = crop_data["image"]
             crop_type = crop_data["type"]
-            
-            # 創建分類資料夾
-            category_dir = os.path.join(base_output_dir, f"crop_{crop_type}")
-            os.makedirs(category_dir, exist_ok=True)
-            
-            # 生成文件名
-            base_name = os.path.splitext(original_filename)[0]
-            ext = os.path.splitext(original_filename)[1] or '.png'
-            save_filename = f"{base_name}_{crop_type}{ext}"
-            save_path = os.path.join(category_dir, save_filename)
-            
-            # 處理重名文件
-            if os.path.exists(save_path):
-                counter = 1
-                while os.path.exists(save_path):
-                    save_filename = f"{base_name}_{crop_type}_{counter}{ext}"
-                    save_path = os.path.join(category_dir, save_filename)
-                    counter += 1
-            
-            # 保存圖片
-            crop_image.save(save_path)
-            
-            if crop_type not in saved_paths:
-                saved_paths[crop_type] = []
-            saved_paths[crop_type].append(save_path)
-            
-            logger.info(f"[CropService] Saved {crop_type} crop to: {save_path}")
+            save_path = _save_crop_to_category(
+                crop_data["image"], crop_type, base_output_dir, original_filename, logger
+            )
+            saved_paths.setdefault(crop_type, []).append(save_path)
         
         return saved_paths
         
@@ -187,6 +194,7 @@ def save_crops_to_categories(cropped_images_data, base_output_dir, original_file
 def crop_batch_with_categorization(input_directory, output_directory, logger, config=None):
     """
     批量裁切圖片並按類型分類
+    每張裁切圖片在產生後立即保存並釋放，不會在記憶體中累積整批裁切結果
     """
     logger.info(f"[CropService] Starting batch crop with categorization")
     logger.info(f"[CropService] Input: {input_directory}, Output: {output_directory}")
@@ -200,7 +208,7 @@ def crop_batch_with_categorization(input_directory, output_directory, logger, co
     image_files = []
     for root, dirs, files in os.walk(input_directory):
         for filename in files:
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')):
+            if filename.lower().endswith(_CROP_IMAGE_EXTENSIONS):
                 image_files.append(os.path.join(root, filename))
     
     if not image_files:
@@ -217,42 +225,46 @@ def crop_batch_with_categorization(input_directory, output_directory, logger, co
             "unknown": []
         }
     }
+    crop_categories = results["crop_categories"]
     
     for image_path in image_files:
+        image_name = os.path.basename(image_path)
         try:
-            logger.info(f"[CropService] Processing: {os.path.basename(image_path)}")
+            logger.info(f"[CropService] Processing: {image_name}")
             
-            # 載入圖片
-            image_pil = Image.open(image_path)
-            
-            # 執行裁切
-            cropped_images_data, message = crop_image_service(image_pil, None, logger, config)
+            crop_count = 0
+            crop_failed = False
+            # 載入圖片並逐張執行裁切，保存後立即關閉
+            with Image.open(image_path) as image_pil:
+                try:
+                    for crop_data in crop_image_iter(image_pil, logger, config):
+                        crop_image = crop_data["image"]
+                        crop_type = crop_data["type"]
+                        try:
+                            save_path = _save_crop_to_category(
+                                crop_image, crop_type, output_directory, image_name, logger
+                            )
+                        finally:
+                            crop_image.close()
+                        
+                        # 統計結果
+                        category = crop_type if crop_type in crop_categories else "unknown"
+                        crop_categories[category].append(save_path)
+                        crop_count += 1
+                except Exception as e:
+                    # 與 crop_image_service (safe_execute) 相同：裁切失敗的圖片仍計入已處理檔案，不中斷整批
+                    crop_failed = True
+                    logger.error(f"[CropService] Error during waifuc image processing for {image_name}: {e}", exc_info=True)
             
-            if cropped_images_data and isinstance(cropped_images_data, list):
-                # 保存裁切結果到分類資料夾
-                saved_paths = save_crops_to_categories(
-                    cropped_images_data, 
-                    output_directory, 
-                    os.path.basename(image_path), 
-                    logger, 
-                    config
-                )
-                
-                # 統計結果
-                for crop_type, paths in saved_paths.items():
-                    if crop_type in results["crop_categories"]:
-                        results["crop_categories"][crop_type].extend(paths)
-                    else:
-                        results["crop_categories"]["unknown"].extend(paths)
-                
+            if crop_count and not crop_failed:
                 results["successful_crops"] += 1
-                logger.info(f"[CropService] Successfully cropped {os.path.basename(image_path)}: {len(cropped_images_data)} crops")
+                logger.info(f"[CropService] Successfully cropped {image_name}: {crop_count} crops")
             else:
                 results["failed_crops"] += 1
-                logger.warning(f"[CropService] No crops generated for {os.path.basename(image_path)}")
+                if not crop_failed:
+                    logger.warning(f"[CropService] No crops generated for {image_name}")
             
             results["processed_files"] += 1
-            image_pil.close()
             
         except Exception as e:
             results["failed_crops"] += 1
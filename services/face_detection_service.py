@@ -1,65 +1,152 @@
 # services/face_detection_service.py
+import os
+import errno
+import json
+import logging
+import multiprocessing
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PIL import Image
 from imgutils.detect import detect_faces # Using the core detection function
 from utils.error_handler import safe_execute # For safely executing the detection
+from utils.file_utils import scan_directory_for_images
 
 # No direct logger setup here, expect it to be passed.
 
-def detect_faces_service(image_pil: Image.Image, logger, config=None):
+# 支援的圖片副檔名 (小寫，含點)
+_SUPPORTED_FORMATS = frozenset({'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tiff'})
+
+# 偵測模型是否已在本進程中載入 (imgutils 會快取 ONNX session，只需觸發一次載入)
+_face_detector_ready = False
+
+# 批量偵測的單張處理詳情 (比 dict 更省記憶體)
+ProcessingDetail = namedtuple('ProcessingDetail', 'original_path face_count faces_data classification message')
+
+# 多進程偵測時每個工作進程的設定 (conf_threshold, draft_size)，由 _init_detection_worker 初始化
+_worker_settings = None
+
+def _normalize_detection(face_data):
     """
-    人臉偵測服務 - 正確使用 detect_faces 並返回詳細的人臉資訊
+    統一 detect_faces 的單筆輸出格式
+    支援 dict 格式 {'bbox': [x1, y1, x2, y2], 'score': float}
+    以及 imgutils 的 tuple 格式 ((x1, y1, x2, y2), label, score)
+    
+    Returns:
+        tuple: (邊界框, 置信度)
     """
-    logger.info(f"[FaceDetectionService] 開始偵測人臉...")
+    if isinstance(face_data, dict):
+        return face_data.get('bbox', [0, 0, 0, 0]), face_data.get('score', 0.0)
+    bbox, _, score = face_data
+    return bbox, score
 
-    if not isinstance(image_pil, Image.Image):
-        logger.error("[FaceDetectionService] 輸入不是 PIL Image 對象")
-        return None, "錯誤: 輸入不是有效的 PIL Image", None
+def _bbox_stats(bboxes):
+    """
+    計算 (N, 4) 邊界框陣列 [x1, y1, x2, y2] 的面積與中心點
+    
+    Returns:
+        tuple: (面積陣列 (N,), 中心點陣列 (N, 2))
+    """
+    # 以原地運算減少中間陣列: 寬高 -> 面積，左上 + 右下 -> 中心
+    sizes = bboxes[:, 2:] - bboxes[:, :2]
+    areas = np.multiply(sizes[:, 0], sizes[:, 1])
+    np.abs(areas, out=areas)
+    centers = bboxes[:, :2] + bboxes[:, 2:]
+    centers *= 0.5
+    return areas, centers
 
-    def _detect_faces_internal(pil_image):
-        """
-        內部人臉偵測函數 - 正確使用 imgutils.detect.detect_faces
-        """
-        try:
-            # 獲取配置參數
-            conf_threshold = getattr(config, 'FACE_DETECTION_CONFIDENCE_THRESHOLD', 0.3)
-            
-            # 使用 detect_faces 進行偵測
-            # detect_faces 返回 list of dict，每個 dict 包含:
-            # - 'bbox': [x1, y1, x2, y2] 邊界框座標
-            # - 'score': float 置信度分數
-            detection_result = detect_faces(pil_image, conf_threshold=conf_threshold)
-            
-            logger.debug(f"[FaceDetectionService] detect_faces 返回 {len(detection_result)} 個結果")
-            
-            # 處理偵測結果，建構詳細資訊
-            processed_faces = []
-            for i, face_data in enumerate(detection_result):
-                face_info = {
-                    'id': i,
-                    'bbox': face_data.get('bbox', [0, 0, 0, 0]),  # 邊界框 [x1, y1, x2, y2]
-                    'confidence': face_data.get('score', 0.0),    # 置信度
-                    'area': 0,                                     # 人臉區域面積
-                    'center': [0, 0]                              # 人臉中心點
-                }
-                
-                # 計算人臉區域面積和中心點
-                if 'bbox' in face_data and len(face_data['bbox']) >= 4:
-                    x1, y1, x2, y2 = face_data['bbox'][:4]
-                    face_info['area'] = abs((x2 - x1) * (y2 - y1))
-                    face_info['center'] = [(x1 + x2) / 2, (y1 + y2) / 2]
-                
-                processed_faces.append(face_info)
-            
-            return processed_faces
-            
-        except Exception as e:
-            logger.error(f"[FaceDetectionService] detect_faces 調用失敗: {e}")
-            raise
+def _detect_faces_internal(pil_image, conf_threshold, logger, scale=None):
+    """
+    內部人臉偵測函數 - 正確使用 imgutils.detect.detect_faces
+    scale 為 (x 倍率, y 倍率)，圖片以縮小尺寸解碼時用來將座標換算回原始尺寸
+    """
+    try:
+        # 使用 detect_faces 進行偵測，結果格式由 _normalize_detection 統一
+        detection_result = detect_faces(pil_image, conf_threshold=conf_threshold)
+        
+        logger.debug("[FaceDetectionService] detect_faces 返回 %d 個結果", len(detection_result))
+        
+        if not detection_result:
+            return []
+        
+        # 處理偵測結果，以 NumPy 一次計算所有人臉的面積和中心點
+        normalized = [_normalize_detection(face_data) for face_data in detection_result]
+        bboxes = np.asarray(
+            [bbox[:4] if len(bbox) >= 4 else (0, 0, 0, 0) for bbox, _ in normalized],
+            dtype=np.float64
+        ).reshape(-1, 4)
+        if scale is not None:
+            bboxes *= (scale[0], scale[1], scale[0], scale[1])
+            bbox_values = bboxes.tolist()
+        else:
+            bbox_values = [bbox for bbox, _ in normalized]
+        areas, centers = _bbox_stats(bboxes)
+        
+        processed_faces = [
+            {
+                'id': i,
+                'bbox': bbox,            # 邊界框 [x1, y1, x2, y2]
+                'confidence': score,     # 置信度
+                'area': area,            # 人臉區域面積
+                'center': center         # 人臉中心點
+            }
+            for i, (bbox, (_, score), area, center) in enumerate(
+                zip(bbox_values, normalized, areas.tolist(), centers.tolist())
+            )
+        ]
+        
+        return processed_faces
+        
+    except Exception as e:
+        logger.error(f"[FaceDetectionService] detect_faces 調用失敗: {e}")
+        raise
+
+def _warmup_face_detector(conf_threshold, logger):
+    """
+    在批量處理前預先載入人臉偵測模型，之後每張圖片都重用同一個 ONNX session
+    載入失敗時只記錄警告，實際錯誤會在偵測時由 safe_execute 處理
+    """
+    global _face_detector_ready
+    if _face_detector_ready:
+        return
+    
+    start_time = time.perf_counter()
+    try:
+        detect_faces(Image.new('RGB', (64, 64)), conf_threshold=conf_threshold)
+    except Exception as e:
+        logger.warning(f"[FaceDetectionService] 人臉偵測模型預載入失敗: {e}")
+        return
+    
+    _face_detector_ready = True
+    logger.info(f"[FaceDetectionService] 人臉偵測模型已載入 ({time.perf_counter() - start_time:.2f}s)")
 
+def _summarize_faces(faces_data):
+    """
+    單次遍歷計算人臉列表的平均置信度與總面積
+    
+    Returns:
+        tuple: (平均置信度, 總面積)
+    """
+    total_confidence = 0.0
+    total_area = 0.0
+    for face in faces_data:
+        total_confidence += face['confidence']
+        total_area += face['area']
+    return total_confidence / len(faces_data), total_area
+
+def _detect_and_summarize(image_pil, conf_threshold, logger, scale=None):
+    """
+    執行人臉偵測並生成偵測報告
+    
+    Returns:
+        tuple: (訊息, 人臉資訊列表)
+    """
     # 安全執行人臉偵測
     detection_results = safe_execute(
         _detect_faces_internal,
-        image_pil,
+        image_pil, conf_threshold, logger, scale,
         logger=logger,
         default_return=[],  # 預設返回空列表而非 None
         error_msg_prefix="[FaceDetectionService] 人臉偵測執行錯誤"
@@ -76,21 +163,240 @@ def detect_faces_service(image_pil: Image.Image, logger, config=None):
         logger.info(f"[FaceDetectionService] {message}")
     else:
         # 計算平均置信度
-        avg_confidence = sum(face['confidence'] for face in detection_results) / face_count
-        total_area = sum(face['area'] for face in detection_results)
+        avg_confidence, total_area = _summarize_faces(detection_results)
         
         message = f"偵測到 {face_count} 個人臉 (平均置信度: {avg_confidence:.2f}, 總面積: {total_area:.0f})"
         logger.info(f"[FaceDetectionService] {message}")
         
-        # 記錄每個人臉的詳細資訊
-        for face in detection_results:
-            logger.debug(f"[FaceDetectionService] 人臉 {face['id']}: "
-                        f"位置 {face['bbox']}, 置信度 {face['confidence']:.3f}, "
-                        f"面積 {face['area']:.0f}")
+        # 記錄每個人臉的詳細資訊 (僅在 DEBUG 級別啟用時格式化)
+        if logger.isEnabledFor(logging.DEBUG):
+            for face in detection_results:
+                logger.debug("[FaceDetectionService] 人臉 %d: 位置 %s, 置信度 %.3f, 面積 %.0f",
+                             face['id'], face['bbox'], face['confidence'], face['area'])
+
+    return message, detection_results
+
+def detect_faces_service(image_pil: Image.Image, logger, config=None):
+    """
+    人臉偵測服務 - 正確使用 detect_faces 並返回詳細的人臉資訊
+    """
+    logger.info(f"[FaceDetectionService] 開始偵測人臉...")
+
+    if not isinstance(image_pil, Image.Image):
+        logger.error("[FaceDetectionService] 輸入不是 PIL Image 對象")
+        return None, "錯誤: 輸入不是有效的 PIL Image", None
+
+    # 獲取配置參數
+    conf_threshold = getattr(config, 'FACE_DETECTION_CONFIDENCE_THRESHOLD', 0.3)
+    message, detection_results = _detect_and_summarize(image_pil, conf_threshold, logger)
 
     return image_pil, message, detection_results
 
-def classify_by_face_count(image_path, face_count, faces_data=None, logger=None, config=None):
+def detect_faces_or_raise(image_pil: Image.Image, logger, config=None):
+    """
+    人臉偵測 - 與 detect_faces_service 相同的偵測，但失敗時拋出例外而不是回傳空結果，
+    讓呼叫端能區分「偵測失敗」與「沒有人臉」
+
+    Returns:
+        list: 人臉資訊列表 (bbox/confidence/area/center)
+    """
+    conf_threshold = getattr(config, 'FACE_DETECTION_CONFIDENCE_THRESHOLD', 0.3)
+    return _detect_faces_internal(image_pil, conf_threshold, logger)
+
+def detect_faces_batch(pil_images, logger, config=None, scales=None):
+    """
+    批次人臉偵測 - 對一組 PIL 圖片執行偵測，配置參數只讀取一次
+    scales 為每張圖片的座標換算倍率 (可選，對應以 draft 縮小解碼的圖片)
+    
+    Returns:
+        list: 依輸入順序排列的 (message, faces_data) 列表
+    """
+    conf_threshold = getattr(config, 'FACE_DETECTION_CONFIDENCE_THRESHOLD', 0.3)
+    _warmup_face_detector(conf_threshold, logger)
+    if scales is None:
+        scales = [None] * len(pil_images)
+    return [
+        _detect_and_summarize(image_pil, conf_threshold, logger, scale)
+        for image_pil, scale in zip(pil_images, scales)
+    ]
+
+def _load_image_for_detection(image_path, draft_size=None):
+    """
+    載入並解碼圖片 (在工作執行緒中執行，PIL 解碼時會釋放 GIL)
+    JPEG 圖片會以 draft 模式直接在解碼時縮小到不小於 draft_size 的尺寸，
+    偵測模型本身只使用約 640px 的輸入，因此不影響偵測結果
+    不含透明通道的圖片會先轉為 RGB，避免偵測時在主執行緒上再次轉換
+    (含透明通道的圖片交由 imgutils 以白色背景合成)
+    
+    Returns:
+        tuple: (PIL 圖片, 座標換算倍率 或 None)
+    """
+    image_pil = Image.open(image_path)
+    try:
+        scale = None
+        if draft_size and image_pil.format == 'JPEG':
+            original_width, original_height = image_pil.size
+            image_pil.draft('RGB', (draft_size, draft_size))
+            if image_pil.size != (original_width, original_height):
+                scale = (original_width / image_pil.width, original_height / image_pil.height)
+        image_pil.load()
+        if image_pil.mode not in ('RGB', 'RGBA', 'LA', 'PA') and 'transparency' not in image_pil.info:
+            rgb_image = image_pil.convert('RGB')
+            image_pil.close()
+            image_pil = rgb_image
+    except Exception:
+        image_pil.close()
+        raise
+    return image_pil, scale
+
+def _init_detection_worker(conf_threshold, draft_size):
+    """
+    工作進程初始化: 保存偵測設定並在本進程中載入一次偵測模型
+    """
+    global _worker_settings
+    _worker_settings = (conf_threshold, draft_size)
+    _warmup_face_detector(conf_threshold, logging.getLogger(__name__))
+
+def _detect_faces_in_worker(image_path):
+    """
+    工作進程中處理單一圖片: 載入、解碼並偵測人臉 (不移動文件)
+    
+    Returns:
+        tuple: (圖片路徑, 人臉資訊列表, 訊息)，載入失敗時人臉資訊為 None
+    """
+    conf_threshold, draft_size = _worker_settings
+    worker_logger = logging.getLogger(__name__)
+    try:
+        image_pil, scale = _load_image_for_detection(image_path, draft_size)
+    except Exception as e:
+        return image_path, None, f"載入圖片失敗: {e}"
+    
+    try:
+        message, faces_data = _detect_and_summarize(image_pil, conf_threshold, worker_logger, scale)
+    finally:
+        image_pil.close()
+    return image_path, faces_data, message
+
+def _iter_face_detections_multiprocess(image_files, workers, logger, config=None):
+    """
+    以多個工作進程 (各自持有一個 ONNX session) 平行偵測人臉
+    文件移動仍由主進程處理，以保持重名處理的一致性
+    
+    Yields:
+        tuple: (圖片路徑, 人臉資訊列表, 訊息)，順序不保證與輸入相同
+    """
+    conf_threshold = getattr(config, 'FACE_DETECTION_CONFIDENCE_THRESHOLD', 0.3)
+    draft_size = getattr(config, 'FACE_DETECTION_DRAFT_SIZE', 1280)
+    logger.info(f"[FaceDetectionService] 使用 {workers} 個工作進程進行人臉偵測")
+    
+    # 使用 spawn 避免 fork 已初始化的 ONNX runtime 執行緒
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_detection_worker,
+                      initargs=(conf_threshold, draft_size)) as pool:
+        yield from pool.imap_unordered(_detect_faces_in_worker, image_files, chunksize=16)
+
+def _iter_face_detections(image_files, logger, config=None):
+    """
+    以 FACE_DETECTION_BATCH_SIZE 為單位分批載入圖片並偵測人臉
+    圖片讀取與解碼由執行緒池預先載入下一批，與目前批次的偵測重疊進行
+    
+    設定 FACE_DETECTION_WORKERS > 1 時改用多進程偵測
+    
+    Yields:
+        tuple: (圖片路徑, 人臉資訊列表, 訊息)，載入失敗時人臉資訊為 None
+    """
+    workers = getattr(config, 'FACE_DETECTION_WORKERS', 1) or 1
+    if workers > 1:
+        yield from _iter_face_detections_multiprocess(image_files, workers, logger, config)
+        return
+    
+    batch_size = max(1, getattr(config, 'FACE_DETECTION_BATCH_SIZE', 8))
+    io_workers = getattr(config, 'FACE_DETECTION_IO_WORKERS', None) or min(8, os.cpu_count() or 1)
+    draft_size = getattr(config, 'FACE_DETECTION_DRAFT_SIZE', 1280)
+    batches = [image_files[start:start + batch_size] for start in range(0, len(image_files), batch_size)]
+    
+    with ThreadPoolExecutor(max_workers=io_workers) as executor:
+        def _submit(batch_paths):
+            return [executor.submit(_load_image_for_detection, path, draft_size) for path in batch_paths]
+        
+        pending = _submit(batches[0]) if batches else []
+        for index, batch_paths in enumerate(batches):
+            futures = pending
+            # 預先提交下一批的載入工作
+            pending = _submit(batches[index + 1]) if index + 1 < len(batches) else []
+            
+            loaded_paths = []
+            loaded_images = []
+            loaded_scales = []
+            for image_path, future in zip(batch_paths, futures):
+                try:
+                    image_pil, scale = future.result()
+                except Exception as e:
+                    yield image_path, None, f"載入圖片失敗: {e}"
+                    continue
+                loaded_paths.append(image_path)
+                loaded_images.append(image_pil)
+                loaded_scales.append(scale)
+            
+            try:
+                batch_results = detect_faces_batch(loaded_images, logger, config, loaded_scales)
+            finally:
+                for image_pil in loaded_images:
+                    image_pil.close()
+            
+            for image_path, (message, faces_data) in zip(loaded_paths, batch_results):
+                yield image_path, faces_data, message
+
+class _UniqueNameAllocator:
+    """
+    根據目錄中的既有檔名產生不重複的檔名 (name_1.ext, name_2.ext ...)
+    每個重名檔案記住下一個可用序號，重複衝突時不需從 1 開始逐一嘗試
+    """
+    __slots__ = ('names', 'next_suffix')
+
+    def __init__(self, names):
+        self.names = set(names)
+        self.next_suffix = {}
+
+    def allocate(self, filename):
+        """返回不重複的檔名並登記"""
+        if filename not in self.names:
+            self.names.add(filename)
+            return filename
+        
+        name, ext = os.path.splitext(filename)
+        counter = self.next_suffix.get(filename, 1)
+        while f"{name}_{counter}{ext}" in self.names:
+            counter += 1
+        unique_name = f"{name}_{counter}{ext}"
+        self.names.add(unique_name)
+        self.next_suffix[filename] = counter + 1
+        return unique_name
+
+def _get_name_allocator(directory, name_cache=None):
+    """
+    取得目錄的檔名分配器
+    name_cache 為 {目錄: _UniqueNameAllocator}，同一目錄只在首次查詢時執行 os.listdir
+    """
+    if name_cache is not None and directory in name_cache:
+        return name_cache[directory]
+    allocator = _UniqueNameAllocator(os.listdir(directory))
+    if name_cache is not None:
+        name_cache[directory] = allocator
+    return allocator
+
+def _move_file(src_path, target_path):
+    """
+    移動文件: 同一檔案系統使用 os.replace 直接改名，跨檔案系統時退回 shutil.move
+    """
+    try:
+        os.replace(src_path, target_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src_path, target_path)
+
+def classify_by_face_count(image_path, face_count, faces_data=None, logger=None, config=None, name_cache=None):
     """
     根據人臉數量分類圖片到不同資料夾
     
@@ -100,6 +406,7 @@ def classify_by_face_count(image_path, face_count, faces_data=None, logger=None,
         faces_data: 詳細的人臉資訊 (可選)
         logger: 日誌記錄器
         config: 配置對象
+        name_cache: 目錄檔名快取 {目錄: 檔名分配器} (可選，批量處理時共用以避免重複掃描)
     
     Returns:
         tuple: (新路徑, 分類名稱, 分類統計)
@@ -137,22 +444,17 @@ def classify_by_face_count(image_path, face_count, faces_data=None, logger=None,
         else:
             category_info = classification_rules.get(face_count, classification_rules[0])
         
-        # 創建分類目標資料夾
+        # 創建分類目標資料夾 (已在 name_cache 中的目錄表示本批次已創建並掃描過)
         category_dir = os.path.join(base_dir, category_info['folder'])
-        os.makedirs(category_dir, exist_ok=True)
+        if name_cache is None or category_dir not in name_cache:
+            os.makedirs(category_dir, exist_ok=True)
         
         # 計算目標路徑，處理重名文件
-        target_path = os.path.join(category_dir, filename)
-        if os.path.exists(target_path):
-            name, ext = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(target_path):
-                target_path = os.path.join(category_dir, f"{name}_{counter}{ext}")
-                counter += 1
+        name_allocator = _get_name_allocator(category_dir, name_cache)
+        target_path = os.path.join(category_dir, name_allocator.allocate(filename))
         
         # 移動文件到分類資料夾
-        import shutil
-        shutil.move(image_path, target_path)
+        _move_file(image_path, target_path)
         
         # 生成分類統計資訊
         classification_stats = {
@@ -166,9 +468,10 @@ def classify_by_face_count(image_path, face_count, faces_data=None, logger=None,
         
         # 如果有詳細人臉資訊，加入統計
         if faces_data and len(faces_data) > 0:
+            avg_confidence, total_area = _summarize_faces(faces_data)
             classification_stats['faces_info'] = {
-                'avg_confidence': sum(f['confidence'] for f in faces_data) / len(faces_data),
-                'total_area': sum(f['area'] for f in faces_data),
+                'avg_confidence': avg_confidence,
+                'total_area': total_area,
                 'face_positions': [f['center'] for f in faces_data]
             }
         
@@ -209,20 +512,14 @@ def filter_images_for_training(input_directory, logger, config=None):
     os.makedirs(training_dir, exist_ok=True)
     os.makedirs(excluded_dir, exist_ok=True)
     
+    # 一次讀取目標目錄中的既有檔名，用於產生不重複的檔名
+    training_names = _get_name_allocator(training_dir)
+    excluded_names = _get_name_allocator(excluded_dir)
+    
     # 掃描圖片文件
-    image_files = []
-    supported_formats = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tiff')
-    
-    for root, dirs, files in os.walk(input_directory):
-        # 跳過已創建的訓練和排除目錄
-        if training_dir_name in dirs:
-            dirs.remove(training_dir_name)
-        if excluded_dir_name in dirs:
-            dirs.remove(excluded_dir_name)
-            
-        for filename in files:
-            if filename.lower().endswith(supported_formats):
-                image_files.append(os.path.join(root, filename))
+    # 跳過已創建的訓練和排除目錄
+    image_files = scan_directory_for_images(input_directory, supported_extensions=_SUPPORTED_FORMATS,
+                                            skip_dir_names={training_dir_name, excluded_dir_name})
     
     if not image_files:
         return False, "未找到圖片文件", {}
@@ -243,16 +540,27 @@ def filter_images_for_training(input_directory, logger, config=None):
         }
     }
     
-    # 處理每個圖片
-    for i, image_path in enumerate(image_files, 1):
+    # classify_all 模式下所有圖片都會保留，若不需要人臉分佈統計則直接略過偵測
+    skip_detection = filter_mode == "classify_all" and not getattr(config, 'FACE_DETECTION_NEED_DISTRIBUTION', True)
+    if skip_detection:
+        logger.info(f"[FaceDetectionService] classify_all 模式且不需要人臉分佈統計，略過人臉偵測")
+        detections = ((image_path, None, None) for image_path in image_files)
+    else:
+        # 分批偵測並處理每個圖片
+        detections = _iter_face_detections(image_files, logger, config)
+    
+    for i, (image_path, faces_data, message) in enumerate(detections, 1):
         try:
             logger.info(f"[FaceDetectionService] 處理 ({i}/{len(image_files)}): {os.path.basename(image_path)}")
             
-            # 載入圖片
-            image_pil = Image.open(image_path)
-            
-            # 偵測人臉
-            result_image, message, faces_data = detect_faces_service(image_pil, logger, config)
+            if skip_detection:
+                filename = os.path.basename(image_path)
+                target_path = os.path.join(training_dir, training_names.allocate(filename))
+                _move_file(image_path, target_path)
+                results["training_images"].append(target_path)
+                results["filter_stats"]["training_count"] += 1
+                results["filter_stats"]["processed"] += 1
+                continue
             
             if faces_data is not None:
                 face_count = len(faces_data)
@@ -285,33 +593,17 @@ def filter_images_for_training(input_directory, logger, config=None):
                 filename = os.path.basename(image_path)
                 
                 if is_suitable_for_training:
-                    target_path = os.path.join(training_dir, filename)
                     # 處理重名
-                    if os.path.exists(target_path):
-                        name, ext = os.path.splitext(filename)
-                        counter = 1
-                        while os.path.exists(target_path):
-                            target_path = os.path.join(training_dir, f"{name}_{counter}{ext}")
-                            counter += 1
-                    
-                    import shutil
-                    shutil.move(image_path, target_path)
+                    target_path = os.path.join(training_dir, training_names.allocate(filename))
+                    _move_file(image_path, target_path)
                     results["training_images"].append(target_path)
                     results["filter_stats"]["training_count"] += 1
                     
                     logger.info(f"[FaceDetectionService] ✓ 訓練圖片: {filename} ({face_count} 個人臉)")
                 else:
-                    target_path = os.path.join(excluded_dir, filename)
                     # 處理重名
-                    if os.path.exists(target_path):
-                        name, ext = os.path.splitext(filename)
-                        counter = 1
-                        while os.path.exists(target_path):
-                            target_path = os.path.join(excluded_dir, f"{name}_{counter}{ext}")
-                            counter += 1
-                    
-                    import shutil
-                    shutil.move(image_path, target_path)
+                    target_path = os.path.join(excluded_dir, excluded_names.allocate(filename))
+                    _move_file(image_path, target_path)
                     results["excluded_images"].append(target_path)
                     results["filter_stats"]["excluded_count"] += 1
                     
@@ -320,9 +612,7 @@ def filter_images_for_training(input_directory, logger, config=None):
                 results["filter_stats"]["processed"] += 1
             else:
                 results["filter_stats"]["error_count"] += 1
-                logger.error(f"[FaceDetectionService] ✗ 處理失敗: {os.path.basename(image_path)}")
-            
-            image_pil.close()
+                logger.error(f"[FaceDetectionService] ✗ 處理失敗: {os.path.basename(image_path)} - {message}")
             
         except Exception as e:
             results["filter_stats"]["error_count"] += 1
@@ -364,19 +654,18 @@ def detect_faces_batch_with_classification(input_directory, logger, config=None)
         return False, "輸入目錄不存在", {}
     
     # 掃描所有支援的圖片文件
-    image_files = []
-    supported_formats = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tiff')
-    
-    for root, dirs, files in os.walk(input_directory):
-        for filename in files:
-            if filename.lower().endswith(supported_formats):
-                image_files.append(os.path.join(root, filename))
+    image_files = scan_directory_for_images(input_directory, supported_extensions=_SUPPORTED_FORMATS)
     
     if not image_files:
         return False, "未找到圖片文件", {}
     
     logger.info(f"[FaceDetectionService] 找到 {len(image_files)} 個圖片文件")
     
+    # 讀取配置
+    classification_enabled = getattr(config, 'FACE_DETECTION_AUTO_CLASSIFY', True)
+    name_cache = {}  # 分類目錄的既有檔名快取
+    details_log_path = getattr(config, 'FACE_DETECTION_DETAILS_LOG', None)
+    
     # 初始化結果統計
     classification_results = {
         "no_faces": [],       # 無人臉圖片列表
@@ -390,88 +679,87 @@ def detect_faces_batch_with_classification(input_directory, logger, config=None)
         "processed": 0,
         "successful": 0,
         "failed": 0,
-        "classification_enabled": getattr(config, 'FACE_DETECTION_AUTO_CLASSIFY', True),
+        "classification_enabled": classification_enabled,
         "face_distribution": {
             "0_faces": 0,
             "1_face": 0, 
             "2_faces": 0,
             "3_plus_faces": 0
         },
-        "processing_details": []
+        "processing_details": [],  # ProcessingDetail 列表 (設定 FACE_DETECTION_DETAILS_LOG 時為空)
+        "processing_details_log": details_log_path
     }
     
-    # 處理每個圖片文件
-    for i, image_path in enumerate(image_files, 1):
-        try:
-            logger.info(f"[FaceDetectionService] 處理 ({i}/{len(image_files)}): {os.path.basename(image_path)}")
-            
-            # 載入圖片
-            image_pil = Image.open(image_path)
-            
-            # 執行人臉偵測
-            result_image, message, faces_data = detect_faces_service(image_pil, logger, config)
-            
-            if faces_data is not None:
-                face_count = len(faces_data)
-                
-                # 更新人臉分佈統計
-                if face_count == 0:
-                    processing_stats["face_distribution"]["0_faces"] += 1
-                elif face_count == 1:
-                    processing_stats["face_distribution"]["1_face"] += 1
-                elif face_count == 2:
-                    processing_stats["face_distribution"]["2_faces"] += 1
-                else:
-                    processing_stats["face_distribution"]["3_plus_faces"] += 1
+    # 分批偵測並處理每個圖片文件
+    # 設定 FACE_DETECTION_DETAILS_LOG 時，處理詳情逐行寫入 JSONL 文件而不保留在記憶體中
+    details_file = open(details_log_path, 'a', encoding='utf-8') if details_log_path else None
+    try:
+        detections = _iter_face_detections(image_files, logger, config)
+        for i, (image_path, faces_data, message) in enumerate(detections, 1):
+            try:
+                logger.info(f"[FaceDetectionService] 處理 ({i}/{len(image_files)}): {os.path.basename(image_path)}")
                 
-                # 執行自動分類（如果啟用）
-                classification_info = None
-                if processing_stats["classification_enabled"]:
-                    new_path, category_name, classification_stats = classify_by_face_count(
-                        image_path, face_count, faces_data, logger, config
-                    )
+                if faces_data is not None:
+                    face_count = len(faces_data)
                     
-                    classification_info = {
-                        'new_path': new_path,
-                        'category': category_name,
-                        'stats': classification_stats
-                    }
-                    
-                    # 記錄到對應分類結果
+                    # 更新人臉分佈統計
                     if face_count == 0:
-                        classification_results["no_faces"].append(new_path)
+                        processing_stats["face_distribution"]["0_faces"] += 1
                     elif face_count == 1:
-                        classification_results["single_face"].append(new_path)
+                        processing_stats["face_distribution"]["1_face"] += 1
                     elif face_count == 2:
-                        classification_results["two_faces"].append(new_path)
+                        processing_stats["face_distribution"]["2_faces"] += 1
+                    else:
+                        processing_stats["face_distribution"]["3_plus_faces"] += 1
+                    
+                    # 執行自動分類（如果啟用）
+                    classification_info = None
+                    if classification_enabled:
+                        new_path, category_name, classification_stats = classify_by_face_count(
+                            image_path, face_count, faces_data, logger, config, name_cache
+                        )
+                        
+                        classification_info = {
+                            'new_path': new_path,
+                            'category': category_name,
+                            'stats': classification_stats
+                        }
+                        
+                        # 記錄到對應分類結果
+                        if face_count == 0:
+                            classification_results["no_faces"].append(new_path)
+                        elif face_count == 1:
+                            classification_results["single_face"].append(new_path)
+                        elif face_count == 2:
+                            classification_results["two_faces"].append(new_path)
+                        else:
+                            classification_results["multiple_faces"].append(new_path)
+                    
+                    # 記錄處理詳情
+                    processing_detail = ProcessingDetail(image_path, face_count, faces_data, classification_info, message)
+                    if details_file is not None:
+                        details_file.write(json.dumps(processing_detail._asdict(), ensure_ascii=False, default=str) + "\n")
                     else:
-                        classification_results["multiple_faces"].append(new_path)
+                        processing_stats["processing_details"].append(processing_detail)
+                    
+                    processing_stats["successful"] += 1
+                    logger.info(f"[FaceDetectionService] ✓ {os.path.basename(image_path)}: "
+                               f"{face_count} 個人臉" + 
+                               (f" -> {classification_info['category']}" if classification_info else ""))
+                else:
+                    processing_stats["failed"] += 1
+                    logger.error(f"[FaceDetectionService] ✗ 處理失敗: {os.path.basename(image_path)} - {message}")
                 
-                # 記錄處理詳情
-                processing_detail = {
-                    'original_path': image_path,
-                    'face_count': face_count,
-                    'faces_data': faces_data,
-                    'classification': classification_info,
-                    'message': message
-                }
-                processing_stats["processing_details"].append(processing_detail)
+                processing_stats["processed"] += 1
                 
-                processing_stats["successful"] += 1
-                logger.info(f"[FaceDetectionService] ✓ {os.path.basename(image_path)}: "
-                           f"{face_count} 個人臉" + 
-                           (f" -> {classification_info['category']}" if classification_info else ""))
-            else:
+            except Exception as e:
                 processing_stats["failed"] += 1
-                logger.error(f"[FaceDetectionService] ✗ 處理失敗: {os.path.basename(image_path)}")
-            
-            processing_stats["processed"] += 1
-            image_pil.close()
-            
-        except Exception as e:
-            processing_stats["failed"] += 1
-            processing_stats["processed"] += 1
-            logger.error(f"[FaceDetectionService] ✗ 處理錯誤 {os.path.basename(image_path)}: {e}")
+                processing_stats["processed"] += 1
+                logger.error(f"[FaceDetectionService] ✗ 處理錯誤 {os.path.basename(image_path)}: {e}")
+    
+    finally:
+        if details_file is not None:
+            details_file.close()
     
     # 生成處理摘要
     success_rate = (processing_stats["successful"] / processing_stats["total_files"]) * 100
@@ -2,25 +2,160 @@
 FileService for handling file-related operations such as preparing previews,
 saving processed images, and handling input paths.
 """
+import io
 import os
 from PIL import Image
 import tempfile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse
 import binascii # Added for random name generation
+import itertools
+import mimetypes
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from config.settings import GRADIO_TEMP_DIR # Assuming GRADIO_TEMP_DIR is defined in settings
+from config import settings
 from utils.logger_config import setup_logging # Changed get_logger to setup_logging
 
 logger = setup_logging(__name__, 'logs') # Assuming 'logs' is the desired log directory for this service
 
+# Extensions Gradio can display directly without re-encoding
+_PREVIEW_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp'})
+
+# ASCII characters not allowed in saved filenames, mapped to None so str.translate drops them in C
+_UNSAFE_ASCII_TABLE = {i: None for i in range(128) if not (chr(i).isalnum() or chr(i) in ' ._')}
+
+# Schemes treated as remote inputs (tuple for str.startswith)
+_URL_PREFIXES = ('http://', 'https://', 'ftp://', 's3://')
+
+# Image files picked up when a directory is given as input (tuple for str.endswith)
+_INPUT_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.avif')
+
+# Content-Type -> temp file extension for downloaded images
+_MIME_EXT = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/avif': '.avif',
+    'image/bmp': '.bmp',
+    'image/tiff': '.tiff',
+}
+_URL_IMAGE_EXTENSIONS = frozenset(_MIME_EXT.values()) | {'.jpeg', '.tif'}
+
+def _download_extension(url, content_type):
+    """Picks a file extension for a downloaded image from the URL suffix, then the Content-Type header."""
+    url_ext = os.path.splitext(urlparse(url).path)[1].lower()
+    if url_ext in _URL_IMAGE_EXTENSIONS:
+        return url_ext
+    mime = content_type.split(';', 1)[0].strip().lower() if content_type else ''
+    extension = _MIME_EXT.get(mime)
+    if extension is None and mime.startswith('image/'):
+        extension = mimetypes.guess_extension(mime)
+    return extension or '.jpg' # default
+
+def _sanitize_filename_base(base):
+    """Keeps only alphanumerics, spaces, dots and underscores in a filename base."""
+    if base.isascii():
+        return base.translate(_UNSAFE_ASCII_TABLE).rstrip()
+    return "".join(c for c in base if c.isalnum() or c in (' ', '.', '_')).rstrip()
+
+def _is_unloaded_image(image):
+    """True for an image from Image.open whose pixel data has not been loaded (so it cannot have been modified)."""
+    # Older Pillow stores the pixel core in .im, newer versions in ._im (.im is then a property that asserts it is set)
+    pixels = image.__dict__.get('_im', image.__dict__.get('im'))
+    return pixels is None and getattr(image, 'fp', None) is not None
+
+def _tmpfs_preview_dir():
+    """Returns a preview directory on /dev/shm if it is usable and has enough free space, else None."""
+    if not sys.platform.startswith('linux') or not os.access('/dev/shm', os.W_OK):
+        return None
+    try:
+        if shutil.disk_usage('/dev/shm').free < getattr(settings, 'PREVIEW_TMPFS_MIN_FREE', 512 * 1024 * 1024):
+            return None
+        preview_dir = getattr(settings, 'PREVIEW_TMPFS_DIR', os.path.join('/dev/shm', 'waifuc_previews'))
+        os.makedirs(preview_dir, exist_ok=True)
+        return preview_dir
+    except OSError as e:
+        logger.warning(f"tmpfs preview directory unavailable, using temp_dir instead: {e}")
+        return None
+
+def _sweep_stale_previews(directory, max_age, stop_event):
+    """Periodically deletes files in directory older than max_age seconds until stop_event is set."""
+    while not stop_event.wait(min(60, max_age)):
+        cutoff = time.time() - max_age
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"Could not sweep preview directory {directory}: {e}")
+
 class FileService:
-    def __init__(self, temp_dir=None):
+    def __init__(self, temp_dir=None, download_chunk_size=None, preview_format=None, use_tmpfs=None):
         self.temp_dir = temp_dir or GRADIO_TEMP_DIR
+        # None picks a fast encoder per image (WEBP with alpha, JPEG otherwise)
+        self.preview_format = preview_format
+        # Preview names only need to be unique, not unpredictable: draw randomness once per
+        # instance (guards against PID reuse across restarts) and count from there
+        self._preview_name_prefix = f"{os.getpid()}_{binascii.hexlify(os.urandom(4)).decode()}"
+        self._preview_counter = itertools.count()
+        # Output directories already confirmed to exist
+        self._known_dirs = set()
+        # output_dir -> set of filenames already present, filled by one listdir per directory
+        self._dir_contents_cache = {}
+        # Previews are transient; keep them on tmpfs instead of the data disk when possible
+        self.preview_dir = self.temp_dir
+        self._sweeper_stop = None
+        if use_tmpfs is None:
+            use_tmpfs = getattr(settings, 'PREVIEW_USE_TMPFS', False)
+        tmpfs_dir = _tmpfs_preview_dir() if use_tmpfs and temp_dir is None else None
+        if tmpfs_dir:
+            self.preview_dir = tmpfs_dir
+            self._start_preview_sweeper()
+        # Larger chunks mean fewer Python-level iterations per downloaded byte
+        self.download_chunk_size = download_chunk_size or getattr(settings, 'HTTP_DOWNLOAD_CHUNK_SIZE', 64 * 1024)
+        # Reuse TCP/TLS connections across downloads instead of reconnecting per URL
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+        )
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
         if not os.path.exists(self.temp_dir):
             os.makedirs(self.temp_dir, exist_ok=True)
         logger.info(f"FileService initialized with temp_dir: {self.temp_dir}")
 
+    def close(self):
+        """Closes the pooled HTTP session used for downloads and stops the preview sweeper."""
+        self._session.close()
+        if self._sweeper_stop is not None:
+            self._sweeper_stop.set()
+
+    def _start_preview_sweeper(self):
+        """Starts a daemon thread that deletes tmpfs previews older than PREVIEW_MAX_AGE_SECONDS, since tmpfs is RAM."""
+        max_age = getattr(settings, 'PREVIEW_MAX_AGE_SECONDS', 300)
+        self._sweeper_stop = threading.Event()
+        threading.Thread(
+            target=_sweep_stale_previews,
+            args=(self.preview_dir, max_age, self._sweeper_stop),
+            name="preview-sweeper",
+            daemon=True,
+        ).start()
+
     def prepare_preview_image(self, image_input, output_filename_prefix="preview"):
         """
         Prepares an image for preview in Gradio.
@@ -37,12 +172,17 @@ class FileService:
         """
         try:
             if isinstance(image_input, Image.Image):
-                img_format = image_input.format or 'PNG' # Default to PNG if format is not available
-                # Generate a random name for the temporary file
-                random_suffix = binascii.hexlify(os.urandom(4)).decode()
-                temp_filename = f"{output_filename_prefix}_{random_suffix}.{img_format.lower()}"
-                temp_file_path = os.path.join(self.temp_dir, temp_filename)
-                image_input.save(temp_file_path)
+                source_path = self._reusable_source_path(image_input)
+                if source_path:
+                    # Loaded from disk already; skip re-encoding and point Gradio at the original
+                    logger.debug(f"Reusing source file for preview: {source_path}")
+                    return source_path
+                image_to_save, img_format, save_kwargs = self._preview_encoding(image_input)
+                # Generate a unique name for the temporary file
+                unique_suffix = f"{self._preview_name_prefix}_{next(self._preview_counter):08x}"
+                temp_filename = f"{output_filename_prefix}_{unique_suffix}.{img_format.lower()}"
+                temp_file_path = os.path.join(self.preview_dir, temp_filename)
+                image_to_save.save(temp_file_path, format=img_format, **save_kwargs)
                 logger.debug(f"PIL Image saved to temporary preview path: {temp_file_path}")
                 return temp_file_path
             elif isinstance(image_input, str) and os.path.isfile(image_input):
@@ -57,6 +197,75 @@ class FileService:
             logger.error(f"Error preparing preview image: {e}", exc_info=True)
             return None
 
+    def _preview_encoding(self, image_input):
+        """
+        Chooses how to encode a preview: the image's own format if known, otherwise a fast lossy encoder.
+        Previews are transient, so Pillow's extra optimize pass is always disabled.
+
+        Returns:
+            tuple[Image.Image, str, dict]: Image to save (converted if needed), format name and save kwargs.
+        """
+        img_format = (self.preview_format or image_input.format or '').upper()
+        has_alpha = image_input.mode in ('RGBA', 'LA', 'PA') or (
+            image_input.mode == 'P' and 'transparency' in image_input.info)
+        if not img_format:
+            img_format = 'WEBP' if has_alpha else 'JPEG'
+        if img_format == 'JPEG':
+            if image_input.mode not in ('RGB', 'L'):
+                image_input = image_input.convert('RGB')
+            return image_input, img_format, {'quality': 85, 'optimize': False, 'progressive': False}
+        if img_format == 'WEBP':
+            if image_input.mode not in ('RGB', 'RGBA'):
+                image_input = image_input.convert('RGBA' if has_alpha else 'RGB')
+            return image_input, img_format, {'quality': 80, 'method': 4}
+        return image_input, img_format, {'optimize': False}
+
+    def _reusable_source_path(self, image_input):
+        """
+        Returns the file a PIL Image was opened from if it can be previewed as-is, else None.
+        Only lazily opened images whose pixels were never loaded qualify: an image edited in place
+        (ImageDraw, paste, thumbnail) keeps its .filename, but editing always loads the pixels first.
+        """
+        if not _is_unloaded_image(image_input):
+            return None
+        filename = getattr(image_input, 'filename', None)
+        if not filename or os.path.splitext(filename)[1].lower() not in _PREVIEW_EXTENSIONS:
+            return None
+        if not os.path.isfile(filename):
+            return None
+        abs_path = os.path.abspath(filename)
+        allowed_dirs = {self.temp_dir, self.preview_dir, *getattr(settings, 'ALLOWED_PREVIEW_PATHS', [])}
+        for allowed in allowed_dirs:
+            allowed = os.path.abspath(allowed)
+            try:
+                if os.path.commonpath([abs_path, allowed]) == allowed:
+                    return abs_path
+            except ValueError: # Different drives on Windows
+                continue
+        return None
+
+    def prepare_preview_bytes(self, image_input):
+        """
+        Encodes a PIL Image for preview entirely in memory, skipping the temp-file round trip.
+
+        Args:
+            image_input (Image.Image): PIL Image object to encode.
+
+        Returns:
+            tuple[bytes, str] | tuple[None, None]: Encoded image bytes and their MIME type, or (None, None) if invalid.
+        """
+        if not isinstance(image_input, Image.Image):
+            logger.warning(f"Invalid image input for in-memory preview: {image_input}")
+            return None, None
+        try:
+            image_to_save, img_format, save_kwargs = self._preview_encoding(image_input)
+            buffer = io.BytesIO()
+            image_to_save.save(buffer, format=img_format, **save_kwargs)
+            return buffer.getvalue(), Image.MIME.get(img_format.upper(), 'application/octet-stream')
+        except Exception as e:
+            logger.error(f"Error encoding in-memory preview image: {e}", exc_info=True)
+            return None, None
+
     def save_processed_image(self, pil_image, original_filename, output_dir):
         """
         Saves a processed PIL Image object to the specified output directory.
@@ -72,13 +281,8 @@ class FileService:
         if not isinstance(pil_image, Image.Image):
             logger.error("Invalid input: pil_image must be a PIL.Image object.")
             return None
-        if not os.path.isdir(output_dir):
-            try:
-                os.makedirs(output_dir, exist_ok=True)
-                logger.info(f"Created output directory: {output_dir}")
-            except OSError as e:
-                logger.error(f"Error creating output directory {output_dir}: {e}", exc_info=True)
-                return None
+        if output_dir not in self._known_dirs and not self._ensure_output_dir(output_dir):
+            return None
 
         base, ext = os.path.splitext(original_filename)
         # Consider adding a suffix like '_processed' or a timestamp if needed
@@ -89,63 +293,115 @@ class FileService:
             ext = f".{img_format.lower()}"
             
         # Sanitize base filename to prevent path traversal or invalid characters
-        safe_base = "".join(c for c in base if c.isalnum() or c in (' ', '.', '_')).rstrip()
+        safe_base = _sanitize_filename_base(base)
         if not safe_base: # if original filename was all special chars
             safe_base = "processed_image"
             
+        for attempt in range(2):
+            output_filename = self._unique_output_name(output_dir, safe_base, ext, refresh=attempt > 0)
+            if output_filename is None:
+                logger.error(f"Could not find a unique filename after 100 attempts for {original_filename} in {output_dir}")
+                return None
+            output_path = os.path.join(output_dir, output_filename)
+            try:
+                # 'x' mode never overwrites, even if the cached listing missed a file created elsewhere
+                with open(output_path, 'xb') as f:
+                    pil_image.save(f, format=img_format)
+            except FileExistsError:
+                continue
+            except FileNotFoundError:
+                # Directory removed since it was cached; recreate it and rescan
+                self._known_dirs.discard(output_dir)
+                if not self._ensure_output_dir(output_dir):
+                    return None
+                continue
+            except Exception as e:
+                logger.error(f"Error saving processed image to {output_path}: {e}", exc_info=True)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                return None
+            self._dir_contents_cache[output_dir].add(output_filename)
+            logger.info(f"Processed image saved to: {output_path}")
+            return output_path
+        logger.error(f"Could not find a unique filename for {original_filename} in {output_dir}")
+        return None
+
+    def _ensure_output_dir(self, output_dir):
+        """Creates output_dir if needed and remembers it, so later saves skip the check."""
+        if not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+                logger.info(f"Created output directory: {output_dir}")
+            except OSError as e:
+                logger.error(f"Error creating output directory {output_dir}: {e}", exc_info=True)
+                return False
+        self._known_dirs.add(output_dir)
+        return True
+
+    def _unique_output_name(self, output_dir, safe_base, ext, refresh=False):
+        """
+        Returns a filename in output_dir that does not exist yet, using a cached directory listing
+        instead of one stat call per candidate name. Returns None after 100 collisions.
+        """
+        existing = None if refresh else self._dir_contents_cache.get(output_dir)
+        if existing is None:
+            existing = set(os.listdir(output_dir))
+            self._dir_contents_cache[output_dir] = existing
         output_filename = f"{safe_base}{ext}"
-        output_path = os.path.join(output_dir, output_filename)
-        
         counter = 1
-        while os.path.exists(output_path): # Avoid overwriting
+        while output_filename in existing: # Avoid overwriting
             output_filename = f"{safe_base}_{counter}{ext}"
-            output_path = os.path.join(output_dir, output_filename)
             counter += 1
             if counter > 100: # Safety break
-                logger.error(f"Could not find a unique filename after 100 attempts for {original_filename} in {output_dir}")
                 return None
-
-
-        try:
-            pil_image.save(output_path)
-            logger.info(f"Processed image saved to: {output_path}")
-            return output_path
-        except Exception as e:
-            logger.error(f"Error saving processed image to {output_path}: {e}", exc_info=True)
-            return None
+        return output_filename
 
     def _is_url(self, path_or_url):
         """Checks if the given string is a URL."""
-        try:
-            result = urlparse(path_or_url)
-            return all([result.scheme, result.netloc])
-        except ValueError:
-            return False
+        # A prefix test answers this without running the full URL parser
+        return isinstance(path_or_url, str) and path_or_url[:8].lower().startswith(_URL_PREFIXES)
 
     def _download_image(self, url):
         """Downloads an image from a URL and saves it to a temporary file."""
         try:
-            response = requests.get(url, stream=True, timeout=10) # Added timeout
+            response = self._session.get(url, stream=True, timeout=10) # Added timeout
             response.raise_for_status() # Raise an exception for HTTP errors
             
             # Try to get a reasonable filename from URL or content type
-            content_type = response.headers.get('content-type')
-            extension = '.jpg' # default
-            if content_type:
-                if 'jpeg' in content_type:
-                    extension = '.jpg'
-                elif 'png' in content_type:
-                    extension = '.png'
-                elif 'gif' in content_type:
-                    extension = '.gif'
-                # Add more mimetypes as needed
-            
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension, dir=self.temp_dir)
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_file.write(chunk)
-            temp_file.close()
-            logger.info(f"Image downloaded from {url} to {temp_file.name}")
-            return temp_file.name
+            extension = _download_extension(url, response.headers.get('content-type'))
+
+            fd, temp_path = tempfile.mkstemp(suffix=extension, dir=self.temp_dir)
+            try:
+                # Let urllib3 undo gzip/deflate and copy the body in C-level chunks
+                response.raw.decode_content = True
+                with os.fdopen(fd, 'wb', buffering=0) as temp_file:
+                    shutil.copyfileobj(response.raw, temp_file, length=self.download_chunk_size)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            finally:
+                response.close() # Return the connection to the session pool
+            logger.info(f"Image downloaded from {url} to {temp_path}")
+            return temp_path
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error downloading image from {url}: {e}", exc_info=True)
+            return None
+        except Exception as e: # Catch other potential errors
+            logger.error(f"An unexpected error occurred while downloading {url}: {e}", exc_info=True)
+            return None
+    def _download_image_bytes(self, url):
+        """Downloads an image from a URL into memory and returns its bytes, without touching the disk."""
+        try:
+            response = self._session.get(url, stream=True, timeout=10)
+            response.raise_for_status()
+            buffer = io.BytesIO()
+            try:
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, buffer, length=self.download_chunk_size)
+            finally:
+                response.close() # Return the connection to the session pool
+            logger.info(f"Image downloaded from {url} into memory ({buffer.tell()} bytes)")
+            return buffer.getvalue()
         except requests.exceptions.RequestException as e:
             logger.error(f"Error downloading image from {url}: {e}", exc_info=True)
             return None
@@ -153,47 +409,87 @@ class FileService:
             logger.error(f"An unexpected error occurred while downloading {url}: {e}", exc_info=True)
             return None
 
-
-    def handle_input_path(self, input_path_or_url):
+    def handle_input_path(self, input_path_or_url, as_image=False):
         """
         Handles an input path or URL. If it's a URL, downloads the image.
-        If it's a local path, validates it.
+        If it's a local path, validates it. If it's a directory, lists the image files directly inside it.
         Returns a list of local file paths. For a single image, it's a list with one item.
-        (Future: Could be extended to handle directories)
 
         Args:
             input_path_or_url (str): Path or URL to an image.
+            as_image (bool): Return opened PIL Images instead of paths. URLs are then decoded
+                straight from memory instead of being spooled to a temporary file.
+                Directories always return paths, to avoid holding every file open.
 
         Returns:
-            list[str]: List containing the local file path, or an empty list if invalid/error.
+            list[str] | list[Image.Image]: List containing the local file path (or image), or an empty list if invalid/error.
         """
         if self._is_url(input_path_or_url):
             logger.info(f"Input is a URL: {input_path_or_url}. Attempting to download.")
+            if as_image:
+                data = self._download_image_bytes(input_path_or_url)
+                if data is None:
+                    return []
+                try:
+                    image = Image.open(io.BytesIO(data))
+                    image.load()
+                    return [image]
+                except Exception as e:
+                    logger.error(f"Downloaded data from {input_path_or_url} is not a valid image: {e}", exc_info=True)
+                    return []
             local_path = self._download_image(input_path_or_url)
             return [local_path] if local_path else []
         elif isinstance(input_path_or_url, str) and os.path.isfile(input_path_or_url):
             # Basic validation: check if it's a file.
             # More robust validation (e.g., file type, readability) could be added.
             logger.info(f"Input is a local file path: {input_path_or_url}")
+            if as_image:
+                try:
+                    return [Image.open(input_path_or_url)]
+                except Exception as e:
+                    logger.error(f"Could not open image {input_path_or_url}: {e}", exc_info=True)
+                    return []
             return [input_path_or_url]
         elif isinstance(input_path_or_url, str) and os.path.isdir(input_path_or_url):
-            # Placeholder for directory handling - currently returns empty
-            logger.warning(f"Input is a directory (not yet fully supported for individual processing): {input_path_or_url}")
-            # For now, we will return an empty list.
-            # Future: list image files in the directory.
-            # image_files = []
-            # supported_extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp']
-            # for f_name in os.listdir(input_path_or_url):
-            #     if any(f_name.lower().endswith(ext) for ext in supported_extensions):
-            #         image_files.append(os.path.join(input_path_or_url, f_name))
-            # if not image_files:
-            #    logger.warning(f"No supported image files found in directory: {input_path_or_url}")
-            # return image_files
-            return []
+            # scandir reports the entry type from the directory listing itself, so no per-file stat
+            with os.scandir(input_path_or_url) as entries:
+                image_files = sorted(
+                    entry.path for entry in entries
+                    if entry.is_file(follow_symlinks=False) and entry.name.lower().endswith(_INPUT_IMAGE_EXTENSIONS)
+                )
+            if not image_files:
+                logger.warning(f"No supported image files found in directory: {input_path_or_url}")
+            else:
+                logger.info(f"Input is a directory with {len(image_files)} image files: {input_path_or_url}")
+            return image_files
         else:
             logger.error(f"Invalid input path or URL: {input_path_or_url}")
             return []
 
+    def handle_input_paths(self, inputs_or_urls, max_workers=8):
+        """
+        Handles several input paths or URLs at once. URL downloads run concurrently
+        on a thread pool so their request latency overlaps; results keep input order.
+
+        Args:
+            inputs_or_urls (list[str]): Paths or URLs to images.
+            max_workers (int): Maximum number of concurrent downloads.
+
+        Returns:
+            list[str]: Flattened list of local file paths for every input that could be resolved.
+        """
+        inputs_or_urls = list(inputs_or_urls or [])
+        url_count = sum(1 for item in inputs_or_urls if isinstance(item, str) and self._is_url(item))
+        if url_count <= 1 or max_workers <= 1:
+            # 單一 URL 不值得啟動執行緒池
+            results = [self.handle_input_path(item) for item in inputs_or_urls]
+        else:
+            workers = min(max_workers, url_count)
+            logger.info(f"Resolving {len(inputs_or_urls)} inputs ({url_count} URLs) with {workers} download workers")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(self.handle_input_path, inputs_or_urls))
+        return [path for paths in results for path in paths]
+
 # Example Usage (for testing purposes, typically not run directly from here)
 if __name__ == '__main__':
     # Ensure config.settings.GRADIO_TEMP_DIR is usable or mock it
@@ -273,11 +569,11 @@ if __name__ == '__main__':
     else:
         print("Failed to handle local file path.")
 
-    # Test handle_input_path with a directory (expected to return empty list for now)
+    # Test handle_input_path with a directory (should list the dummy image created earlier)
     dir_paths = fs.handle_input_path(fs.temp_dir)
     print(f"Directory input paths: {dir_paths}")
-    if not dir_paths:
-        print("Directory input handled as expected (returned empty list).")
+    if dummy_image_path in dir_paths:
+        print("Directory input handled as expected.")
     else:
         print(f"Directory input failed, returned: {dir_paths}")
         
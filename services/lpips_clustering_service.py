@@ -1,14 +1,29 @@
 # services/lpips_clustering_service.py
 import os
+import queue
+import shutil
+import threading
+from collections import Counter, defaultdict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+from imgutils.data import load_image
 from imgutils.metrics import lpips_clustering
 from utils.error_handler import safe_execute
+from utils.file_utils import file_digest
 
 # Expect logger and config to be passed.
 
-def _batch_generator(lst, batch_size):
-    """Generator to batch process a list of items."""
-    for i in range(0, len(lst), batch_size):
-        yield lst[i:i + batch_size]
+def _batch_generator(items, batch_size):
+    """Generator to batch process any iterable of items (lists, generators, ...)."""
+    if isinstance(items, list) and len(items) <= batch_size:
+        # 單一批次時直接使用原列表，無需切片複製
+        if items:
+            yield items
+        return
+    it = iter(items)
+    while batch := list(islice(it, batch_size)):
+        yield batch
 
 def _safe_lpips_clustering_internal(file_paths_batch, logger, config=None):
     """
@@ -36,35 +51,220 @@ def _safe_lpips_clustering_internal(file_paths_batch, logger, config=None):
         # Re-raise the exception to be caught and handled by safe_execute
         raise # This allows safe_execute to return default_return and log the error message prefix
 
-def cluster_images_service(image_paths: list, logger, config=None):
+def _cluster_one_batch(batch_num, image_paths_batch, logger, config=None):
+    logger.info(f"[LPIPSClusteringService] Processing batch {batch_num + 1} with {len(image_paths_batch)} images.")
+    return safe_execute(
+        _safe_lpips_clustering_internal, # The function to execute
+        image_paths_batch, # First argument to _safe_lpips_clustering_internal
+        logger, # Second argument to _safe_lpips_clustering_internal
+        config, # Third argument to _safe_lpips_clustering_internal
+        logger=logger, # Logger for safe_execute itself
+        default_return=None, # Return None if this batch fails catastrophically
+        error_msg_prefix=f"[LPIPSClusteringService] Error processing LPIPS batch {batch_num + 1}"
+    )
+
+def _default_batch_workers():
+    """
+    Concurrent LPIPS batches by default: min(4, CPU cores) on CPU, but at most 2 when
+    onnxruntime can run on CUDA, since every in-flight batch holds its own activations in GPU memory.
+    """
+    workers = min(4, os.cpu_count() or 1)
+    try:
+        import onnxruntime
+        if 'CUDAExecutionProvider' in onnxruntime.get_available_providers():
+            workers = min(2, workers)
+    except ImportError:
+        pass
+    return workers
+
+# imgutils' LPIPS model resizes every input to 400x400 (BILINEAR) before feature extraction
+_LPIPS_INPUT_SIZE = 400
+
+def _load_batch_images(image_paths_batch):
+    """
+    Decodes a batch into RGB PIL images for lpips_clustering, the same way its path-based input
+    is loaded (load_image with mode='RGB', so transparency is composited onto white).
+    Images are already resized to the 400x400 LPIPS input here, so prefetched batches do not keep
+    full-resolution decodes in memory; lpips_clustering's own resize is then a no-op copy.
+    Files that fail to decode are passed through as paths so the batch fails the same way as before.
+    """
+    loaded = []
+    for image_path in image_paths_batch:
+        try:
+            image = load_image(image_path, mode='RGB')
+            loaded.append(image.resize((_LPIPS_INPUT_SIZE, _LPIPS_INPUT_SIZE), resample=Image.BILINEAR))
+            image.close()
+        except Exception:
+            loaded.append(image_path)
+    return loaded
+
+def _run_lpips_batches_prefetched(batches, logger, config=None):
+    """
+    Runs batches one at a time while a background thread decodes the next batch,
+    overlapping image I/O and decoding with LPIPS inference.
+    """
+    prefetched = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def _producer():
+        for batch in batches:
+            if stop.is_set():
+                return
+            try:
+                item = _load_batch_images(batch)
+            except Exception as e:
+                item = e  # Re-raised by the consumer, at the batch it belongs to
+            prefetched.put(item)
+            if isinstance(item, Exception):
+                return
+
+    loader = threading.Thread(target=_producer, name="lpips-prefetch", daemon=True)
+    loader.start()
+    try:
+        for batch_num in range(len(batches)):
+            item = prefetched.get()
+            if isinstance(item, Exception):
+                raise item
+            yield _cluster_one_batch(batch_num, item, logger, config)
+    finally:
+        # On early exit (consumer closed the generator or a batch raised), drain the queue
+        # so a producer blocked on put() can see the stop flag and finish
+        stop.set()
+        while loader.is_alive():
+            try:
+                prefetched.get_nowait()
+            except queue.Empty:
+                loader.join(0.05)
+
+def _run_lpips_batches(batches, logger, config=None):
+    """
+    Clusters each batch independently and yields the results in batch order as soon as they are available.
+    Batches share no state, so several run concurrently (onnxruntime releases the GIL during inference).
+    """
+    max_workers = getattr(config, 'LPIPS_BATCH_WORKERS', None) if config else None
+    if max_workers is None:
+        max_workers = _default_batch_workers()
+    max_workers = min(max_workers, len(batches))
+
+    if max_workers <= 1:
+        if len(batches) > 1 and getattr(config, 'LPIPS_PREFETCH_IMAGES', True):
+            yield from _run_lpips_batches_prefetched(batches, logger, config)
+        else:
+            for batch_num, batch in enumerate(batches):
+                yield _cluster_one_batch(batch_num, batch, logger, config)
+        return
+
+    logger.info(f"[LPIPSClusteringService] Clustering {len(batches)} batches with {max_workers} workers.")
+    completed = {}
+    next_batch = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_cluster_one_batch, batch_num, batch, logger, config): batch_num
+            for batch_num, batch in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            completed[futures[future]] = future.result()
+            # Cluster ID offsets depend on batch order, so hold back batches that finish early
+            while next_batch in completed:
+                yield completed.pop(next_batch)
+                next_batch += 1
+
+def _perceptual_hash(image_path, hash_size=16):
+    """
+    Difference hash (dHash) of an image: compares neighbouring pixels of a (hash_size+1)×hash_size
+    grayscale thumbnail, so re-encodes and resizes of the same picture usually hash identically.
+    """
+    with Image.open(image_path) as img:
+        img.draft('L', ((hash_size + 1) * 4, hash_size * 4))  # JPEG 以縮小模式解碼
+        thumbnail = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = thumbnail.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(offset, offset + hash_size):
+            bits = (bits << 1) | (pixels[col] < pixels[col + 1])
+    return bits
+
+def _dedupe_image_paths(image_paths, logger, config=None):
+    """
+    Removes repeated inputs before clustering.
+    Identical path strings are collapsed; paths resolving to the same file (symlinks), with identical
+    content when LPIPS_DEDUP_BY_CONTENT is enabled, or with identical perceptual hashes when
+    LPIPS_DEDUP_BY_PHASH is enabled, are clustered once through a representative.
+
+    Returns:
+        tuple[list, dict]: Paths to cluster, and representative path -> other paths sharing its result.
+    """
+    unique_inputs = list(dict.fromkeys(image_paths))
+    keys = [os.path.realpath(path) for path in unique_inputs]
+    if getattr(config, 'LPIPS_DEDUP_BY_CONTENT', False):
+        def _content_key(path_and_key):
+            try:
+                return file_digest(path_and_key[0])
+            except OSError:
+                return path_and_key[1]
+        with ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4)) as executor:
+            keys = list(executor.map(_content_key, zip(unique_inputs, keys)))
+    if getattr(config, 'LPIPS_DEDUP_BY_PHASH', False):
+        # 感知雜湊完全相同的圖片 (重新編碼、縮放過的同一張圖) 直接視為重複，不必再跑 LPIPS
+        def _phash_key(path_and_key):
+            try:
+                return ('phash', _perceptual_hash(path_and_key[0]))
+            except Exception:
+                return path_and_key[1]
+        with ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4)) as executor:
+            keys = list(executor.map(_phash_key, zip(unique_inputs, keys)))
+
+    representatives = {}
+    aliases = {}
+    unique_paths = []
+    for path, key in zip(unique_inputs, keys):
+        representative = representatives.setdefault(key, path)
+        if representative is path:
+            unique_paths.append(path)
+        else:
+            aliases.setdefault(representative, []).append(path)
+
+    if len(unique_paths) < len(image_paths):
+        logger.info(
+            f"[LPIPSClusteringService] Deduplicated inputs: {len(image_paths)} -> {len(unique_paths)} "
+            f"({1 - len(unique_paths) / len(image_paths):.1%} fewer images to compare)."
+        )
+    return unique_paths, aliases
+
+def cluster_images_iter(image_paths: list, logger, config=None):
+    """
+    Clusters images with LPIPS and yields (file_path, cluster_id) tuples batch by batch,
+    so callers that act on each assignment never hold the full result list.
+    """
     logger.info(f"[LPIPSClusteringService] Starting LPIPS clustering for {len(image_paths)} images.")
 
-    if not image_paths:
-        logger.warning("[LPIPSClusteringService] No image paths provided for clustering.")
-        return [], "No images to cluster."
+    # LPIPS 成本隨圖片數平方成長，先去除重複輸入，結果再展開回所有路徑
+    image_paths, duplicate_aliases = _dedupe_image_paths(image_paths, logger, config)
 
-    # Default batch size, can be overridden by config if provided
-    batch_size = 100 
-    if config and hasattr(config, 'LPIPS_BATCH_SIZE') and isinstance(config.LPIPS_BATCH_SIZE, int):
-        batch_size = config.LPIPS_BATCH_SIZE
-        logger.info(f"[LPIPSClusteringService] Using batch size from config: {batch_size}")
+    # LPIPS 聚類需要完整的 N×N 距離矩陣，分批會遺失批次間的相似度，
+    # 因此在數量允許時一次送入全部圖片，由 imgutils 自行處理模型前向的批次
+    max_oneshot = getattr(config, 'LPIPS_MAX_ONESHOT', 5000) if config else 5000
+    if max_oneshot is None or len(image_paths) <= max_oneshot:
+        batch_size = len(image_paths)
+    else:
+        # Default batch size, can be overridden by config if provided
+        batch_size = 100 
+        if config and hasattr(config, 'LPIPS_BATCH_SIZE') and isinstance(config.LPIPS_BATCH_SIZE, int):
+            batch_size = config.LPIPS_BATCH_SIZE
+            logger.info(f"[LPIPSClusteringService] Using batch size from config: {batch_size}")
+        logger.warning(
+            f"[LPIPSClusteringService] {len(image_paths)} images exceed LPIPS_MAX_ONESHOT ({max_oneshot}); "
+            f"clustering in batches of {batch_size}. Duplicates across different batches will not be detected."
+        )
     
-    all_clustering_results = [] # To store (file_path, cluster_id) tuples
     processed_files_count = 0
+    cluster_id_offset = 0 # 各批次的聚類ID互相獨立，需平移以避免不同批次的聚類被合併
 
-    for batch_num, image_paths_batch in enumerate(_batch_generator(image_paths, batch_size)):
-        logger.info(f"[LPIPSClusteringService] Processing batch {batch_num + 1} with {len(image_paths_batch)} images.")
-        
-        batch_cluster_ids = safe_execute(
-            _safe_lpips_clustering_internal, # The function to execute
-            image_paths_batch, # First argument to _safe_lpips_clustering_internal
-            logger, # Second argument to _safe_lpips_clustering_internal
-            config, # Third argument to _safe_lpips_clustering_internal
-            logger=logger, # Logger for safe_execute itself
-            default_return=None, # Return None if this batch fails catastrophically
-            error_msg_prefix=f"[LPIPSClusteringService] Error processing LPIPS batch {batch_num + 1}"
-        )
+    batches = list(_batch_generator(image_paths, batch_size))
+    batch_results = _run_lpips_batches(batches, logger, config)
 
+    for batch_num, (image_paths_batch, batch_cluster_ids) in enumerate(zip(batches, batch_results)):
         if batch_cluster_ids is None:
             logger.error(f"[LPIPSClusteringService] Failed to process batch {batch_num + 1}. Skipping.")
             # We could add placeholders or error markers for these files if needed
@@ -80,59 +280,122 @@ def cluster_images_service(image_paths: list, logger, config=None):
             processed_files_count += len(image_paths_batch)
             continue
 
+        batch_max_id = -1
+        batch_assignments = []
         for file_path, cluster_id in zip(image_paths_batch, batch_cluster_ids):
-            all_clustering_results.append((file_path, cluster_id))
+            if cluster_id != -1:
+                batch_max_id = max(batch_max_id, cluster_id)
+                cluster_id += cluster_id_offset
+            batch_assignments.append((file_path, cluster_id))
+        cluster_id_offset += batch_max_id + 1
+
+        for file_path, cluster_id in batch_assignments:
+            duplicates = duplicate_aliases.get(file_path)
+            if duplicates and cluster_id == -1:
+                # 內容相同的圖片即使被判為噪音，也彼此組成一個聚類
+                cluster_id = cluster_id_offset
+                cluster_id_offset += 1
+            yield file_path, cluster_id
+            if duplicates:
+                for duplicate in duplicates:
+                    yield duplicate, cluster_id
         
         processed_files_count += len(image_paths_batch)
         logger.info(f"[LPIPSClusteringService] Finished batch {batch_num + 1}. Total processed so far: {processed_files_count}")
 
     logger.info(f"[LPIPSClusteringService] LPIPS clustering completed for {processed_files_count} images.")
+
+def _log_cluster_distribution(cluster_counts, logger):
+    """
+    記錄聚類分佈，並在全部為噪音點或沒有形成聚類時提出警告
+    """
+    if not cluster_counts:
+        return
+
+    logger.info(f"[LPIPSClusteringService] Cluster distribution: {dict(cluster_counts)}")
+    
+    # Count noise points (cluster_id = -1)
+    noise_count = cluster_counts.get(-1, 0)
+    actual_clusters = len([cid for cid in cluster_counts.keys() if cid != -1])
+    
+    if noise_count == sum(cluster_counts.values()):
+        logger.warning("[LPIPSClusteringService] All images classified as noise. Consider lowering threshold.")
+    elif actual_clusters == 0:
+        logger.warning("[LPIPSClusteringService] No clusters formed. Images too dissimilar or threshold too low.")
+    else:
+        logger.info(f"[LPIPSClusteringService] Formed {actual_clusters} clusters with {noise_count} noise points.")
+
+def _count_assignments(assignments, cluster_counts):
+    """
+    邊傳遞 (file_path, cluster_id) 邊累計各聚類的數量，不保留完整結果列表
+    """
+    for file_path, cluster_id in assignments:
+        cluster_counts[cluster_id] += 1
+        yield file_path, cluster_id
+
+def cluster_images_service(image_paths: list, logger, config=None):
+    if not image_paths:
+        logger.warning("[LPIPSClusteringService] No image paths provided for clustering.")
+        return [], "No images to cluster."
+
+    all_clustering_results = list(cluster_images_iter(image_paths, logger, config)) # (file_path, cluster_id) tuples
     logger.info(f"[LPIPSClusteringService] Generated {len(all_clustering_results)} cluster assignments.")
 
     # Analyze clustering results
-    cluster_counts = {}
-    for file_path, cluster_id in all_clustering_results:
-        cluster_counts[cluster_id] = cluster_counts.get(cluster_id, 0) + 1
-    
-    if cluster_counts:
-        logger.info(f"[LPIPSClusteringService] Cluster distribution: {cluster_counts}")
-        
-        # Count noise points (cluster_id = -1)
-        noise_count = cluster_counts.get(-1, 0)
-        actual_clusters = len([cid for cid in cluster_counts.keys() if cid != -1])
-        
-        if noise_count == len(all_clustering_results):
-            logger.warning("[LPIPSClusteringService] All images classified as noise. Consider lowering threshold.")
-        elif actual_clusters == 0:
-            logger.warning("[LPIPSClusteringService] No clusters formed. Images too dissimilar or threshold too low.")
-        else:
-            logger.info(f"[LPIPSClusteringService] Formed {actual_clusters} clusters with {noise_count} noise points.")
+    _log_cluster_distribution(Counter(cluster_id for _, cluster_id in all_clustering_results), logger)
 
     # The service now returns a list of tuples: (file_path, cluster_id)
     # The orchestrator or a subsequent step would be responsible for any file operations (like moving to folders)
     # based on these results.
-    return all_clustering_results, f"LPIPS clustering complete. Processed {processed_files_count} images. Found {len(all_clustering_results)} assignments."
+    return all_clustering_results, f"LPIPS clustering complete. Processed {len(image_paths)} images. Found {len(all_clustering_results)} assignments."
+
+def _scan_file_sizes(image_paths, logger):
+    """
+    依目錄分組，每個目錄只執行一次 os.scandir，回傳 {path: 檔案大小}
+    (Windows 上大小直接來自目錄項目；其他平台只對需要的項目 stat)
+    """
+    paths_by_dir = defaultdict(set)
+    for image_path in image_paths:
+        paths_by_dir[os.path.dirname(image_path)].add(image_path)
+
+    file_sizes = {}
+    for directory, wanted in paths_by_dir.items():
+        try:
+            with os.scandir(directory or '.') as entries:
+                for entry in entries:
+                    entry_path = os.path.join(directory, entry.name)
+                    if entry_path in wanted:
+                        file_sizes[entry_path] = entry.stat().st_size
+        except OSError as e:
+            logger.warning(f"[LPIPSClusteringService] Failed to scan {directory} for file sizes: {e}")
+    return file_sizes
 
 def eliminate_duplicates_from_clusters(clustering_results, logger, config=None):
     """
     從聚類結果中淘汰重複圖片，保留每個聚類中品質最好的圖片
+    clustering_results 可以是列表，也可以是 cluster_images_iter 產生的 (file_path, cluster_id) 串流
     """
-    logger.info(f"[LPIPSClusteringService] Starting duplicate elimination from {len(clustering_results)} clustering results")
+    logger.info("[LPIPSClusteringService] Starting duplicate elimination from clustering results")
     
     # 按聚類ID分組
-    clusters = {}
+    clusters = defaultdict(list)
     noise_images = []
+    assignment_count = 0
     
     for file_path, cluster_id in clustering_results:
+        assignment_count += 1
         if cluster_id == -1:  # 噪音點
             noise_images.append(file_path)
         else:
-            if cluster_id not in clusters:
-                clusters[cluster_id] = []
             clusters[cluster_id].append(file_path)
+
+    logger.info(f"[LPIPSClusteringService] Grouped {assignment_count} clustering results into {len(clusters)} clusters and {len(noise_images)} noise images")
     
     eliminated_images = []
     kept_images = []
+
+    # 預先以 os.scandir 取得需要評分的圖片檔案大小，避免評分時逐張 getsize
+    file_sizes = _scan_file_sizes([p for paths in clusters.values() if len(paths) > 1 for p in paths], logger)
     
     # 處理每個聚類
     for cluster_id, image_paths in clusters.items():
@@ -144,7 +407,7 @@ def eliminate_duplicates_from_clusters(clustering_results, logger, config=None):
         logger.info(f"[LPIPSClusteringService] Processing cluster {cluster_id} with {len(image_paths)} images")
         
         # 評估圖片品質並選擇最佳圖片
-        best_image = select_best_image_from_cluster(image_paths, logger, config)
+        best_image = select_best_image_from_cluster(image_paths, logger, config, file_sizes)
         
         if best_image:
             kept_images.append(best_image)
@@ -172,30 +435,39 @@ def eliminate_duplicates_from_clusters(clustering_results, logger, config=None):
         'clusters_processed': len(clusters)
     }
 
-def select_best_image_from_cluster(image_paths, logger, config=None):
+def _score_image_safely(image_path, logger, file_size=None):
+    """
+    計算單張圖片的品質分數，失敗時回傳 None (供執行緒池使用)
+    """
+    try:
+        return calculate_image_quality_score(image_path, logger, file_size)
+    except Exception as e:
+        logger.warning(f"[LPIPSClusteringService] Failed to evaluate {image_path}: {e}")
+        return None
+
+def select_best_image_from_cluster(image_paths, logger, config=None, file_sizes=None):
     """
     從聚類中選擇品質最好的圖片
     評估標準：文件大小、解析度、圖片清晰度等
+    file_sizes: 可選的 {path: 檔案大小}，命中時不再逐張 stat
     """
     try:
-        best_image = None
-        best_score = -1
-        
-        for image_path in image_paths:
-            try:
-                # 計算圖片品質分數
-                score = calculate_image_quality_score(image_path, logger)
-                
-                if score > best_score:
-                    best_score = score
-                    best_image = image_path
-                    
-            except Exception as e:
-                logger.warning(f"[LPIPSClusteringService] Failed to evaluate {image_path}: {e}")
-                continue
-        
-        if best_image:
-            logger.debug(f"[LPIPSClusteringService] Selected best image: {os.path.basename(best_image)} (score: {best_score:.2f})")
+        # 每張圖片的評分主要是 stat 與讀取檔頭的 I/O，以執行緒並行處理
+        max_workers = min(getattr(config, 'LPIPS_QUALITY_WORKERS', None) or 16, len(image_paths))
+        file_sizes = file_sizes or {}
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                scores = list(executor.map(lambda p: _score_image_safely(p, logger, file_sizes.get(p)), image_paths))
+        else:
+            scores = [_score_image_safely(p, logger, file_sizes.get(p)) for p in image_paths]
+
+        scored = [(p, score) for p, score in zip(image_paths, scores) if score is not None]
+        if not scored:
+            return None
+
+        # max() 在同分時保留第一張，與原本的逐一比較相同
+        best_image, best_score = max(scored, key=lambda item: item[1])
+        logger.debug(f"[LPIPSClusteringService] Selected best image: {os.path.basename(best_image)} (score: {best_score})")
         
         return best_image
         
@@ -203,45 +475,105 @@ def select_best_image_from_cluster(image_paths, logger, config=None):
         logger.error(f"[LPIPSClusteringService] Error selecting best image: {e}")
         return image_paths[0] if image_paths else None
 
-def calculate_image_quality_score(image_path, logger):
+def _split_path(image_path):
+    """
+    以 rpartition 一次切出 (目錄, 檔名, 主檔名, 副檔名)，結果與 os.path.dirname/basename/splitext 相同
+    """
+    directory, sep, filename = image_path.rpartition(os.sep)
+    if os.altsep and os.altsep in filename:
+        directory, sep, filename = image_path.rpartition(os.altsep)
+    if sep and not directory.strip(sep):
+        directory += sep  # 根目錄下的檔案，保留 "/" 與 dirname 一致
+    name, dot, ext = filename.rpartition('.')
+    if not dot or not name.strip('.'):  # 沒有副檔名或是 ".bashrc" 這類隱藏檔
+        return directory, filename, filename, ''
+    return directory, filename, name, dot + ext
+
+# 同解析度、同大小時的格式偏好，數字越大越好
+_FORMAT_RANK = {'.png': 5, '.webp': 4, '.jpg': 3, '.jpeg': 3, '.bmp': 2, '.gif': 1}
+
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}  # C4/C8/CC 不是影格標頭
+
+def _read_jpeg_size(f):
+    """
+    逐段跳過 JPEG 標記直到 SOF，只讀取每段的 4 bytes 標頭 (EXIF/ICC 區段再大也不會讀入)
+    """
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:  # 填充用的 0xFF
+            fill = f.read(1)
+            if not fill:
+                return None
+            code = fill[0]
+        if code == 0xD8 or code == 0x01 or 0xD0 <= code <= 0xD7:  # 無長度欄位的標記
+            continue
+        header = f.read(2)
+        if len(header) < 2:
+            return None
+        length = int.from_bytes(header, 'big')
+        if code in _JPEG_SOF_MARKERS:
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            return int.from_bytes(sof[3:5], 'big'), int.from_bytes(sof[1:3], 'big')
+        f.seek(length - 2, os.SEEK_CUR)
+
+def _read_image_size(image_path):
     """
-    計算圖片品質分數
+    直接從檔頭讀取圖片寬高 (JPEG/PNG/WebP/GIF/BMP)，其他格式或無法解析時才交給 PIL
+    """
+    with open(image_path, 'rb') as f:
+        head = f.read(30)
+        size = None
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            size = int.from_bytes(head[16:20], 'big'), int.from_bytes(head[20:24], 'big')
+        elif head[:3] == b'\xff\xd8\xff':
+            size = _read_jpeg_size(f)
+        elif head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+            chunk = head[12:16]
+            if chunk == b'VP8X':
+                size = int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+            elif chunk == b'VP8L' and head[20] == 0x2F:
+                bits = int.from_bytes(head[21:25], 'little')
+                size = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            elif chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+                size = int.from_bytes(head[26:28], 'little') & 0x3FFF, int.from_bytes(head[28:30], 'little') & 0x3FFF
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            size = int.from_bytes(head[6:8], 'little'), int.from_bytes(head[8:10], 'little')
+        elif head[:2] == b'BM' and len(head) >= 26:
+            size = int.from_bytes(head[18:22], 'little', signed=True), abs(int.from_bytes(head[22:26], 'little', signed=True))
+
+    if size and size[0] > 0 and size[1] > 0:
+        return size
+    with Image.open(image_path) as img:
+        return img.size
+
+def calculate_image_quality_score(image_path, logger, file_size=None):
+    """
+    計算圖片品質分數，回傳可直接比較大小的 (解析度, 文件大小, 格式排名)
+    file_size: 已知的檔案大小 (例如來自 os.scandir)，None 時才 stat
     """
     try:
-        from PIL import Image
-        import os
+        if file_size is None:
+            file_size = os.path.getsize(image_path)
         
-        # 文件大小分數 (30%)
-        file_size = os.path.getsize(image_path)
-        size_score = min(file_size / (1024 * 1024), 10) / 10  # 最多10MB給滿分
-        
-        # 解析度分數 (50%)
-        with Image.open(image_path) as img:
-            width, height = img.size
-            resolution = width * height
-            resolution_score = min(resolution / (2048 * 2048), 1)  # 4MP給滿分
-        
-        # 文件格式分數 (20%)
-        ext = os.path.splitext(image_path)[1].lower()
-        format_scores = {
-            '.png': 1.0,
-            '.jpg': 0.8,
-            '.jpeg': 0.8,
-            '.webp': 0.9,
-            '.bmp': 0.6,
-            '.gif': 0.3
-        }
-        format_score = format_scores.get(ext, 0.5)
+        # 依 (解析度, 文件大小, 格式) 的優先順序比較，聚類內只需要排序，不需要加權分數
+        width, height = _read_image_size(image_path)
+        resolution = width * height
+        _, filename, _, ext = _split_path(image_path)
+        format_rank = _FORMAT_RANK.get(ext.lower(), 0)
+        score = (resolution, file_size, format_rank)
         
-        # 總分計算
-        total_score = (size_score * 0.3 + resolution_score * 0.5 + format_score * 0.2) * 100
-        
-        logger.debug(f"[LPIPSClusteringService] Quality score for {os.path.basename(image_path)}: {total_score:.2f}")
-        return total_score
+        logger.debug(f"[LPIPSClusteringService] Quality score for {filename}: {score}")
+        return score
         
     except Exception as e:
         logger.warning(f"[LPIPSClusteringService] Failed to calculate quality score for {image_path}: {e}")
-        return 0
+        return (0, 0, 0)
 
 def move_eliminated_images(eliminated_images, logger, config=None):
     """
@@ -252,35 +584,38 @@ def move_eliminated_images(eliminated_images, logger, config=None):
     
     try:
         # 確定淘汰圖片的存放位置
-        if config and hasattr(config, 'LPIPS_ELIMINATED_DIR'):
-            eliminated_dir = config.LPIPS_ELIMINATED_DIR
-        else:
+        eliminated_dir = getattr(config, 'LPIPS_ELIMINATED_DIR', None)
+        if not eliminated_dir:
             # 在第一張圖片的目錄中創建eliminated_duplicates資料夾
-            first_image_dir = os.path.dirname(eliminated_images[0])
+            first_image_dir = _split_path(eliminated_images[0])[0]
             eliminated_dir = os.path.join(first_image_dir, 'eliminated_duplicates')
         
         os.makedirs(eliminated_dir, exist_ok=True)
         
-        moved_count = 0
-        for image_path in eliminated_images:
+        # 只列出一次目標資料夾，重名檢查在記憶體中完成
+        taken_names = set(os.listdir(eliminated_dir))
+        move_pairs = []
+        for image_path, (_, filename, name, ext) in [(p, _split_path(p)) for p in eliminated_images]:
+            # 處理重名文件
+            if filename in taken_names:
+                counter = 1
+                while f"{name}_{counter}{ext}" in taken_names:
+                    counter += 1
+                filename = f"{name}_{counter}{ext}"
+            taken_names.add(filename)
+            move_pairs.append((image_path, os.path.join(eliminated_dir, filename)))
+        
+        def _move_one(pair):
+            image_path, target_path = pair
             try:
-                filename = os.path.basename(image_path)
-                target_path = os.path.join(eliminated_dir, filename)
-                
-                # 處理重名文件
-                if os.path.exists(target_path):
-                    name, ext = os.path.splitext(filename)
-                    counter = 1
-                    while os.path.exists(target_path):
-                        target_path = os.path.join(eliminated_dir, f"{name}_{counter}{ext}")
-                        counter += 1
-                
-                import shutil
                 shutil.move(image_path, target_path)
-                moved_count += 1
-                
+                return True
             except Exception as e:
                 logger.error(f"[LPIPSClusteringService] Failed to move {image_path}: {e}")
+                return False
+        
+        with ThreadPoolExecutor(max_workers=min(8, len(move_pairs))) as executor:
+            moved_count = sum(executor.map(_move_one, move_pairs))
         
         logger.info(f"[LPIPSClusteringService] Moved {moved_count}/{len(eliminated_images)} eliminated images to {eliminated_dir}")
         
@@ -294,20 +629,28 @@ def cluster_images_service_entry(image_paths: list, logger, config=None):
     Note: This service operates on paths, not PIL images
     """
     try:
-        results, message = cluster_images_service(image_paths, logger, config)
-        
-        # 如果啟用了自動淘汰重複圖片
-        if getattr(config, 'LPIPS_AUTO_ELIMINATE_DUPLICATES', True) and results:
+        # 如果啟用了自動淘汰重複圖片，直接串接聚類結果串流，不先建立完整的結果列表
+        if getattr(config, 'LPIPS_AUTO_ELIMINATE_DUPLICATES', True) and image_paths:
             logger.info("[LPIPSClusteringService] Auto-elimination enabled, processing duplicates...")
-            elimination_results = eliminate_duplicates_from_clusters(results, logger, config)
+            cluster_counts = Counter()
+            elimination_results = eliminate_duplicates_from_clusters(
+                _count_assignments(cluster_images_iter(image_paths, logger, config), cluster_counts),
+                logger,
+                config
+            )
+            assignment_count = sum(cluster_counts.values())
+            if not assignment_count:
+                return [], f"LPIPS clustering complete. Processed {len(image_paths)} images. Found 0 assignments."
+            _log_cluster_distribution(cluster_counts, logger)
             
             # 更新返回消息
+            message = f"LPIPS clustering complete. Processed {len(image_paths)} images. Found {assignment_count} assignments."
             elimination_summary = f"Kept {len(elimination_results['kept_images'])} images, eliminated {len(elimination_results['eliminated_images'])} duplicates"
-            message = f"{message}. {elimination_summary}"
+            message = f"{message} {elimination_summary}"
             
             return elimination_results, message
         
-        return results, message
+        return cluster_images_service(image_paths, logger, config)
     except Exception as e:
         logger.error(f"[LPIPSClusteringService] Error in cluster_images_service_entry: {e}")
         return [], f"Clustering error: {str(e)}"
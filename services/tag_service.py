@@ -1,227 +1,784 @@
 # services/tag_service.py
+import hashlib
+import json
 import os
-import tempfile
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import numpy as np
 from PIL import Image
-from imgutils.tagging import get_wd14_tags, tags_to_text
+from huggingface_hub import hf_hub_download
+from imgutils.tagging.wd14 import MODEL_NAMES, _get_wd14_labels
+from imgutils.utils import get_onnx_provider
+from onnxruntime import GraphOptimizationLevel, InferenceSession, SessionOptions
 
 from config import settings as default_settings # Import default settings
 from utils.error_handler import safe_execute, ImageProcessingError, ModelError
+from utils.file_utils import file_digest, scan_directory_for_images
 
 # Logger will be passed from orchestrator or individual script
 
-def _process_tags_with_config(rating, features, chars, config, logger):
+# 常駐的 WD14 ONNX session，首次標記時載入，之後所有呼叫共用 (模型或 provider 變更時才重新載入)
+_tagger_state = {"tagger": None}
+_tagger_lock = threading.Lock()
+
+# 感知雜湊快取：{標籤設定: OrderedDict(dHash -> (rating, features, chars))}，只在 TAG_ENABLE_PHASH_CACHE 時使用
+_phash_cache = {}
+_phash_cache_lock = threading.Lock()
+_PHASH_CACHE_SIZE = 1024
+
+# IO binding 推論時每個執行緒各自重複使用的預測輸出緩衝區 (依形狀)，模型直接寫入，不必再複製回主機
+_prediction_buffers = threading.local()
+
+
+# 輸出時固定排在最前面的標籤 (依此順序)
+_PRIORITY_KEYWORDS = ("1girl", "1boy", "2girls", "multiple girls", "multiple boys", "solo")
+_PRIORITY_KEYWORD_SET = frozenset(_PRIORITY_KEYWORDS)
+
+# 與 imgutils tags_to_text 相同的跳脫規則 (\ ( ) 前加上反斜線)
+_TAG_ESCAPE_RE = re.compile(r'([\\()])')
+
+# 批量標記時掃描的圖片副檔名
+_SUPPORTED_FORMATS = frozenset({'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp'})
+
+
+def _download_tagger_model(model_name):
+    """Local path of the original WD14 ONNX model (downloaded from the hub on first use)."""
+    return hf_hub_download(
+        repo_id='deepghs/wd14_tagger_with_embeddings',
+        filename=f'{MODEL_NAMES[model_name]}/model.onnx',
+    )
+
+
+def _quantized_model_path(quantized_dir, model_name):
+    """Path of the INT8 copy of a model inside TAG_QUANTIZED_MODEL_DIR."""
+    return os.path.join(quantized_dir, f"{model_name}.int8.onnx")
+
+
+def quantize_tagger_model(model_name, output_dir, logger):
+    """
+    One-off export of a dynamically INT8-quantized copy of a WD14 model into output_dir,
+    where TAG_QUANTIZED_MODEL_DIR picks it up for CPU inference.
+    Requires the onnx package for onnxruntime.quantization.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = _quantized_model_path(output_dir, model_name)
+    logger.info(f"[TagService] Quantizing WD14 tagger model {model_name} to {output_path}.")
+    quantize_dynamic(model_input=_download_tagger_model(model_name), model_output=output_path,
+                     weight_type=QuantType.QInt8)
+    return output_path
+
+
+def _resolve_tagger_provider(provider):
+    """ONNX Runtime provider name for the configured TAG_ONNX_PROVIDER."""
+    # 與 open_onnx_model 相同：未指定 provider 時參考 ONNX_MODE 環境變數
+    return get_onnx_provider(provider or os.environ.get('ONNX_MODE', None))
+
+
+def _uses_quantized_model(tag_config):
+    """True when the tagger session for tag_config runs the INT8 model (CPU provider and the quantized file exists)."""
+    quantized_dir = tag_config.quantized_model_dir
+    return bool(quantized_dir) \
+        and _resolve_tagger_provider(tag_config.provider) == "CPUExecutionProvider" \
+        and os.path.exists(_quantized_model_path(quantized_dir, tag_config.model_name))
+
+
+def _open_tagger_session(model_path, provider, device_id, logger, quantized_path=None):
+    """
+    Open the WD14 ONNX session with the same options as imgutils' open_onnx_model,
+    pinning the GPU to device_id when running on CUDA.
+    On CPU the INT8 model at quantized_path is used instead when it exists.
+    Falls back to a CPU session if the accelerated provider cannot be created.
+    """
+    # INT8 權重只在 CPU 上有加速效果 (CUDA provider 多數量化運算子會退回 CPU)
+    cpu_model_path = quantized_path if quantized_path and os.path.exists(quantized_path) else model_path
+    onnx_provider = _resolve_tagger_provider(provider)
+    options = SessionOptions()
+    options.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+    if onnx_provider == "CPUExecutionProvider":
+        options.intra_op_num_threads = os.cpu_count()
+        providers = ["CPUExecutionProvider"]
+        model_path = cpu_model_path
+    elif onnx_provider == "CUDAExecutionProvider":
+        # 明確指定 GPU，CUDA 無法初始化時 onnxruntime 會退回 CPU
+        # HEURISTIC 讓 cuDNN 不必對每個新的批次形狀 (例如最後一批不足 batch_size) 重新進行耗時的演算法搜尋
+        providers = [
+            ("CUDAExecutionProvider", {"device_id": device_id, "cudnn_conv_algo_search": "HEURISTIC"}),
+            "CPUExecutionProvider",
+        ]
+    else:
+        providers = [onnx_provider, "CPUExecutionProvider"]
+    try:
+        return InferenceSession(model_path, options, providers=providers)
+    except Exception as e:
+        if onnx_provider == "CPUExecutionProvider":
+            raise
+        logger.warning(f"[TagService] Failed to create {onnx_provider} session, falling back to CPU: {e}")
+        options.intra_op_num_threads = os.cpu_count()
+        # 退回 CPU 時仍使用原始模型，標記結果 (與標籤快取的指紋) 維持設定的 provider 所對應的版本
+        return InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+
+def _get_tagger(tag_config, logger):
+    """
+    Return the cached tagger (session, I/O names, input size and label indexes),
+    loading it on first use.
+    """
+    model_name, provider, device_id = tag_config.model_name, tag_config.provider, tag_config.device_id
+    quantized_dir = tag_config.quantized_model_dir
+    key = (model_name, provider, device_id, quantized_dir)
+    tagger = _tagger_state["tagger"]
+    if tagger is not None and tagger["key"] == key:
+        return tagger
+
+    with _tagger_lock:
+        tagger = _tagger_state["tagger"]
+        if tagger is None or tagger["key"] != key:
+            logger.info(f"[TagService] Loading WD14 tagger model {model_name} (provider: {provider or 'auto'}).")
+            try:
+                quantized_path = _quantized_model_path(quantized_dir, model_name) if quantized_dir else None
+                session = _open_tagger_session(_download_tagger_model(model_name), provider, device_id, logger,
+                                               quantized_path)
+                tag_names, rating_indexes, general_indexes, character_indexes = _get_wd14_labels(model_name)
+            except Exception as e:
+                raise ModelError(f"Failed to load WD14 Tagger model ({model_name}): {str(e)}", model_name) from e
+
+            model_input = session.get_inputs()[0]
+            model_output = session.get_outputs()[0]
+            label_count = model_output.shape[-1] if model_output.shape else None
+            if not isinstance(label_count, int):
+                label_count = len(tag_names)
+            batch_dim = model_input.shape[0]
+            # 整份狀態一次替換，其他執行緒不會讀到新舊混合的內容
+            active_provider = session.get_providers()[0]
+            logger.info(f"[TagService] WD14 tagger running on {active_provider}.")
+            tagger = {
+                "key": key,
+                "session": session,
+                # 在 GPU 等裝置上以 IO binding 只取回需要的預測輸出，embedding 留在裝置上
+                "use_io_binding": active_provider != "CPUExecutionProvider",
+                "input_name": model_input.name,
+                "output_names": [output.name for output in session.get_outputs()],
+                # float32 預測輸出可直接綁定到預先配置的 numpy 緩衝區
+                "prediction_width": label_count if model_output.type == 'tensor(float)' else None,
+                "target_size": model_input.shape[1],  # NHWC
+                # 部分匯出的模型 batch 維度固定，此時每次推論最多只能送入該數量
+                "max_batch": batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None,
+                "tag_names": np.asarray(tag_names, dtype=object),
+                "rating_indexes": np.asarray(rating_indexes, dtype=np.intp),
+                "rating_names": [tag_names[i] for i in rating_indexes],
+                "general_indexes": np.asarray(general_indexes, dtype=np.intp),
+                "character_indexes": np.asarray(character_indexes, dtype=np.intp),
+                # 依 TAG_EXCLUDED_TAGS 過濾後的通用標籤索引 (以排除集合為 key 快取)
+                "general_index_cache": {},
+            }
+            _tagger_state["tagger"] = tagger
+    return tagger
+
+
+def _fit_tagger_image(image, target_size):
+    """
+    Convert an image to RGB (RGBA if it has transparency) and scale it so its longer
+    side is target_size. Returns (image, has_alpha); the input is returned as-is when
+    nothing changes, so fitting an already fitted image is a no-op.
+    """
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    target_mode = 'RGBA' if has_alpha else 'RGB'
+    if image.mode != target_mode:
+        image = image.convert(target_mode)
+
+    width, height = image.size
+    scale = target_size / max(width, height)
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if new_size != image.size:
+        # reducing_gap 先以整數倍縮小再做 bicubic，大圖縮小時快很多且畫質幾乎無差異
+        image = image.resize(new_size, Image.BICUBIC, reducing_gap=3.0)
+    return image, has_alpha
+
+
+def _prepare_tagger_input(image, target_size, out):
+    """
+    Letterbox an image onto a white target_size square and write it into `out`
+    (a float32 HWC view of the batch buffer) in the BGR order WD14 expects.
+    The image is scaled before padding, so the white border is never resampled.
+    """
+    image, has_alpha = _fit_tagger_image(image, target_size)
+    new_size = image.size
+
+    canvas = Image.new('RGB', (target_size, target_size), (255, 255, 255))
+    offset = ((target_size - new_size[0]) // 2, (target_size - new_size[1]) // 2)
+    canvas.paste(image, offset, mask=image if has_alpha else None)
+
+    # uint8 RGB -> float32 BGR 直接寫入批次緩衝區，不產生中間陣列
+    out[...] = np.asarray(canvas)[:, :, ::-1]
+
+
+def _threshold_tags(tagger, preds, indexes, threshold):
+    """
+    Threshold a whole (N, num_tags) prediction batch at once and return one
+    {tag_name: probability} dict per row, for the labels in `indexes` above `threshold`.
+    """
+    if not len(preds):
+        return []
+    probs = preds[:, indexes]
+    # np.nonzero 依列優先順序回傳，同一張圖片的結果連續且維持標籤索引順序
+    rows, cols = np.nonzero(probs > threshold)
+    names = tagger["tag_names"][indexes[cols]].tolist()
+    values = probs[rows, cols].tolist()
+    bounds = [0, *np.searchsorted(rows, np.arange(1, len(preds))).tolist(), len(rows)]
+    return [dict(zip(names[start:end], values[start:end])) for start, end in zip(bounds, bounds[1:])]
+
+
+def _general_indexes(tagger, excluded_tags):
+    """
+    Return the general label indexes with the excluded tags removed, so excluded labels
+    are dropped by the vectorised threshold instead of per tag in Python.
+    """
+    cache = tagger["general_index_cache"]
+    indexes = cache.get(excluded_tags)
+    if indexes is None:
+        indexes = tagger["general_indexes"]
+        if excluded_tags:
+            names = np.char.lower(tagger["tag_names"][indexes].astype(str))
+            indexes = indexes[~np.isin(names, list(excluded_tags))]
+        if len(cache) >= 8:
+            cache.clear()  # 排除清單在 UI 中反覆修改時避免無限累積
+        cache[excluded_tags] = indexes
+    return indexes
+
+
+def _image_dhash(image, hash_size=8):
+    """
+    64-bit difference hash of an in-memory image: compares neighbouring pixels of a
+    (hash_size+1)×hash_size grayscale thumbnail, so resizes and re-encodes usually hash identically.
+    """
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    thumbnail = image.resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0).convert('L')
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), 'big')
+
+
+def _lookup_phash(tag_config, image_hash):
+    """Return the cached raw (rating, features, chars) of a near-identical image, or None."""
+    max_distance = tag_config.phash_max_distance
+    with _phash_cache_lock:
+        entries = _phash_cache.get(tag_config)
+        if not entries:
+            return None
+        raw = entries.get(image_hash)
+        if raw is None:
+            # 找不到完全相同的雜湊時，接受漢明距離在 TAG_PHASH_MAX_DISTANCE 以內的圖片
+            image_hash, raw = next(((cached_hash, cached_raw) for cached_hash, cached_raw in entries.items()
+                                    if (cached_hash ^ image_hash).bit_count() <= max_distance), (None, None))
+        if raw is not None:
+            entries.move_to_end(image_hash)
+        return raw
+
+
+def _store_phash(tag_config, image_hash, raw):
+    """Remember the raw tagger output of an image, evicting the least recently used entries."""
+    with _phash_cache_lock:
+        entries = _phash_cache.get(tag_config)
+        if entries is None:
+            if len(_phash_cache) >= 4:
+                _phash_cache.clear()  # 設定變更時舊設定的快取不再使用
+            entries = _phash_cache[tag_config] = OrderedDict()
+        entries[image_hash] = raw
+        entries.move_to_end(image_hash)
+        if len(entries) > _PHASH_CACHE_SIZE:
+            entries.popitem(last=False)
+
+
+def _prepare_tagger_batch(images, target_size):
+    """
+    Preprocess a list of images into one float32 (N, H, W, 3) batch for the WD14 session.
+    """
+    batch = np.empty((len(images), target_size, target_size, 3), dtype=np.float32)
+    for image, out in zip(images, batch):
+        _prepare_tagger_input(image, target_size, out)
+    return batch
+
+
+def _prefetch_tagger_batches(image_chunks, target_size):
+    """
+    Yields preprocessed batches in order while a background thread prepares the next ones,
+    so CPU-side decoding/resizing overlaps with inference of the current batch.
+    """
+    if len(image_chunks) <= 1:
+        for chunk in image_chunks:
+            yield _prepare_tagger_batch(chunk, target_size)
+        return
+
+    prepared = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def _producer():
+        for chunk in image_chunks:
+            if stop.is_set():
+                return
+            try:
+                item = _prepare_tagger_batch(chunk, target_size)
+            except Exception as e:
+                item = e  # 交給消費端拋出，確保錯誤對應到正確的批次
+            prepared.put(item)
+            if isinstance(item, Exception):
+                return
+
+    loader = threading.Thread(target=_producer, name="tagger-prefetch", daemon=True)
+    loader.start()
+    try:
+        for _ in image_chunks:
+            item = prepared.get()
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # 提前結束時清空佇列，讓可能卡在 put 的背景執行緒得以結束
+        stop.set()
+        while loader.is_alive():
+            try:
+                prepared.get_nowait()
+            except queue.Empty:
+                loader.join(0.05)
+
+
+def _prediction_buffer(shape):
+    """Return this thread's reusable float32 output buffer of the given shape."""
+    buffers = getattr(_prediction_buffers, 'by_shape', None)
+    if buffers is None:
+        buffers = _prediction_buffers.by_shape = {}
+    buffer = buffers.get(shape)
+    if buffer is None:
+        buffer = buffers[shape] = np.empty(shape, dtype=np.float32)
+    return buffer
+
+
+def _infer_tagger_batch(tagger, batch, tag_config):
+    """
+    Run one preprocessed batch through the cached WD14 session.
+    Returns one (rating, features, chars) tuple per image, like get_wd14_tags.
     """
-    Helper function to process raw tags based on configuration.
+    session = tagger["session"]
+    if tagger["use_io_binding"]:
+        # IO binding 不可跨執行緒共用，每次推論各自建立
+        binding = session.io_binding()
+        binding.bind_cpu_input(tagger["input_name"], batch)
+        if tagger["prediction_width"]:
+            preds = _prediction_buffer((len(batch), tagger["prediction_width"]))
+            binding.bind_output(tagger["output_names"][0], 'cpu', 0, np.float32, preds.shape, preds.ctypes.data)
+            session.run_with_iobinding(binding)
+        else:
+            binding.bind_output(tagger["output_names"][0])
+            session.run_with_iobinding(binding)
+            preds = binding.copy_outputs_to_cpu()[0]
+    else:
+        preds = session.run(tagger["output_names"][:1], {tagger["input_name"]: batch})[0]
+
+    general_threshold, character_threshold = tag_config.general_threshold, tag_config.character_threshold
+    rating_names = tagger["rating_names"]
+    general_indexes = _general_indexes(tagger, tag_config.excluded_tags)
+    # 整批一次完成閾值篩選，不逐張圖片在 Python 中處理
+    preds = preds.astype(np.float64)
+    ratings = [dict(zip(rating_names, row)) for row in preds[:, tagger["rating_indexes"]].tolist()]
+    features = _threshold_tags(tagger, preds, general_indexes, general_threshold)
+    chars = _threshold_tags(tagger, preds, tagger["character_indexes"], character_threshold)
+    return list(zip(ratings, features, chars))
+
+
+_TagConfig = namedtuple(
+    '_TagConfig',
+    'model_name general_threshold character_threshold provider device_id quantized_model_dir batch_size '
+    'phash_max_distance custom_character_tags artist_tags excluded_tags prepend_tags append_tags wildcard_output'
+)
+
+
+def _resolve_tag_config(config):
     """
-    custom_character_tag = getattr(config, "TAG_CUSTOM_CHARACTER_TAG", default_settings.TAG_CUSTOM_CHARACTER_TAG)
+    Resolve all tagging settings once per request, so per-image processing does no getattr lookups.
+    An already resolved _TagConfig is returned as is, so callers can resolve once and pass it down.
+    """
+    if isinstance(config, _TagConfig):
+        return config
     custom_artist_name = getattr(config, "TAG_CUSTOM_ARTIST_NAME", default_settings.TAG_CUSTOM_ARTIST_NAME)
     enable_wildcard = getattr(config, "TAG_ENABLE_WILDCARD", default_settings.TAG_ENABLE_WILDCARD)
     wildcard_template = getattr(config, "TAG_WILDCARD_TEMPLATE", default_settings.TAG_WILDCARD_TEMPLATE)
-    general_threshold = getattr(config, "TAG_GENERAL_THRESHOLD", default_settings.TAG_GENERAL_THRESHOLD)
-    # character_threshold = getattr(config, "TAG_CHARACTER_THRESHOLD", default_settings.TAG_CHARACTER_THRESHOLD) # imgutils handles this internally
     excluded_tags_list = getattr(config, "TAG_EXCLUDED_TAGS", default_settings.TAG_EXCLUDED_TAGS)
-    prepend_tags_str = getattr(config, "TAG_PREPEND_TAGS", default_settings.TAG_PREPEND_TAGS)
-    append_tags_str = getattr(config, "TAG_APPEND_TAGS", default_settings.TAG_APPEND_TAGS)
 
-    parts = []
+    # Wildcard line (if enabled and artist name is present)
+    # It is returned separately from the main tags rather than appended to them.
+    wildcard_output = ""
+    if enable_wildcard and custom_artist_name:
+        wildcard_output = wildcard_template.format(artist=custom_artist_name)
 
-    # 1. Prepend tags
-    if prepend_tags_str:
-        parts.append(prepend_tags_str)
+    return _TagConfig(
+        model_name=getattr(config, "TAG_MODEL_NAME", default_settings.TAG_MODEL_NAME),
+        general_threshold=getattr(config, "TAG_GENERAL_THRESHOLD", default_settings.TAG_GENERAL_THRESHOLD),
+        character_threshold=getattr(config, "TAG_CHARACTER_THRESHOLD", default_settings.TAG_CHARACTER_THRESHOLD),
+        provider=getattr(config, "TAG_ONNX_PROVIDER", default_settings.TAG_ONNX_PROVIDER),
+        device_id=getattr(config, "TAG_DEVICE_ID", default_settings.TAG_DEVICE_ID),
+        quantized_model_dir=getattr(config, "TAG_QUANTIZED_MODEL_DIR", default_settings.TAG_QUANTIZED_MODEL_DIR),
+        batch_size=max(1, getattr(config, "TAG_BATCH_SIZE", default_settings.TAG_BATCH_SIZE) or 1),
+        phash_max_distance=(getattr(config, "TAG_PHASH_MAX_DISTANCE", default_settings.TAG_PHASH_MAX_DISTANCE)
+                            if getattr(config, "TAG_ENABLE_PHASH_CACHE", default_settings.TAG_ENABLE_PHASH_CACHE) else None),
+        # 自訂標籤字串在解析時就拆成標籤，每張圖片不必重新切割
+        custom_character_tags=tuple(_split_tag_text(
+            getattr(config, "TAG_CUSTOM_CHARACTER_TAG", default_settings.TAG_CUSTOM_CHARACTER_TAG))),
+        artist_tags=(f"by {custom_artist_name}",) if custom_artist_name else (), # Common practice to prefix with "by"
+        excluded_tags=frozenset(t.lower() for t in excluded_tags_list or ()),
+        prepend_tags=tuple(_split_tag_text(getattr(config, "TAG_PREPEND_TAGS", default_settings.TAG_PREPEND_TAGS))),
+        append_tags=tuple(_split_tag_text(getattr(config, "TAG_APPEND_TAGS", default_settings.TAG_APPEND_TAGS))),
+        wildcard_output=wildcard_output,
+    )
 
-    # 2. Character tags
-    processed_chars = []
-    if chars: # chars is a dict {'character_name': probability}
-        for char, prob in chars.items():
-            # Assuming character_threshold is applied by get_wd14_tags or we use general_threshold as a fallback if not
-            # For now, let's assume get_wd14_tags already filtered by its internal character threshold.
-            # If not, we might need to filter here, e.g., if prob >= character_threshold:
-            processed_chars.append(char.replace('_', ' ')) # Replace underscores for readability
-    
-    if processed_chars:
-        parts.append(", ".join(processed_chars))
-    elif custom_character_tag:
-        parts.append(custom_character_tag)
 
-    # 3. Artist name
-    if custom_artist_name:
-        parts.append(f"by {custom_artist_name}") # Common practice to prefix with "by"
+_TagSelection = namedtuple('_TagSelection', 'priority prepend characters artist features append wildcard')
+
+
+def _split_tag_text(text):
+    """Split a comma-separated tag string into stripped, non-empty tags."""
+    return [tag.strip() for tag in text.split(',') if tag.strip()] if text else []
+
+
+def _select_tags(features, chars, tag_config):
+    """
+    Select the tags for one image from the raw model output, without any string assembly.
+    Returns a _TagSelection whose fields are tuples of individual tags in output order.
+    """
+    # 2. Character tags
+    # chars is a dict {'character_name': probability}, already filtered by TAG_CHARACTER_THRESHOLD in _infer_tagger_batch.
+    processed_chars = [char.replace('_', ' ') for char in chars] if chars else [] # Replace underscores for readability
+    characters = processed_chars or tag_config.custom_character_tags
 
     # 4. Feature tags (general tags)
     # Filter features by general_threshold and exclude specified tags
-    filtered_features = {}
+    feature_tags = []
     if features: # features is a dict {'tag_name': probability}
+        # Build the lookup set once instead of per feature tag (excluded tags are prebuilt in _TagConfig)
+        excluded_set = tag_config.excluded_tags
+        char_set = frozenset(pt.lower() for pt in processed_chars)
+        general_threshold = tag_config.general_threshold
+        filtered_features = {}
         for tag, prob in features.items():
             tag_lower = tag.lower()
-            if prob >= general_threshold and tag_lower not in excluded_tags_list and tag_lower not in [pt.lower() for pt in processed_chars]:
+            if prob >= general_threshold and tag_lower not in excluded_set and tag_lower not in char_set:
                 filtered_features[tag.replace('_', ' ')] = prob
-    
-    if filtered_features:
-        # Sort tags by probability (optional, but can be useful)
-        # sorted_tags = sorted(filtered_features.keys(), key=lambda t: filtered_features[t], reverse=True)
-        # parts.append(", ".join(sorted_tags))
-        parts.append(tags_to_text(filtered_features)) # tags_to_text handles formatting
-
-    # 5. Append tags
-    if append_tags_str:
-        parts.append(append_tags_str)
-        
-    # Combine all parts, removing empty strings
-    final_tags_list = [part for part in parts if part]
-    text_output = ", ".join(final_tags_list).strip()
-    
+        # Same formatting as tags_to_text (ordered by probability, escaped), without joining and re-splitting
+        feature_tags = [_TAG_ESCAPE_RE.sub(r'\\\1', tag)
+                        for tag, _ in sorted(filtered_features.items(), key=lambda item: (-item[1], item[0]))]
+
+    # 1. Prepend tags / 3. Artist name / 5. Append tags are pre-split in _TagConfig
+    groups = [
+        tag_config.prepend_tags,
+        characters,
+        tag_config.artist_tags,
+        feature_tags,
+        tag_config.append_tags,
+    ]
+
     # Ensure "1girl" or "1boy" (if present) is at the beginning if they exist in character tags
     # This is a common convention for some systems.
     # More robustly, this could be a configurable "priority_tags" list.
-    priority_keywords = ["1girl", "1boy", "2girls", "multiple girls", "multiple boys", "solo"]
-    found_priority_tags = []
+    # The first occurrence of each priority keyword moves to the front, in _PRIORITY_KEYWORDS order.
+    found_priority_tags = set()
+    for index, group in enumerate(groups):
+        if _PRIORITY_KEYWORD_SET.isdisjoint(group):
+            continue  # 大多數分組不含優先標籤，以集合運算略過逐一檢查
+        kept = []
+        for tag in group:
+            if tag in _PRIORITY_KEYWORD_SET and tag not in found_priority_tags:
+                found_priority_tags.add(tag)
+            else:
+                kept.append(tag)
+        groups[index] = kept
+    priority = tuple(keyword for keyword in _PRIORITY_KEYWORDS if keyword in found_priority_tags)
 
-    # Create a temporary list of tags for manipulation
-    current_tags_set = [t.strip() for t in text_output.split(',') if t.strip()]
-    
-    for keyword in priority_keywords:
-        if keyword in current_tags_set:
-            found_priority_tags.append(keyword)
-            current_tags_set.remove(keyword) # Remove to avoid duplication
-
-    # Prepend found priority tags (if any) to the beginning
-    if found_priority_tags:
-        text_output = ", ".join(found_priority_tags + current_tags_set)
-    else:
-        text_output = ", ".join(current_tags_set)
+    return _TagSelection(priority, *(tuple(group) for group in groups), tag_config.wildcard_output)
 
 
-    # Wildcard line (if enabled and artist name is present)
-    wildcard_output = ""
-    if enable_wildcard and custom_artist_name:
-        wildcard_output = wildcard_template.format(artist=custom_artist_name)
-        # text_output += f"\\n{wildcard_output}" # Appending to main tags or returning separately?
-                                                # For now, let's return it separately.
+def _flatten_tags(selection):
+    """Flatten a _TagSelection into the final ordered list of tags."""
+    return list(chain(selection.priority, selection.prepend, selection.characters,
+                      selection.artist, selection.features, selection.append))
+
+
+def _process_tags_with_config(rating, features, chars, tag_config, logger):
+    """
+    Helper function to process raw tags based on a resolved _TagConfig.
+    Returns (tag_list, wildcard_output); the tags are only joined into text at the service boundary.
+    """
+    selection = _select_tags(features, chars, tag_config)
+    tag_list = _flatten_tags(selection)
+    wildcard_output = selection.wildcard
 
     logger.debug(f"[TagService] Rating: {rating}")
     logger.debug(f"[TagService] Raw Chars: {chars}")
     logger.debug(f"[TagService] Raw Features: {features}")
-    logger.debug(f"[TagService] Processed Text Output: {text_output}")
+    logger.debug(f"[TagService] Processed Tags: {tag_list}")
     if wildcard_output:
         logger.debug(f"[TagService] Wildcard Line: {wildcard_output}")
         
-    return text_output, wildcard_output
+    return tag_list, wildcard_output
+
 
+# 單張圖片的標記結果；標籤維持 list 形式，只在對外回傳時才組成字串
+_TagResult = namedtuple('_TagResult', 'tag_list wildcard message')
 
-def _tag_image_core_logic(image_pil, logger, config):
-    if not isinstance(image_pil, Image.Image):
-        raise ImageProcessingError("Invalid input: image_pil must be a PIL Image object.", "N/A")
 
-    model_name = getattr(config, "TAG_MODEL_NAME", default_settings.TAG_MODEL_NAME)
-    general_threshold = getattr(config, "TAG_GENERAL_THRESHOLD", default_settings.TAG_GENERAL_THRESHOLD)
-    # character_threshold = getattr(config, "TAG_CHARACTER_THRESHOLD", default_settings.TAG_CHARACTER_THRESHOLD) # For get_wd14_tags
+def _format_tag_result(result):
+    """
+    Render a _TagResult as the (tags, message) pair returned by the string-based services.
+    tag_image_service_entry returns the wildcard line as a separate field instead.
+    """
+    tags = ", ".join(result.tag_list)
+    if result.wildcard:
+        # 字串介面 (及批量輸出的標籤檔) 維持原有格式，將 wildcard 附加在標籤之後
+        tags += f" | Wildcard: {result.wildcard}"
+    return tags, result.message
+
 
-    temp_file_path = None
+def warmup_tagger(logger, config=None):
+    """
+    Load the configured tagger and run dummy batches through it (one image and a full
+    TAG_BATCH_SIZE batch), so model loading and kernel initialisation happen before the
+    first real request. Failures only log a warning; tagging reports real errors itself.
+    """
+    tag_config = _resolve_tag_config(config)
+    start_time = time.perf_counter()
     try:
-        # get_wd14_tags expects a file path. Save PIL Image to a temporary file.
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmpfile:
-            image_pil.save(tmpfile, format="PNG")
-            temp_file_path = tmpfile.name
-        
-        logger.info(f"[TagService] Image saved to temporary file: {temp_file_path} for tagging.")
+        tagger = _get_tagger(tag_config, logger)
+        if tagger.get("warmed_up"):
+            return
+        target_size = tagger["target_size"]
+        for batch_size in sorted({1, min(tag_config.batch_size, tagger["max_batch"] or tag_config.batch_size)}):
+            _infer_tagger_batch(tagger, np.zeros((batch_size, target_size, target_size, 3), dtype=np.float32), tag_config)
+        tagger["warmed_up"] = True
+    except Exception as e:
+        logger.warning(f"[TagService] WD14 tagger warm-up failed: {e}")
+        return
+    logger.info(f"[TagService] WD14 tagger warmed up ({time.perf_counter() - start_time:.2f}s)")
+
+
+def _tagger_draft_size(config, logger):
+    """
+    Input size of the configured tagger (loading it on first use), used as the JPEG draft size.
+    Returns None if the tagger cannot be loaded; tagging itself will then report the error.
+    """
+    tagger = safe_execute(
+        _get_tagger,
+        _resolve_tag_config(config),
+        logger,
+        logger=logger,
+        default_return=None,
+        error_msg_prefix="[TagService] Error loading tagger"
+    )
+    target_size = tagger["target_size"] if tagger else None
+    return target_size if isinstance(target_size, int) else None
 
-        # Call the tagging function
-        # Note: get_wd14_tags has its own thresholds (general_threshold, character_threshold)
-        # We pass general_threshold here. It also has character_threshold with a default.
-        # The model_name is crucial.
-        try:
-            # Ensure ONNXRuntime sessions are managed correctly if this is called frequently.
-            # For now, assume imgutils handles session creation/destruction or uses a global session.
-            rating, features, chars = get_wd14_tags(
-                temp_file_path,
-                model_name=model_name,
-                general_threshold=general_threshold, # This is the general threshold for feature tags
-                # character_threshold=character_threshold, # This is for character tags, imgutils has a default
-                # Other parameters like `onnx_models`, `ignore_exif_errors` can be exposed if needed.
-            )
-        except Exception as e:
-            # Catch specific ONNX/model loading errors if possible
-            error_msg = f"WD14 Tagger model ({model_name}) processing failed: {str(e)}"
-            logger.error(f"[TagService] {error_msg}", exc_info=True)
-            if ("model" in str(e).lower() or "download" in str(e).lower() or 
-                "onnx" in str(e).lower() or "cuda" in str(e).lower() or "not found" in str(e).lower()): # Added "not found"
-                raise ModelError(error_msg, model_name) from e
-            else:
-                raise ImageProcessingError(error_msg, temp_file_path) from e
 
+def _load_image_for_tagging(image_path, draft_size=None):
+    """
+    載入並完整解碼要標記的圖片 (損壞的圖片在此單獨失敗，不會拖垮整批推論)
+    JPEG 圖片以 draft 模式在解碼時直接縮小到不小於 draft_size 的尺寸，
+    接著在載入端就轉換色彩模式並縮放到模型輸入大小 (與前處理的縮放相同，
+    前處理遇到已縮放的圖片會直接略過)，因此不影響標記結果
+    """
+    image_pil = Image.open(image_path)
+    try:
+        if draft_size:
+            if image_pil.format == 'JPEG':
+                image_pil.draft('RGB', (draft_size, draft_size))
+            # 在載入執行緒中完成縮放，預先載入的圖片只佔用模型輸入大小的記憶體
+            fitted, _ = _fit_tagger_image(image_pil, draft_size)
+        else:
+            fitted = image_pil
+        fitted.load()
+    except Exception:
+        image_pil.close()
+        raise
+    if fitted is not image_pil:
+        image_pil.close()  # 原始解碼結果已不需要，提早釋放檔案控制代碼
+    return fitted
+
+
+def _as_tagger_image(image):
+    """
+    Accept a PIL image or an HWC uint8 RGB/RGBA (or HW grayscale) ndarray.
+    Arrays are wrapped in memory with Image.fromarray, never re-encoded.
+    """
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, np.ndarray) and image.dtype == np.uint8 and (
+            image.ndim == 2 or (image.ndim == 3 and image.shape[2] in (3, 4))):
+        return Image.fromarray(image)
+    raise ImageProcessingError("Invalid input: image_pil must be a PIL Image object or a uint8 image array.", "N/A")
+
+
+def _tag_images_core_logic(images, logger, config):
+    images = [_as_tagger_image(image) for image in images]
+
+    # Settings are resolved once for the whole request
+    tag_config = _resolve_tag_config(config)
+    model_name = tag_config.model_name
+    batch_size = tag_config.batch_size
+
+    # The PIL images are preprocessed in memory (alpha is composited onto white),
+    # so no PNG encode/decode round trip through a temp file is needed.
+
+    # Run the cached WD14 session; only the first call pays for model loading.
+    # Images are stacked into batches so each session.run covers up to batch_size images.
+    # The next batch is preprocessed on a background thread while the current one runs.
+    tagger = _get_tagger(tag_config, logger)
+
+    # 啟用感知雜湊快取時，與先前標記過的圖片幾乎相同 (縮放、重新編碼) 的圖片直接沿用其推論結果
+    image_hashes = None
+    cached_raw = {}
+    if tag_config.phash_max_distance is not None:
+        image_hashes = [_image_dhash(image) for image in images]
+        for index, image_hash in enumerate(image_hashes):
+            raw = _lookup_phash(tag_config, image_hash)
+            if raw is not None:
+                cached_raw[index] = raw
+        if cached_raw:
+            logger.info(f"[TagService] {len(cached_raw)} of {len(images)} image(s) reused from the perceptual hash cache.")
+    pending = [index for index in range(len(images)) if index not in cached_raw]
+
+    step = min(batch_size, tagger["max_batch"] or batch_size)
+    pending_images = [images[index] for index in pending]
+    image_chunks = [pending_images[start:start + step] for start in range(0, len(pending_images), step)]
+    inferred = []
+    try:
+        for batch in _prefetch_tagger_batches(image_chunks, tagger["target_size"]):
+            inferred.extend(_infer_tagger_batch(tagger, batch, tag_config))
+    except ModelError:
+        raise
+    except Exception as e:
+        # Catch specific ONNX/model loading errors if possible
+        error_msg = f"WD14 Tagger model ({model_name}) processing failed: {str(e)}"
+        logger.error(f"[TagService] {error_msg}", exc_info=True)
+        if ("model" in str(e).lower() or "download" in str(e).lower() or 
+            "onnx" in str(e).lower() or "cuda" in str(e).lower() or "not found" in str(e).lower()): # Added "not found"
+            raise ModelError(error_msg, model_name) from e
+        else:
+            raise ImageProcessingError(error_msg, "in-memory image") from e
+
+    if image_hashes is not None:
+        for index, raw in zip(pending, inferred):
+            _store_phash(tag_config, image_hashes[index], raw)
+    cached_raw.update(zip(pending, inferred))
+    raw_results = [cached_raw[index] for index in range(len(images))]
+
+    outputs = []
+    for rating, features, chars in raw_results:
         logger.info(f"[TagService] Raw tags obtained. Rating: {rating}, Features: {len(features)}, Chars: {len(chars)}")
 
         # Process tags with configuration (custom tags, exclusions, etc.)
-        processed_tags, wildcard_line = _process_tags_with_config(rating, features, chars, config, logger)
-        
-        final_output_tags = processed_tags
-        if wildcard_line: # If UI/orchestrator wants to handle this separately
-            # For now, append to the main tags for simplicity in service return
-            final_output_tags += f" | Wildcard: {wildcard_line}"
+        tag_list, wildcard_line = _process_tags_with_config(rating, features, chars, tag_config, logger)
 
-
-        num_tags = len(processed_tags.split(',')) if processed_tags else 0
-        msg = f"Image tagged successfully with {num_tags} tags using model {model_name}."
+        msg = f"Image tagged successfully with {len(tag_list)} tags using model {model_name}."
         logger.info(f"[TagService] {msg}")
-        return final_output_tags, msg
+        outputs.append(_TagResult(tag_list, wildcard_line, msg))
+    return outputs
 
-    finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.debug(f"[TagService] Temporary file {temp_file_path} deleted.")
-            except Exception as e:
-                logger.warning(f"[TagService] Failed to delete temporary file {temp_file_path}: {e}", exc_info=True)
 
-
-def tag_image_service(image_pil: Image.Image, logger, config=None):
+def _tag_images_results(images, logger, config=None):
     """
-    Service function to tag an image using WD14 tagger.
-    Accepts a PIL Image object.
-    Saves the PIL image to a temporary file to be processed by get_wd14_tags.
+    Tag a list of images and return one _TagResult per image.
+    Failed images get an empty tag list and a "Tagging failed" message.
     """
-    logger.info(f"[TagService] Received request to tag image.")
-    
+    logger.info(f"[TagService] Received request to tag {len(images)} image(s).")
+
     if config is None:
         config = default_settings # Fallback to default settings if no specific config is passed
         logger.info("[TagService] No specific config provided, using default settings.")
-    
+
+    if not images:
+        return []
+
     # Use safe_execute to wrap the core logic
     result_or_error = safe_execute(
-        _tag_image_core_logic,
-        image_pil,
+        _tag_images_core_logic,
+        images,
         logger,
         config,
-        default_return=(None, "Tag processing failed due to an internal error."),
+        default_return=None,
         error_msg_prefix="[TagService] Error during image tagging"
     )
 
-    if result_or_error and result_or_error != (None, "Tag processing failed due to an internal error."):
+    if result_or_error:
         return result_or_error
     else:
-        # error_msg_prefix is already included by safe_execute in result_or_error
-        logger.error(f"[TagService] Tagging failed: {result_or_error}")
-        return "", f"Tagging failed: {result_or_error}"
+        # safe_execute has already logged the underlying error; report it for every image
+        error_msg = "Tag processing failed due to an internal error."
+        logger.error(f"[TagService] Tagging failed: {error_msg}")
+        return [_TagResult([], "", f"Tagging failed: {error_msg}") for _ in images]
+
+
+def tag_images_service(images, logger, config=None):
+    """
+    Service function to tag a list of PIL images (or uint8 image arrays) using WD14 tagger.
+    Images are fed to the cached WD14 session in batches of TAG_BATCH_SIZE.
+    Returns a list of (tags, message) tuples, one per input image.
+    """
+    return [_format_tag_result(result) for result in _tag_images_results(images, logger, config)]
+
+
+def _tag_image_result(image_pil, logger, config=None, image_path=None):
+    """
+    Tag one image given as a PIL image, or as image_path when it is already on disk.
+    Returns a _TagResult.
+    """
+    if image_path and os.path.exists(image_path):
+        # 圖片已在磁碟上時直接從檔案解碼，呼叫端不必先自行載入成 PIL 物件
+        try:
+            tag_config = _resolve_tag_config(config)
+            with _load_image_for_tagging(image_path, _tagger_draft_size(tag_config, logger)) as image_file:
+                return _tag_images_results([image_file], logger, tag_config)[0]
+        except Exception as e:
+            logger.error(f"[TagService] Failed to open {image_path} for tagging: {e}")
+            if image_pil is None:
+                return _TagResult([], "", f"Tagging failed: {e}")
+    return _tag_images_results([image_pil], logger, config)[0]
 
-def save_tags_to_file(image_path, tags_string, logger, config=None):
+
+def tag_image_service(image_pil: Image.Image, logger, config=None, image_path=None):
+    """
+    Service function to tag an image using WD14 tagger.
+    Accepts a PIL Image object, or image_path when the image is already on disk.
+    The image is fed to the cached WD14 session directly from memory.
     """
-    將標籤保存到文本文件
+    return _format_tag_result(_tag_image_result(image_pil, logger, config, image_path))
+
+def save_tags_to_file(image_path, tags_string, logger, config=None, ensure_dir=True):
     """
+    將標籤保存到文本文件 (tags_string 可為字串或標籤列表)
+    ensure_dir=False 時不建立 TAG_OUTPUT_DIR (由呼叫端事先建立一次，例如批量標記)
+    """
+    if isinstance(tags_string, (list, tuple)):
+        tags_string = ", ".join(tags_string)
     try:
         # 確定標籤文件的路徑
         base_path = os.path.splitext(image_path)[0]
         tags_file_path = f"{base_path}.txt"
         
-        # 如果配置指定了標籤目錄
-        if config and hasattr(config, 'TAG_OUTPUT_DIR'):
-            tags_dir = config.TAG_OUTPUT_DIR
-            os.makedirs(tags_dir, exist_ok=True)
+        # 如果配置指定了標籤目錄 (None 表示與圖片同目錄)
+        tags_dir = getattr(config, 'TAG_OUTPUT_DIR', None)
+        if tags_dir:
+            if ensure_dir:
+                os.makedirs(tags_dir, exist_ok=True)
             filename = os.path.basename(base_path)
             tags_file_path = os.path.join(tags_dir, f"{filename}.txt")
         
-        # 寫入標籤文件
-        with open(tags_file_path, 'w', encoding='utf-8') as f:
-            f.write(tags_string)
+        # 寫入標籤文件 (一次編碼後以二進位寫入，不經過 TextIOWrapper)
+        with open(tags_file_path, 'wb') as f:
+            f.write(tags_string.encode('utf-8'))
         
         logger.info(f"[TagService] Saved tags to: {tags_file_path}")
         return tags_file_path
@@ -230,9 +787,80 @@ def save_tags_to_file(image_path, tags_string, logger, config=None):
         logger.error(f"[TagService] Failed to save tags to file: {e}")
         return None
 
+class _TagCache:
+    """
+    以 sqlite 保存的標籤快取，key 為 (標籤設定指紋, 檔案內容雜湊)
+    模型、閾值、排除或自訂標籤變更時指紋不同，舊的快取不會被誤用
+    """
+    __slots__ = ('connection', 'namespace')
+
+    def __init__(self, path, tag_config):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tags (key TEXT PRIMARY KEY, tag_list TEXT NOT NULL, wildcard TEXT NOT NULL)'
+        )
+        # provider、GPU 編號與批次大小本身不影響輸出，不列入指紋；但 INT8 模型 (只在 CPU 上載入)
+        # 與原始模型的結果不同，改以實際使用的模型版本列入指紋。排除標籤排序後才有穩定的 repr
+        relevant = tag_config._replace(provider=None, device_id=None, batch_size=None, quantized_model_dir=None,
+                                       excluded_tags=tuple(sorted(tag_config.excluded_tags)))
+        variant = "int8" if _uses_quantized_model(tag_config) else "fp32"
+        self.namespace = hashlib.blake2b(repr((relevant, variant)).encode('utf-8'), digest_size=8).hexdigest()
+
+    def key(self, digest):
+        return f"{self.namespace}:{digest}"
+
+    def get_many(self, keys):
+        """Return {key: _TagResult} for the keys found in the cache."""
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), 500):  # sqlite 單一查詢的參數數量有上限
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f'SELECT key, tag_list, wildcard FROM tags WHERE key IN ({",".join("?" * len(chunk))})', chunk
+            )
+            for key, tag_list, wildcard in rows:
+                found[key] = _TagResult(json.loads(tag_list), wildcard, "Tags loaded from cache.")
+        return found
+
+    def put(self, key, result):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO tags VALUES (?, ?, ?)',
+            (key, json.dumps(result.tag_list, ensure_ascii=False), result.wildcard)
+        )
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def _lookup_cached_tags(tag_cache, image_files, io_workers, logger):
+    """
+    Hash the files in parallel and look them up in the tag cache.
+    Returns ({path: cache key}, {path: cached _TagResult}); files that cannot be read get no key.
+    """
+    def _digest_or_none(path):
+        try:
+            return file_digest(path)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=io_workers) as executor:
+        digests = list(executor.map(_digest_or_none, image_files))
+    cache_keys = {path: tag_cache.key(digest) for path, digest in zip(image_files, digests) if digest}
+    try:
+        cached = tag_cache.get_many(cache_keys.values())
+    except sqlite3.Error as e:
+        logger.warning(f"[TagService] Tag cache lookup failed, tagging all images: {e}")
+        cached = {}
+    hits = {path: cached[key] for path, key in cache_keys.items() if key in cached}
+    return cache_keys, hits
+
+
 def tag_batch_images(input_directory, logger, config=None):
     """
     批量標記圖片
+    設定 TAG_CACHE_PATH 時，內容與標籤設定都未變的圖片直接使用快取的標籤，不重新推論
     """
     logger.info(f"[TagService] Starting batch tagging for: {input_directory}")
     
@@ -240,11 +868,7 @@ def tag_batch_images(input_directory, logger, config=None):
         return False, "Input directory not found", {}
     
     # 掃描所有圖片文件
-    image_files = []
-    for root, dirs, files in os.walk(input_directory):
-        for filename in files:
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')):
-                image_files.append(os.path.join(root, filename))
+    image_files = scan_directory_for_images(input_directory, supported_extensions=_SUPPORTED_FORMATS)
     
     if not image_files:
         return False, "No image files found", {}
@@ -257,40 +881,112 @@ def tag_batch_images(input_directory, logger, config=None):
         "tag_files_saved": []
     }
     
-    for image_path in image_files:
+    # 標籤設定在整個批量處理開始時解析一次，所有批次共用
+    tag_config = _resolve_tag_config(config)
+    batch_size = tag_config.batch_size
+    io_workers = getattr(config, 'TAG_IO_WORKERS', None) or min(8, os.cpu_count() or 1)
+
+    auto_save = getattr(config, 'TAG_AUTO_SAVE_TO_FILE', True)
+    tags_dir = getattr(config, 'TAG_OUTPUT_DIR', None)
+    if auto_save and tags_dir:
+        # 標籤目錄只建立一次，不在每張圖片保存時重複檢查
+        os.makedirs(tags_dir, exist_ok=True)
+
+    def _record_result(image_path, result):
         try:
-            logger.info(f"[TagService] Processing: {os.path.basename(image_path)}")
-            
-            # 載入圖片
-            image_pil = Image.open(image_path)
-            
-            # 生成標籤
-            tags, message = tag_image_service(image_pil, logger, config)
-            
-            if tags and isinstance(tags, str):
+            if result.tag_list or result.wildcard:
                 # 保存標籤到文件
-                if getattr(config, 'TAG_AUTO_SAVE_TO_FILE', True):
-                    tags_file_path = save_tags_to_file(image_path, tags, logger, config)
+                if auto_save:
+                    tags, _ = _format_tag_result(result)
+                    tags_file_path = save_tags_to_file(image_path, tags, logger, config, ensure_dir=False)
                     if tags_file_path:
                         results["tag_files_saved"].append(tags_file_path)
-                
+
                 # 統計標籤數量
-                tag_count = len([t.strip() for t in tags.split(',') if t.strip()])
+                tag_count = len(result.tag_list)
                 results["total_tags_generated"] += tag_count
                 results["successful_tags"] += 1
-                
+
                 logger.info(f"[TagService] Generated {tag_count} tags for {os.path.basename(image_path)}")
             else:
                 results["failed_tags"] += 1
                 logger.warning(f"[TagService] Failed to generate tags for {os.path.basename(image_path)}")
-            
+
             results["processed_files"] += 1
-            image_pil.close()
-            
+
         except Exception as e:
             results["failed_tags"] += 1
             logger.error(f"[TagService] Error processing {image_path}: {e}")
-    
+
+    tag_cache = None
+    cache_keys = {}
+    cache_path = getattr(config, 'TAG_CACHE_PATH', None)
+    if cache_path:
+        try:
+            tag_cache = _TagCache(cache_path, tag_config)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"[TagService] Tag cache unavailable at {cache_path}: {e}")
+
+    try:
+        if tag_cache is not None:
+            cache_keys, cached_results = _lookup_cached_tags(tag_cache, image_files, io_workers, logger)
+            if cached_results:
+                logger.info(f"[TagService] {len(cached_results)} of {len(image_files)} images found in tag cache.")
+                for image_path, result in cached_results.items():
+                    _record_result(image_path, result)
+                image_files = [path for path in image_files if path not in cached_results]
+
+        # 全部命中快取時不必載入模型
+        draft_size = _tagger_draft_size(tag_config, logger) if image_files else None
+        batches = [image_files[start:start + batch_size] for start in range(0, len(image_files), batch_size)]
+
+        # 每次載入 batch_size 張圖片，一次送入模型推論
+        # 圖片讀取與解碼由執行緒池預先載入下一批，與目前批次的推論重疊進行
+        with ThreadPoolExecutor(max_workers=io_workers) as executor:
+            def _submit(paths):
+                return [executor.submit(_load_image_for_tagging, path, draft_size) for path in paths]
+
+            pending = _submit(batches[0]) if batches else []
+            for index, paths in enumerate(batches):
+                futures = pending
+                # 預先提交下一批的載入工作
+                pending = _submit(batches[index + 1]) if index + 1 < len(batches) else []
+
+                batch_paths = []
+                batch_images = []
+                for image_path, future in zip(paths, futures):
+                    try:
+                        logger.info(f"[TagService] Processing: {os.path.basename(image_path)}")
+                        # 載入圖片 (先完整解碼，JPEG 以 draft 模式縮小解碼)
+                        batch_images.append(future.result())
+                        batch_paths.append(image_path)
+                    except Exception as e:
+                        results["failed_tags"] += 1
+                        results["processed_files"] += 1
+                        logger.error(f"[TagService] Error processing {image_path}: {e}")
+
+                if not batch_images:
+                    continue
+
+                try:
+                    # 生成標籤
+                    batch_results = _tag_images_results(batch_images, logger, tag_config)
+                finally:
+                    for image_pil in batch_images:
+                        image_pil.close()
+
+                for image_path, result in zip(batch_paths, batch_results):
+                    _record_result(image_path, result)
+                    cache_key = cache_keys.get(image_path)
+                    if cache_key and not result.message.startswith("Tagging failed"):
+                        try:
+                            tag_cache.put(cache_key, result)
+                        except sqlite3.Error as e:
+                            logger.warning(f"[TagService] Failed to cache tags for {image_path}: {e}")
+    finally:
+        if tag_cache is not None:
+            tag_cache.close()
+
     # 生成摘要
     avg_tags = results["total_tags_generated"] / max(results["successful_tags"], 1)
     summary = f"Batch tagging completed. Processed: {results['processed_files']}, Success: {results['successful_tags']}, Failed: {results['failed_tags']}, Avg tags: {avg_tags:.1f}"
@@ -298,34 +994,37 @@ def tag_batch_images(input_directory, logger, config=None):
     
     return True, summary, results
 
-def tag_image_service_entry(image_pil: Image.Image, logger, config=None):
+def tag_image_service_entry(image_pil: Image.Image, logger, config=None, image_path=None):
     """
     Entry point for orchestrator - tags image using WD14.
-    Returns: (tags_dict, message)
+    Accepts image_path instead of a PIL image when the image is already on disk.
+    Returns: (tags_dict, message); the wildcard line is returned separately in tags_dict["wildcard"]
     """
     try:
-        tags, message = tag_image_service(image_pil, logger, config)
-        # Convert tags string to dict format expected by orchestrator
-        if isinstance(tags, str) and tags:
+        result = _tag_image_result(image_pil, logger, config, image_path)
+        # Convert tags to dict format expected by orchestrator
+        if result.tag_list or result.wildcard:
             # Enhanced conversion with tag count and categories
-            tag_list = [t.strip() for t in tags.split(',') if t.strip()]
+            tags = ", ".join(result.tag_list)
             tag_dict = {
                 "tags": tags, 
                 "raw_tags": tags,
-                "tag_count": len(tag_list),
-                "tag_list": tag_list
+                "tag_count": len(result.tag_list),
+                "tag_list": result.tag_list,
+                "wildcard": result.wildcard
             }
         else:
             tag_dict = {
                 "tags": "", 
                 "raw_tags": "",
                 "tag_count": 0,
-                "tag_list": []
+                "tag_list": [],
+                "wildcard": ""
             }
-        return tag_dict, message
+        return tag_dict, result.message
     except Exception as e:
         logger.error(f"[TagService] Error in tag_image_service_entry: {e}")
-        return {"tags": "", "raw_tags": "", "tag_count": 0, "tag_list": []}, f"Tagging error: {str(e)}"
+        return {"tags": "", "raw_tags": "", "tag_count": 0, "tag_list": [], "wildcard": ""}, f"Tagging error: {str(e)}"
 
 # Example usage (for testing this module directly)
 if __name__ == '__main__':
@@ -1,19 +1,264 @@
 # services/upscale_service.py
+import PIL
 from PIL import Image
 from imgutils.upscale import upscale_with_cdc # Main upscaling function
 import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from config import settings as default_settings
 from utils.error_handler import safe_execute, ImageProcessingError, ModelError, ConfigError
 
 # Logger will be passed from orchestrator or individual script
 
-def _pil_resize_image(image: Image.Image, target_width: int, target_height: int, preserve_aspect_ratio: bool, logger) -> Image.Image:
+# Pillow-SIMD 是 Pillow 的直接替代版本 (版本號帶有 .post 後綴)，
+# 在支援 SSE4/AVX2 的 x86 CPU 上 resize 的 BICUBIC/LANCZOS 卷積快 2-4 倍
+_PILLOW_BUILD = f"Pillow-SIMD {PIL.__version__}" if ".post" in PIL.__version__ else f"Pillow {PIL.__version__}"
+
+# 縮小用 LANCZOS、放大用 BICUBIC；在匯入時決定一次，不必每張圖片重新判斷 Pillow 版本
+if hasattr(Image, 'Resampling'):  # Pillow >= 9.1.0
+    _RESAMPLE_DOWNSCALE = Image.Resampling.LANCZOS
+    _RESAMPLE_UPSCALE = Image.Resampling.BICUBIC
+else:  # Pillow < 9.1.0
+    _RESAMPLE_DOWNSCALE = getattr(Image, 'LANCZOS', 1) # Default to 1 if LANCZOS not found
+    _RESAMPLE_UPSCALE = getattr(Image, 'BICUBIC', 3) # Default to 3 if BICUBIC not found
+
+_UpscaleConfig = namedtuple(
+    '_UpscaleConfig',
+    'model_name target_width target_height preserve_aspect_ratio center_crop_after_upscale tile_size tile_overlap '
+    'batch_size min_size_threshold jpeg_draft workers cross_image_tile_batching resize_reducing_gap'
+)
+
+def _resolve_upscale_config(config):
+    """
+    Resolve all upscale settings once, so per-image processing does no getattr lookups.
+    Accepts a settings module/object, a dict of setting names, or None (default settings).
+    An already resolved _UpscaleConfig is returned as is, so callers can resolve once and pass it down.
+    """
+    if isinstance(config, _UpscaleConfig):
+        return config
+    if isinstance(config, dict):
+        def setting(name):
+            return config.get(name, getattr(default_settings, name))
+    else:
+        def setting(name):
+            return getattr(config, name, getattr(default_settings, name))
+
+    return _UpscaleConfig(
+        model_name=setting("UPSCALE_MODEL_NAME"),
+        target_width=setting("UPSCALE_TARGET_WIDTH"),
+        target_height=setting("UPSCALE_TARGET_HEIGHT"),
+        preserve_aspect_ratio=setting("UPSCALE_PRESERVE_ASPECT_RATIO"),
+        center_crop_after_upscale=setting("UPSCALE_CENTER_CROP_AFTER_UPSCALE"),
+        tile_size=setting("UPSCALE_TILE_SIZE"),
+        tile_overlap=setting("UPSCALE_TILE_OVERLAP"),
+        batch_size=setting("UPSCALE_BATCH_SIZE"),
+        min_size_threshold=setting("UPSCALE_MIN_SIZE_THRESHOLD"),
+        jpeg_draft=setting("UPSCALE_JPEG_DRAFT"),
+        workers=setting("UPSCALE_WORKERS"),
+        cross_image_tile_batching=setting("UPSCALE_CROSS_IMAGE_TILE_BATCHING"),
+        resize_reducing_gap=setting("UPSCALE_RESIZE_REDUCING_GAP"),
+    )
+
+def warmup_upscaler(logger, config=None):
+    """
+    Load the configured CDC model once before a batch, so the download, session creation
+    and imgutils' probe run are not paid by (and serialised behind) the first image.
+    imgutils keeps the session in its own per-model cache, which every later
+    upscale_with_cdc call reuses. Failures only log a warning; upscaling reports real errors itself.
+    """
+    model_name = _resolve_upscale_config(config).model_name
+    try:
+        from imgutils.upscale.cdc import _open_cdc_upscaler_model
+    except ImportError:
+        logger.debug("[UpscaleService] imgutils CDC internals not available; model loads on first upscale.")
+        return
+    start_time = time.perf_counter()
+    try:
+        _, scale = _open_cdc_upscaler_model(model_name)
+    except Exception as e:
+        logger.warning(f"[UpscaleService] CDC model warm-up failed ({model_name}): {e}")
+        return
+    logger.info(f"[UpscaleService] CDC model {model_name} (x{scale}) loaded ({time.perf_counter() - start_time:.2f}s)")
+
+# CDC 模型的輸入邊長須為 16 的倍數 (與 imgutils 相同)
+_CDC_INPUT_UNIT = 16
+
+# (model_name, batch_size) -> 各執行緒共用的 _TileBatcher
+_tile_batchers = {}
+_tile_batchers_lock = threading.Lock()
+
+class _TileBatcher:
+    """
+    Runs CDC tiles submitted by several threads through one shared ONNX session.
+    Whichever waiting thread finds the session idle takes up to batch_size pending tiles
+    of the same shape, from any image, and runs them together; the other threads wait
+    for their tiles. Tiles are thus packed across images instead of one image at a time.
+    """
+    __slots__ = ('session', 'scale', 'batch_size', 'condition', 'pending', 'running')
+
+    def __init__(self, session, scale, batch_size):
+        self.session = session
+        self.scale = scale
+        self.batch_size = batch_size
+        self.condition = threading.Condition()
+        self.pending = []  # [tile (1, 3, h, w), 結果或例外]
+        self.running = False
+
+    def _take_batch(self):
+        shape = self.pending[0][0].shape
+        batch = [request for request in self.pending if request[0].shape == shape][:self.batch_size]
+        taken = set(map(id, batch))
+        self.pending = [request for request in self.pending if id(request) not in taken]
+        return batch
+
+    def run(self, tiles):
+        """Upscale a (N, 3, h, w) float32 array of equally sized tiles; returns the raw model output rows."""
+        requests = [[tiles[index:index + 1], None] for index in range(len(tiles))]
+        with self.condition:
+            self.pending.extend(requests)
+            while any(request[1] is None for request in requests):
+                if self.running:
+                    self.condition.wait()
+                    continue
+                batch = self._take_batch()
+                self.running = True
+                self.condition.release()
+                try:
+                    outputs, = self.session.run(['output'], {'input': np.concatenate([request[0] for request in batch])})
+                    results = list(outputs)
+                except Exception as e:
+                    results = [e] * len(batch)
+                finally:
+                    self.condition.acquire()
+                    self.running = False
+                for request, result in zip(batch, results):
+                    request[1] = result
+                self.condition.notify_all()
+
+        for _, result in requests:
+            if isinstance(result, Exception):
+                raise result
+        return np.stack([result for _, result in requests])
+
+def _upscale_with_tile_batcher(image_pil: Image.Image, batcher, tile_size, tile_overlap):
+    """
+    Same result as upscale_with_cdc for an RGB/L image, with the tiles run through the shared batcher.
+    """
+    from imgutils.utils import area_batch_run
+
+    if image_pil.mode != 'RGB':
+        image_pil = image_pil.convert('RGB')
+    input_array = (np.asarray(image_pil, dtype=np.float32) / 255.0).transpose((2, 0, 1))
+
+    def _method(ix):
+        batch, channels, height, width = ix.shape
+        p_height = -height % _CDC_INPUT_UNIT
+        p_width = -width % _CDC_INPUT_UNIT
+        if p_height or p_width:  # align to 16
+            ix = np.pad(ix, ((0, 0), (0, 0), (0, p_height), (0, p_width)), mode='reflect')
+        ox = batcher.run(ix)
+        batch, channels, scale, out_height, scale, out_width = ox.shape
+        ox = ox.reshape((batch, channels, scale * out_height, scale * out_width))
+        return ox[..., :scale * height, :scale * width]  # crop back
+
+    # 一次交出整張圖片的所有分塊，由 batcher 與其他圖片的分塊合併成批次
+    output_array = area_batch_run(
+        input_array[None, ...], _method,
+        tile_size=tile_size, tile_overlap=tile_overlap, batch_size=2 ** 31,
+        scale=batcher.scale, silent=True,
+    )[0]
+    output_array = (np.clip(output_array, a_min=0.0, a_max=1.0) * 255.0).astype(np.uint8).transpose((1, 2, 0))
+    return Image.fromarray(output_array, mode='RGB')
+
+def _get_batched_upscaler(config, logger):
+    """
+    Returns an image -> image upscaler whose tiles are batched together with those of other
+    threads using the same model, or None if the imgutils CDC internals are not available.
+    """
+    upscale_config = _resolve_upscale_config(config)
+    try:
+        from imgutils.upscale.cdc import _open_cdc_upscaler_model
+        from imgutils.utils import area_batch_run  # noqa: F401
+    except ImportError:
+        logger.debug("[UpscaleService] imgutils CDC internals not available; tiles are batched per image.")
+        return None
+
+    key = (upscale_config.model_name, upscale_config.batch_size)
+    with _tile_batchers_lock:
+        batcher = _tile_batchers.get(key)
+        if batcher is None:
+            session, scale = _open_cdc_upscaler_model(upscale_config.model_name)
+            batcher = _TileBatcher(session, scale, upscale_config.batch_size)
+            _tile_batchers[key] = batcher
+
+    def _upscale(image_pil):
+        return _upscale_with_tile_batcher(image_pil, batcher, upscale_config.tile_size, upscale_config.tile_overlap)
+    return _upscale
+
+def _apply_jpeg_draft(image_pil: Image.Image, config, logger):
+    """
+    Configures a lazily opened JPEG to decode at a reduced (1/2, 1/4, 1/8) scale when the
+    file is larger than the target size itself, so libjpeg skips only resolution the output
+    cannot hold; the AI upscaler still sees at least target-size detail. Must be called before
+    the image is loaded.
+    """
+    upscale_config = _resolve_upscale_config(config)
+    if image_pil.format != 'JPEG' or not upscale_config.jpeg_draft:
+        return
+
+    target_width, target_height = upscale_config.target_width, upscale_config.target_height
+    if not target_width or not target_height:
+        return
+
+    # 圖片會因 min_size_threshold 原樣返回時，保留完整解析度
+    min_size_threshold = upscale_config.min_size_threshold
+    original_width, original_height = image_pil.size
+    if min_size_threshold is not None and original_width >= min_size_threshold and original_height >= min_size_threshold:
+        return
+
+    # draft 只會縮小到兩邊都不小於目標尺寸，小於兩倍目標尺寸的圖片維持完整解析度
+    image_pil.draft('RGB', (target_width, target_height))
+    if image_pil.size != (original_width, original_height):
+        logger.info(f"[UpscaleService] JPEG draft decode: {original_width}x{original_height} -> {image_pil.size[0]}x{image_pil.size[1]}")
+
+def _compute_resize_params(current_width, current_height, target_width, target_height, preserve_aspect_ratio):
+    """
+    Pure size arithmetic for _pil_resize_image: returns (final_width, final_height).
+    With preserve_aspect_ratio the image is scaled to cover the target box (or to the one
+    target dimension given); otherwise the positive target dimensions are used as-is.
+    The caller rejects non-positive results.
+    """
+    if not preserve_aspect_ratio:
+        # Use target dimensions directly if not preserving aspect ratio
+        # Ensure they are positive, otherwise use current dimension
+        return (target_width if target_width and target_width > 0 else current_width,
+                target_height if target_height and target_height > 0 else current_height)
+
+    if target_width and target_height:
+        # Scale to fit/cover: make sure the upscaled image is at least target_width x target_height
+        scale = max(target_width / current_width, target_height / current_height) # Ensure both dimensions meet target
+        return int(current_width * scale), int(current_height * scale)
+    if target_width: # Only width specified
+        return target_width, int(current_height * (target_width / current_width))
+    # Only height specified
+    return int(current_width * (target_height / current_height)), target_height
+
+def _pil_resize_image(image: Image.Image, target_width: int, target_height: int, preserve_aspect_ratio: bool, logger, center_crop: bool = False,
+                      reducing_gap=None) -> Image.Image:
     """
     Resizes a PIL image to target dimensions, optionally preserving aspect ratio.
     If preserving aspect ratio, scales the image so that it fits within or covers the target dimensions,
     then crops or pads if necessary (currently, it scales to cover and expects subsequent crop if needed).
     This simplified version scales to ensure both dimensions are >= target if preserve_aspect_ratio is True.
+    With center_crop, only the centre target_width x target_height region of the scaled image is produced
+    (the same pixels _center_crop_image would keep), without resizing the parts that would be cropped away.
+    When downscaling, reducing_gap lets Pillow shrink by an integer factor with a cheap box reduction first
+    and run the LANCZOS pass only on the remaining ratio (the technique Image.thumbnail uses).
     """
     current_width, current_height = image.size
     logger.debug(f"[UpscaleService] Resizing. Current: {current_width}x{current_height}, Target: {target_width}x{target_height}, Preserve Ratio: {preserve_aspect_ratio}")
@@ -22,34 +267,11 @@ def _pil_resize_image(image: Image.Image, target_width: int, target_height: int,
         logger.warning("[UpscaleService] Resize called with no target dimensions. Returning original.")
         return image
 
-    final_width, final_height = target_width, target_height
-
-    if preserve_aspect_ratio:
-        if target_width and target_height:
-            # Scale to fit/cover: make sure the upscaled image is at least target_width x target_height
-            width_scale = target_width / current_width if current_width > 0 else 0
-            height_scale = target_height / current_height if current_height > 0 else 0
-            scale = max(width_scale, height_scale) # Ensure both dimensions meet target
-            if scale <= 0: # Avoid issues with zero or negative scales
-                logger.warning(f"[UpscaleService] Invalid scale factor ({scale}) calculated. Using original size for this dimension.")
-                final_width = current_width if not target_width else target_width
-                final_height = current_height if not target_height else target_height
-            else:
-                final_width = int(current_width * scale)
-                final_height = int(current_height * scale)
-        elif target_width: # Only width specified
-            if current_width == 0: return image # Avoid division by zero
-            scale = target_width / current_width
-            final_height = int(current_height * scale)
-        elif target_height: # Only height specified
-            if current_height == 0: return image # Avoid division by zero
-            scale = target_height / current_height
-            final_width = int(current_width * scale)
-    else:
-        # Use target dimensions directly if not preserving aspect ratio
-        # Ensure they are positive, otherwise use current dimension
-        final_width = target_width if target_width and target_width > 0 else current_width
-        final_height = target_height if target_height and target_height > 0 else current_height
+    if current_width <= 0 or current_height <= 0:
+        logger.warning(f"[UpscaleService] Cannot resize an image of size {current_width}x{current_height}. Returning original.")
+        return image
+
+    final_width, final_height = _compute_resize_params(current_width, current_height, target_width, target_height, preserve_aspect_ratio)
 
     if final_width <= 0 or final_height <= 0:
         logger.error(f"[UpscaleService] Calculated invalid final dimensions: {final_width}x{final_height}. Returning original image.")
@@ -57,39 +279,39 @@ def _pil_resize_image(image: Image.Image, target_width: int, target_height: int,
 
     logger.debug(f"[UpscaleService] Calculated final resize dimensions: {final_width}x{final_height}")
 
-    resample_filter = None
-    try:
-        if hasattr(Image, 'Resampling'):  # Pillow >= 9.1.0
-            if final_width < current_width or final_height < current_height: # Downscaling
-                resample_filter = Image.Resampling.LANCZOS
-            else: # Upscaling or same size
-                resample_filter = Image.Resampling.BICUBIC
-            logger.debug(f"[UpscaleService] Using Image.Resampling: {resample_filter}")
-        else:  # Pillow < 9.1.0
-            if final_width < current_width or final_height < current_height: # Downscaling
-                resample_filter = getattr(Image, 'LANCZOS', 1) # Default to 1 if LANCZOS not found
-                logger.debug(f"[UpscaleService] Using Image.LANCZOS (fallback: 1): {resample_filter}")
-            else: # Upscaling or same size
-                resample_filter = getattr(Image, 'BICUBIC', 3) # Default to 3 if BICUBIC not found
-                logger.debug(f"[UpscaleService] Using Image.BICUBIC (fallback: 3): {resample_filter}")
-    except Exception as e:
-        logger.error(f"[UpscaleService] Error selecting resampling filter: {e}. Falling back to integers.", exc_info=True)
-        resample_filter = 1 if (final_width < current_width or final_height < current_height) else 3
-
-    if resample_filter is None: # Safeguard
-        logger.error("[UpscaleService] Resampling filter is None after selection. Defaulting.")
-        resample_filter = 1 if (final_width < current_width or final_height < current_height) else 3
+    if (final_width, final_height) == image.size:
+        # 例如 AI 放大後已剛好是目標尺寸：resize 到相同尺寸仍會完整跑一次濾波並配置新圖片
+        logger.debug("[UpscaleService] Image already has the target size. Skipping resize.")
+        return image
 
-    logger.info(f"[UpscaleService] Final resample filter selected: {resample_filter}")
+    downscaling = final_width < current_width or final_height < current_height
+    resample_filter = _RESAMPLE_DOWNSCALE if downscaling else _RESAMPLE_UPSCALE
+    logger.info(f"[UpscaleService] Final resample filter selected: {resample_filter} ({_PILLOW_BUILD})")
+
+    output_size = (final_width, final_height)
+    box = None
+    if center_crop and target_width and target_height and final_width >= target_width and final_height >= target_height \
+            and output_size != (target_width, target_height):
+        # 直接把來源中對應裁切區域的 box 縮放到目標尺寸：取樣位置與「先縮放再置中裁切」相同，
+        # 但不必縮放之後會被裁掉的部分，也省去裁切時再複製一次整張大圖
+        left = (final_width - target_width) // 2
+        top = (final_height - target_height) // 2
+        box = (left * current_width / final_width, top * current_height / final_height,
+               (left + target_width) * current_width / final_width, (top + target_height) * current_height / final_height)
+        output_size = (target_width, target_height)
+        logger.info(f"[UpscaleService] Resizing to {final_width}x{final_height} and center cropping to {target_width}x{target_height} in one step.")
+
+    # reducing_gap 只在縮小時有作用；放大時維持單次 BICUBIC
+    resize_reducing_gap = reducing_gap if downscaling else None
 
     try:
-        resized_image = image.resize((final_width, final_height), resample=resample_filter)
+        resized_image = image.resize(output_size, resample=resample_filter, box=box, reducing_gap=resize_reducing_gap)
     except ValueError as e:
         logger.error(f"[UpscaleService] ValueError during resize (filter: {resample_filter}): {e}. Attempting with explicit integer fallback.", exc_info=True)
-        fallback_filter = 1 if (final_width < current_width or final_height < current_height) else 3
+        fallback_filter = 1 if downscaling else 3
         logger.info(f"[UpscaleService] Retrying resize with integer filter: {fallback_filter}")
         try:
-            resized_image = image.resize((final_width, final_height), resample=fallback_filter)
+            resized_image = image.resize(output_size, resample=fallback_filter, box=box)
         except Exception as final_e:
             logger.error(f"[UpscaleService] Resize failed even with integer fallback filter: {final_e}", exc_info=True)
             raise ImageProcessingError(f"Failed to resize image: {final_e}")
@@ -127,20 +349,25 @@ def _center_crop_image(image: Image.Image, target_width: int, target_height: int
     logger.info(f"[UpscaleService] Image cropped from {current_width}x{current_height} to {target_width}x{target_height}.")
     return cropped_image
 
-def _upscale_image_core_logic(image_pil: Image.Image, logger, config):
+def _upscale_image_core_logic(image_pil: Image.Image, logger, config, upscaler=None):
+    """
+    upscaler: optional image -> image callable used instead of upscale_with_cdc
+    (e.g. the cross-image tile batcher used by upscale_batch_images).
+    """
     if not isinstance(image_pil, Image.Image):
         raise ImageProcessingError("Invalid input: image_pil must be a PIL Image object.", "N/A")
 
-    # Load settings from config or use defaults
-    model_name = getattr(config, "UPSCALE_MODEL_NAME", default_settings.UPSCALE_MODEL_NAME)
-    target_width = getattr(config, "UPSCALE_TARGET_WIDTH", default_settings.UPSCALE_TARGET_WIDTH)
-    target_height = getattr(config, "UPSCALE_TARGET_HEIGHT", default_settings.UPSCALE_TARGET_HEIGHT)
-    preserve_aspect_ratio = getattr(config, "UPSCALE_PRESERVE_ASPECT_RATIO", default_settings.UPSCALE_PRESERVE_ASPECT_RATIO)
-    center_crop_after_upscale = getattr(config, "UPSCALE_CENTER_CROP_AFTER_UPSCALE", default_settings.UPSCALE_CENTER_CROP_AFTER_UPSCALE)
-    tile_size = getattr(config, "UPSCALE_TILE_SIZE", default_settings.UPSCALE_TILE_SIZE)
-    tile_overlap = getattr(config, "UPSCALE_TILE_OVERLAP", default_settings.UPSCALE_TILE_OVERLAP)
-    batch_size = getattr(config, "UPSCALE_BATCH_SIZE", default_settings.UPSCALE_BATCH_SIZE)
-    min_size_threshold = getattr(config, "UPSCALE_MIN_SIZE_THRESHOLD", default_settings.UPSCALE_MIN_SIZE_THRESHOLD)
+    # Load settings from config or use defaults (resolved once; batch callers pass an _UpscaleConfig)
+    upscale_config = _resolve_upscale_config(config)
+    model_name = upscale_config.model_name
+    target_width = upscale_config.target_width
+    target_height = upscale_config.target_height
+    preserve_aspect_ratio = upscale_config.preserve_aspect_ratio
+    center_crop_after_upscale = upscale_config.center_crop_after_upscale
+    tile_size = upscale_config.tile_size
+    tile_overlap = upscale_config.tile_overlap
+    batch_size = upscale_config.batch_size
+    min_size_threshold = upscale_config.min_size_threshold
 
     original_width, original_height = image_pil.size
     logger.info(f"[UpscaleService] Original image size: {original_width}x{original_height}. Model: {model_name}")
@@ -160,14 +387,17 @@ def _upscale_image_core_logic(image_pil: Image.Image, logger, config):
     # --- Stage 1: AI Upscaling with imgutils.upscale_with_cdc ---
     try:
         logger.info(f"[UpscaleService] Starting AI upscaling with model: {model_name}, tile: {tile_size}, overlap: {tile_overlap}")
-        ai_upscaled_image = upscale_with_cdc(
-            image_pil,
-            model=model_name,
-            tile_size=tile_size,
-            tile_overlap=tile_overlap,
-            batch_size=batch_size,
-            silent=True # Assuming logger provides enough feedback
-        )
+        if upscaler is not None:
+            ai_upscaled_image = upscaler(image_pil)
+        else:
+            ai_upscaled_image = upscale_with_cdc(
+                image_pil,
+                model=model_name,
+                tile_size=tile_size,
+                tile_overlap=tile_overlap,
+                batch_size=batch_size,
+                silent=True # Assuming logger provides enough feedback
+            )
         logger.info(f"[UpscaleService] AI upscaling complete. New size: {ai_upscaled_image.size}")
     except Exception as e:
         error_msg = f"AI Upscaling (model: {model_name}) failed: {str(e)}"
@@ -187,12 +417,15 @@ def _upscale_image_core_logic(image_pil: Image.Image, logger, config):
     # If target dimensions are set, we might need to resize the AI upscaled image.
     # This is especially true if preserve_aspect_ratio is True, as AI upscale might give, e.g., 4x, 
     # and then we need to scale it to fit the target_width/target_height box.
+    crop_to_target = bool(center_crop_after_upscale and target_width and target_height)
     if target_width or target_height:
         logger.info(f"[UpscaleService] Resizing AI upscaled image to fit target dimensions: W={target_width}, H={target_height}, PreserveRatio={preserve_aspect_ratio}")
-        current_processed_image = _pil_resize_image(current_processed_image, target_width, target_height, preserve_aspect_ratio, logger)
+        current_processed_image = _pil_resize_image(current_processed_image, target_width, target_height, preserve_aspect_ratio, logger,
+                                                    center_crop=crop_to_target, reducing_gap=upscale_config.resize_reducing_gap)
     
     # --- Stage 3: Center Cropping (if enabled and target dimensions are set) ---
-    if center_crop_after_upscale and target_width and target_height:
+    # 縮放時已一併裁切到目標尺寸的圖片不必再裁切 (crop 會再複製整張圖片)
+    if crop_to_target and current_processed_image.size != (target_width, target_height):
         logger.info(f"[UpscaleService] Performing center crop to {target_width}x{target_height}.")
         final_image = _center_crop_image(current_processed_image, target_width, target_height, logger)
     else:
@@ -250,23 +483,14 @@ def upscale_image_service(image_pil: Image.Image, logger, config=None):
         logger.error(f"[UpscaleService] Upscaling failed")
         return None, "Upscaling failed due to error"
 
-def upscale_image_service_entry(image_path, logger, config=None, output_path=None):
+def upscale_image_service_entry(image_path, logger, config=None, output_path=None, upscaler=None):
     """
     Main entry point for the upscale service.
     Handles loading an image, upscaling it, and saving the result.
+    upscaler is passed through to _upscale_image_core_logic.
     """
-    if config is None:
-        config_obj = default_settings # Use global settings
-    elif isinstance(config, dict):
-        # Create a simple namespace object from dict for attribute access
-        # This allows using config.SETTING_NAME like with the settings module
-        class DictConfig:
-            def __init__(self, dictionary):
-                for key, value in dictionary.items():
-                    setattr(self, key, value)
-        config_obj = DictConfig(config)
-    else: # Assuming it's already a config object (e.g. module or class instance)
-        config_obj = config
+    # None, dict, settings module/object or an already resolved _UpscaleConfig
+    config_obj = _resolve_upscale_config(config)
 
     logger.info(f"[UpscaleService] Starting upscale for image: {image_path}")
 
@@ -274,6 +498,7 @@ def upscale_image_service_entry(image_path, logger, config=None, output_path=Non
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Input image path does not exist: {image_path}")
         image_pil = Image.open(image_path)
+        _apply_jpeg_draft(image_pil, config_obj, logger)
     except FileNotFoundError as e:
         logger.error(f"[UpscaleService] File not found: {image_path}. Error: {e}", exc_info=True)
         raise ImageProcessingError(f"Input file not found: {image_path}", image_path) from e
@@ -281,7 +506,7 @@ def upscale_image_service_entry(image_path, logger, config=None, output_path=Non
         logger.error(f"[UpscaleService] Error loading image {image_path}: {e}", exc_info=True)
         raise ImageProcessingError(f"Failed to load image: {image_path}", image_path) from e
 
-    processed_image, message = _upscale_image_core_logic(image_pil, logger, config_obj)
+    processed_image, message = _upscale_image_core_logic(image_pil, logger, config_obj, upscaler)
     logger.info(f"[UpscaleService] Core processing message: {message}")
 
     if output_path:
@@ -320,6 +545,37 @@ def upscale_image_service_entry(image_path, logger, config=None, output_path=Non
         logger.info("[UpscaleService] Output path not provided. Returning processed PIL image.")
         return processed_image, None, message # Return PIL image, no path, and message
 
+def _default_upscale_workers():
+    """
+    Number of images upscaled at once when UPSCALE_WORKERS is not set.
+    Every in-flight image holds its float32 tile outputs and stitch buffers at the upscaled
+    resolution (roughly 600 MB for a 1024x1024 input with an x4 model), so the default stays
+    at 2 on CPU and 1 when CUDA is available, where GPU memory is the tighter limit.
+    """
+    try:
+        import onnxruntime
+        if 'CUDAExecutionProvider' in onnxruntime.get_available_providers():
+            return 1
+    except ImportError:
+        pass
+    return min(2, max(1, (os.cpu_count() or 2) // 2))
+
+def _upscale_batch_file(image_path, output_path, logger, config, upscaler=None):
+    """
+    批量放大中的單一圖片處理 (在執行緒池中執行)
+    只回傳 (輸出路徑或 None, 訊息)，不保留放大後的圖片物件以免佔用記憶體
+    """
+    logger.info(f"[UpscaleService] Processing: {os.path.basename(image_path)}")
+
+    # 執行放大
+    result_image, final_output_path, message = upscale_image_service_entry(
+        image_path, logger, config, output_path, upscaler
+    )
+
+    if result_image and final_output_path and os.path.exists(final_output_path):
+        return final_output_path, message
+    return None, message
+
 def upscale_batch_images(input_directory, output_directory, logger, config=None):
     """
     批量放大圖片到指定尺寸
@@ -351,54 +607,79 @@ def upscale_batch_images(input_directory, output_directory, logger, config=None)
         "total_size_after": 0,
         "upscaled_files": []
     }
-    
+
+    # 先依序決定所有輸出路徑，平行處理時不同子目錄的同名檔案才不會搶到同一個路徑
+    reserved_paths = set()
+    output_paths = []
     for image_path in image_files:
-        try:
-            logger.info(f"[UpscaleService] Processing: {os.path.basename(image_path)}")
-            
-            # 記錄原始文件大小
-            original_size = os.path.getsize(image_path)
-            results["total_size_before"] += original_size
-            
-            # 生成輸出路徑
+        name, ext = os.path.splitext(os.path.basename(image_path))
+        output_path = os.path.join(output_directory, f"{name}_upscaled{ext}")
+
+        # 處理重名文件
+        counter = 1
+        while output_path in reserved_paths or os.path.exists(output_path):
+            output_path = os.path.join(output_directory, f"{name}_upscaled_{counter}{ext}")
+            counter += 1
+        reserved_paths.add(output_path)
+        output_paths.append(output_path)
+
+    # 設定只解析一次，之後每張圖片直接使用
+    upscale_config = _resolve_upscale_config(config)
+
+    # 先載入模型，避免第一批工作執行緒全部卡在模型載入上
+    warmup_upscaler(logger, upscale_config)
+
+    # AI 放大 (ONNX Runtime) 與 PIL 縮放都會釋放 GIL，以執行緒平行處理多張圖片並共用同一個模型；
+    # 不使用行程池，避免每個行程各自載入模型 (GPU 上也只需要一個 CUDA context)
+    workers = upscale_config.workers or _default_upscale_workers()
+
+    # 多個執行緒同時放大時，將不同圖片的分塊合併成 UPSCALE_BATCH_SIZE 大小的批次送入模型
+    upscaler = None
+    if workers > 1 and upscale_config.batch_size > 1 and upscale_config.cross_image_tile_batching:
+        upscaler = safe_execute(
+            _get_batched_upscaler,
+            upscale_config,
+            logger,
+            logger=logger,
+            default_return=None,
+            error_msg_prefix="[UpscaleService] Error preparing cross-image tile batching"
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_upscale_batch_file, image_path, output_path, logger, upscale_config, upscaler)
+            for image_path, output_path in zip(image_files, output_paths)
+        ]
+
+        for image_path, future in zip(image_files, futures):
             filename = os.path.basename(image_path)
-            name, ext = os.path.splitext(filename)
-            output_filename = f"{name}_upscaled{ext}"
-            output_path = os.path.join(output_directory, output_filename)
-            
-            # 處理重名文件
-            if os.path.exists(output_path):
-                counter = 1
-                while os.path.exists(output_path):
-                    output_filename = f"{name}_upscaled_{counter}{ext}"
-                    output_path = os.path.join(output_directory, output_filename)
-                    counter += 1
-            
-            # 執行放大
-            result_image, final_output_path, message = upscale_image_service_entry(
-                image_path, logger, config, output_path
-            )
-            
-            if result_image and final_output_path and os.path.exists(final_output_path):
-                # 記錄處理後文件大小
-                upscaled_size = os.path.getsize(final_output_path)
-                results["total_size_after"] += upscaled_size
-                results["successful_upscales"] += 1
-                results["upscaled_files"].append(final_output_path)
-                
-                logger.info(f"[UpscaleService] Successfully upscaled {filename}: {original_size/1024:.1f}KB -> {upscaled_size/1024:.1f}KB")
-            elif "Skipped" in message:
-                results["skipped_files"] += 1
-                logger.info(f"[UpscaleService] Skipped {filename}: {message}")
-            else:
+            try:
+                # 記錄原始文件大小
+                original_size = os.path.getsize(image_path)
+                results["total_size_before"] += original_size
+
+                final_output_path, message = future.result()
+
+                if final_output_path:
+                    # 記錄處理後文件大小
+                    upscaled_size = os.path.getsize(final_output_path)
+                    results["total_size_after"] += upscaled_size
+                    results["successful_upscales"] += 1
+                    results["upscaled_files"].append(final_output_path)
+
+                    logger.info(f"[UpscaleService] Successfully upscaled {filename}: {original_size/1024:.1f}KB -> {upscaled_size/1024:.1f}KB")
+                elif "Skipped" in message:
+                    results["skipped_files"] += 1
+                    logger.info(f"[UpscaleService] Skipped {filename}: {message}")
+                else:
+                    results["failed_upscales"] += 1
+                    logger.warning(f"[UpscaleService] Failed to upscale {filename}: {message}")
+
+                results["processed_files"] += 1
+
+            except Exception as e:
                 results["failed_upscales"] += 1
-                logger.warning(f"[UpscaleService] Failed to upscale {filename}: {message}")
-            
-            results["processed_files"] += 1
-            
-        except Exception as e:
-            results["failed_upscales"] += 1
-            logger.error(f"[UpscaleService] Error processing {image_path}: {e}")
+                logger.error(f"[UpscaleService] Error processing {image_path}: {e}")
     
     # 生成摘要
     size_increase = ((results["total_size_after"] / max(results["total_size_before"], 1)) - 1) * 100
@@ -1,5 +1,7 @@
 # services/validator_service.py
 import os
+import shutil
+import tempfile
 from PIL import Image
 from config import settings as default_settings
 from utils.error_handler import safe_execute
@@ -68,7 +70,6 @@ def validate_image_service(image_path_or_dir, logger, config=None, is_directory=
                     try:
                         os.makedirs(quarantine_dir, exist_ok=True)
                         quarantine_path = os.path.join(quarantine_dir, os.path.basename(file_path))
-                        import shutil
                         shutil.move(file_path, quarantine_path)
                         removed_count += 1
                         logger.info(f"[ValidatorService] Moved invalid image to quarantine: {quarantine_path}")
@@ -111,9 +112,6 @@ def validate_image(image_pil: Image.Image, logger, config=None):
     Entry point for orchestrator - validates a PIL image.
     Returns: (is_valid, message_or_pil, path_list)
     """
-    import tempfile
-    import os
-    
     try:
         # Create temporary file to validate the PIL image
         with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
@@ -2,14 +2,17 @@
 Unit tests for the FileService.
 """
 import unittest
+import io
 import os
-from PIL import Image
+from PIL import Image, ImageDraw
 import tempfile
 import shutil
+import threading
+import time
 from unittest.mock import patch, MagicMock, mock_open
 from typing import cast
 
-from services.file_service import FileService
+from services.file_service import FileService, _sweep_stale_previews
 from config import settings
 from utils.logger_config import setup_logging
 
@@ -72,6 +75,108 @@ class TestFileService(unittest.TestCase):
             loaded_image = Image.open(preview_path)
             self.assertEqual(loaded_image.size, (100, 100))
 
+    def test_prepare_preview_image_unique_names(self):
+        """Test repeated previews of in-memory images never reuse a filename."""
+        test_image = Image.new('RGB', (8, 8), color='red')
+        test_image.format = 'PNG'
+
+        paths = {self.file_service.prepare_preview_image(test_image, "unique_preview") for _ in range(5)}
+
+        self.assertEqual(len(paths), 5)
+        self.assertTrue(all(path is not None and os.path.exists(path) for path in paths))
+
+    def test_prepare_preview_image_reuses_source_file(self):
+        """Test prepare_preview_image returns the source file of an opened image without re-encoding."""
+        source_path = os.path.join(self.test_temp_dir, "opened_source.png")
+        Image.new('RGB', (24, 24), color='green').save(source_path)
+
+        with Image.open(source_path) as opened_image:
+            preview_path = self.file_service.prepare_preview_image(opened_image, "reuse_preview")
+
+        self.assertEqual(preview_path, os.path.abspath(source_path))
+
+        # Images outside the allowed directories are still copied into the temp dir
+        outside_dir = os.path.join(self.temp_dir.name, "outside")
+        os.makedirs(outside_dir, exist_ok=True)
+        outside_path = os.path.join(outside_dir, "outside.png")
+        Image.new('RGB', (24, 24), color='green').save(outside_path)
+        with patch.object(settings, 'ALLOWED_PREVIEW_PATHS', []), Image.open(outside_path) as opened_image:
+            preview_path = self.file_service.prepare_preview_image(opened_image, "copied_preview")
+
+        self.assertIsNotNone(preview_path)
+        if preview_path is not None:
+            self.assertTrue(preview_path.startswith(self.test_temp_dir))
+            self.assertIn("copied_preview", preview_path)
+
+    def test_prepare_preview_image_encodes_modified_image(self):
+        """Test an opened image edited in place is previewed from its pixels, not from the stale source file."""
+        source_path = os.path.join(self.test_temp_dir, "edited_source.png")
+        Image.new('RGB', (24, 24), color='red').save(source_path)
+
+        with Image.open(source_path) as opened_image:
+            ImageDraw.Draw(opened_image).rectangle((0, 0, 23, 23), fill='blue')
+            preview_path = self.file_service.prepare_preview_image(opened_image, "edited_preview")
+
+        self.assertIsNotNone(preview_path)
+        self.assertNotEqual(preview_path, os.path.abspath(source_path))
+        with Image.open(preview_path) as preview_image:
+            self.assertEqual(preview_image.convert('RGB').getpixel((12, 12)), (0, 0, 255))
+
+    def test_prepare_preview_image_fast_encoder(self):
+        """Test in-memory images without a format are previewed as JPEG, or WEBP when they have alpha."""
+        opaque_path = self.file_service.prepare_preview_image(Image.new('RGB', (20, 20), color='red'))
+        alpha_path = self.file_service.prepare_preview_image(Image.new('RGBA', (20, 20), color=(0, 0, 0, 0)))
+
+        self.assertIsNotNone(opaque_path)
+        self.assertIsNotNone(alpha_path)
+        if opaque_path is not None and alpha_path is not None:
+            self.assertTrue(opaque_path.endswith('.jpeg'))
+            self.assertTrue(alpha_path.endswith('.webp'))
+            self.assertEqual(Image.open(alpha_path).mode, 'RGBA')
+
+        fs_png = FileService(temp_dir=self.test_temp_dir, preview_format='PNG')
+        png_path = fs_png.prepare_preview_image(Image.new('RGB', (20, 20), color='red'))
+        self.assertIsNotNone(png_path)
+        if png_path is not None:
+            self.assertTrue(png_path.endswith('.png'))
+
+    def test_sweep_stale_previews(self):
+        """Test the preview sweeper deletes expired previews and keeps fresh ones."""
+        sweep_dir = os.path.join(self.temp_dir.name, "sweep")
+        os.makedirs(sweep_dir, exist_ok=True)
+        stale_path = os.path.join(sweep_dir, "stale.png")
+        fresh_path = os.path.join(sweep_dir, "fresh.png")
+        for path in (stale_path, fresh_path):
+            with open(path, 'wb') as f:
+                f.write(b'preview')
+        os.utime(stale_path, (time.time() - 3600, time.time() - 3600))
+
+        stop_event = threading.Event()
+        sweeper = threading.Thread(target=_sweep_stale_previews, args=(sweep_dir, 60, stop_event))
+        with patch.object(stop_event, 'wait', side_effect=[False, True]):
+            sweeper.start()
+            sweeper.join(timeout=5)
+
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertTrue(os.path.exists(fresh_path))
+
+    def test_explicit_temp_dir_skips_tmpfs(self):
+        """Test an explicit temp_dir keeps previews there even when tmpfs is requested."""
+        fs = FileService(temp_dir=self.test_temp_dir, use_tmpfs=True)
+        self.assertEqual(fs.preview_dir, self.test_temp_dir)
+        fs.close()
+
+    def test_prepare_preview_bytes(self):
+        """Test prepare_preview_bytes encodes a PIL image in memory."""
+        test_image = Image.new('RGB', (32, 16), color='red')
+        test_image.format = 'PNG'
+
+        data, mime = self.file_service.prepare_preview_bytes(test_image)
+
+        self.assertEqual(mime, 'image/png')
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (32, 16))
+        self.assertEqual(self.file_service.prepare_preview_bytes("not_an_image"), (None, None))
+
     def test_prepare_preview_image_with_file_path(self):
         """Test prepare_preview_image with file path input."""
         # Create a test image file
@@ -144,6 +249,39 @@ class TestFileService(unittest.TestCase):
             self.assertTrue(os.path.exists(saved_path2))
             self.assertIn("collision_test_1", saved_path2)
 
+    def test_save_processed_image_external_collision(self):
+        """Test save_processed_image never overwrites a file created after the directory was cached."""
+        test_image = Image.new('RGB', (10, 10), color='yellow')
+        test_image.format = 'PNG'
+        output_dir = os.path.join(self.temp_dir.name, "external_collision")
+
+        first_path = self.file_service.save_processed_image(test_image, "external.png", output_dir)
+        # Created behind the service's back, so the cached listing does not know about it
+        external_path = os.path.join(output_dir, "external_1.png")
+        with open(external_path, 'wb') as f:
+            f.write(b'not overwritten')
+
+        second_path = self.file_service.save_processed_image(test_image, "external.png", output_dir)
+
+        self.assertIsNotNone(first_path)
+        self.assertEqual(second_path, os.path.join(output_dir, "external_2.png"))
+        with open(external_path, 'rb') as f:
+            self.assertEqual(f.read(), b'not overwritten')
+
+    def test_save_processed_image_recreates_removed_dir(self):
+        """Test save_processed_image still saves after a cached output directory was deleted."""
+        test_image = Image.new('RGB', (10, 10), color='blue')
+        test_image.format = 'PNG'
+        output_dir = os.path.join(self.temp_dir.name, "removed_dir")
+
+        first_path = self.file_service.save_processed_image(test_image, "removed.png", output_dir)
+        shutil.rmtree(output_dir)
+        second_path = self.file_service.save_processed_image(test_image, "removed.png", output_dir)
+
+        self.assertIsNotNone(first_path)
+        self.assertEqual(second_path, os.path.join(output_dir, "removed.png"))
+        self.assertTrue(os.path.exists(second_path))
+
     def test_save_processed_image_invalid_input(self):
         """Test save_processed_image with invalid inputs."""
         # Test with non-PIL object
@@ -179,21 +317,24 @@ class TestFileService(unittest.TestCase):
         self.assertTrue(self.file_service._is_url("https://example.com/image.png"))
         self.assertTrue(self.file_service._is_url("http://test.org/photo.jpg"))
         self.assertTrue(self.file_service._is_url("ftp://files.com/pic.gif"))
+        self.assertTrue(self.file_service._is_url("HTTPS://example.com/IMAGE.PNG"))
         
         # Test invalid URLs
         self.assertFalse(self.file_service._is_url("not_a_url"))
         self.assertFalse(self.file_service._is_url("/local/path/image.png"))
         self.assertFalse(self.file_service._is_url("relative/path.jpg"))
         self.assertFalse(self.file_service._is_url(""))
+        self.assertFalse(self.file_service._is_url("C:\\images\\photo.png"))
+        self.assertFalse(self.file_service._is_url(cast(str, None)))
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_download_image_success(self, mock_get):
         """Test _download_image with successful download."""
         # Mock successful response
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.headers = {'content-type': 'image/png'}
-        mock_response.iter_content.return_value = [b'fake_image_data']
+        mock_response.raw = io.BytesIO(b'fake_image_data')
         mock_response.raise_for_status.return_value = None
         mock_get.return_value = mock_response
         
@@ -203,9 +344,50 @@ class TestFileService(unittest.TestCase):
         if downloaded_path is not None:
             self.assertTrue(os.path.exists(downloaded_path))
             self.assertTrue(downloaded_path.endswith('.png'))
+            with open(downloaded_path, 'rb') as f:
+                self.assertEqual(f.read(), b'fake_image_data')
         mock_get.assert_called_once()
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
+    def test_download_image_chunk_size(self, mock_get):
+        """Test _download_image streams with the configured chunk size."""
+        mock_response = MagicMock()
+        mock_response.headers = {'content-type': 'image/jpeg'}
+        mock_response.raw.read.side_effect = [b'fake_image_data', b'']
+        mock_get.return_value = mock_response
+
+        fs = FileService(temp_dir=self.test_temp_dir, download_chunk_size=128 * 1024)
+        downloaded_path = fs._download_image("https://example.com/test.jpg")
+
+        self.assertIsNotNone(downloaded_path)
+        mock_response.raw.read.assert_called_with(128 * 1024)
+        self.assertTrue(mock_response.raw.decode_content)
+        mock_response.close.assert_called_once()
+
+    @patch('requests.Session.get')
+    def test_download_image_extension(self, mock_get):
+        """Test _download_image picks the extension from the URL suffix, then the Content-Type."""
+        def make_response(content_type):
+            mock_response = MagicMock()
+            mock_response.headers = {'content-type': content_type}
+            mock_response.raw = io.BytesIO(b'fake_image_data')
+            return mock_response
+
+        mock_get.side_effect = [
+            make_response('image/webp; charset=binary'),
+            make_response('application/octet-stream'),
+        ]
+
+        header_path = self.file_service._download_image("https://example.com/image?id=1")
+        suffix_path = self.file_service._download_image("https://example.com/art/pic.PNG?size=large")
+
+        self.assertIsNotNone(header_path)
+        self.assertIsNotNone(suffix_path)
+        if header_path is not None and suffix_path is not None:
+            self.assertTrue(header_path.endswith('.webp'))
+            self.assertTrue(suffix_path.endswith('.png'))
+
+    @patch('requests.Session.get')
     def test_download_image_failure(self, mock_get):
         """Test _download_image with failed download."""
         # Mock failed response
@@ -215,6 +397,13 @@ class TestFileService(unittest.TestCase):
         
         self.assertIsNone(downloaded_path)
 
+    def test_download_session_reused(self):
+        """Test downloads share one pooled session with retries mounted."""
+        adapter = self.file_service._session.get_adapter("https://example.com/a.png")
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertIs(adapter, self.file_service._session.get_adapter("http://example.com/b.png"))
+        self.file_service.close()
+
     def test_handle_input_path_local_file(self):
         """Test handle_input_path with local file."""
         # Create a test file
@@ -227,10 +416,22 @@ class TestFileService(unittest.TestCase):
         self.assertEqual(result[0], test_file_path)
 
     def test_handle_input_path_directory(self):
-        """Test handle_input_path with directory (currently returns empty list)."""
-        result = self.file_service.handle_input_path(self.test_temp_dir)
-        
-        self.assertEqual(len(result), 0)
+        """Test handle_input_path with directory lists the image files directly inside it."""
+        input_dir = os.path.join(self.temp_dir.name, "dir_input")
+        os.makedirs(os.path.join(input_dir, "nested"), exist_ok=True)
+        for name in ("b.PNG", "a.jpg", "nested/c.png"):
+            Image.new('RGB', (10, 10), color='blue').save(os.path.join(input_dir, name))
+        with open(os.path.join(input_dir, "notes.txt"), 'w') as f:
+            f.write("not an image")
+
+        result = self.file_service.handle_input_path(input_dir)
+
+        self.assertEqual(result, [os.path.join(input_dir, "a.jpg"), os.path.join(input_dir, "b.PNG")])
+
+        # A directory without images returns an empty list
+        empty_dir = os.path.join(self.temp_dir.name, "empty_dir_input")
+        os.makedirs(empty_dir, exist_ok=True)
+        self.assertEqual(self.file_service.handle_input_path(empty_dir), [])
 
     @patch.object(FileService, '_download_image')
     def test_handle_input_path_url(self, mock_download):
@@ -243,6 +444,22 @@ class TestFileService(unittest.TestCase):
         self.assertEqual(result[0], "/fake/downloaded/path.jpg")
         mock_download.assert_called_once_with("https://example.com/image.jpg")
 
+    @patch('requests.Session.get')
+    def test_handle_input_path_url_as_image(self, mock_get):
+        """Test handle_input_path decodes a URL in memory when as_image is requested."""
+        encoded = io.BytesIO()
+        Image.new('RGB', (12, 6), color='red').save(encoded, format='PNG')
+        mock_response = MagicMock()
+        mock_response.raw = io.BytesIO(encoded.getvalue())
+        mock_get.return_value = mock_response
+        files_before = set(os.listdir(self.test_temp_dir))
+
+        result = self.file_service.handle_input_path("https://example.com/image.png", as_image=True)
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].size, (12, 6))
+        self.assertEqual(set(os.listdir(self.test_temp_dir)), files_before)
+
     @patch.object(FileService, '_download_image')
     def test_handle_input_path_url_download_failure(self, mock_download):
         """Test handle_input_path with URL download failure."""
@@ -252,6 +469,23 @@ class TestFileService(unittest.TestCase):
         
         self.assertEqual(len(result), 0)
 
+    @patch.object(FileService, '_download_image')
+    def test_handle_input_paths_multiple_urls(self, mock_download):
+        """Test handle_input_paths downloads several URLs and keeps input order."""
+        mock_download.side_effect = lambda url: f"/fake/{url.rsplit('/', 1)[-1]}" if "bad" not in url else None
+        test_file_path = os.path.join(self.test_temp_dir, "batch_local.jpg")
+        Image.new('RGB', (10, 10), color='white').save(test_file_path)
+
+        result = self.file_service.handle_input_paths([
+            "https://example.com/a.jpg",
+            test_file_path,
+            "https://example.com/bad.jpg",
+            "https://example.com/b.jpg",
+        ], max_workers=4)
+
+        self.assertEqual(result, ["/fake/a.jpg", test_file_path, "/fake/b.jpg"])
+        self.assertEqual(mock_download.call_count, 3)
+
     def test_handle_input_path_invalid(self):
         """Test handle_input_path with invalid input."""
         # Test with non-existent file
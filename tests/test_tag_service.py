@@ -0,0 +1,269 @@
+"""
+Unit tests for the TagService (tag selection, result caches and batch tagging).
+The WD14 session is replaced by a fake session and tagger dict, so no model is downloaded.
+"""
+import unittest
+import os
+import sqlite3
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+from services import tag_service
+from services.tag_service import (
+    _TagCache, _TagResult, _resolve_tag_config, _select_tags, _flatten_tags,
+    _image_dhash, _tag_images_results, tag_batch_images,
+)
+from utils.logger_config import setup_logging
+
+# Configure logger for tests
+logger = setup_logging(__name__, 'test_logs', log_level_str='DEBUG')
+
+# 假模型的標籤表：4 個分級、4 個通用標籤、1 個角色標籤
+TAG_NAMES = ["general", "sensitive", "questionable", "explicit",
+             "1girl", "long_hair", "smile", "hat_(object)", "hatsune_miku"]
+
+
+class FakeSession:
+    """Stands in for the WD14 InferenceSession; 'smile' follows the brightness of the image."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batch_sizes = []
+
+    def run(self, output_names, feed):
+        batch = feed["input"]
+        self.batch_sizes.append(len(batch))
+        if self.fail:
+            raise RuntimeError("session run failed")
+        preds = np.tile(np.array([0.6, 0.3, 0.05, 0.05, 0.95, 0.7, 0.0, 0.4, 0.9], dtype=np.float32),
+                        (len(batch), 1))
+        preds[:, 6] = batch.reshape(len(batch), -1).mean(axis=1) / 255.0
+        return [preds]
+
+
+def make_tagger(session):
+    """Build a tagger dict in the layout returned by _get_tagger."""
+    return {
+        "key": ("fake",),
+        "session": session,
+        "use_io_binding": False,
+        "input_name": "input",
+        "output_names": ["pred"],
+        "prediction_width": len(TAG_NAMES),
+        "target_size": 16,
+        "max_batch": None,
+        "tag_names": np.asarray(TAG_NAMES, dtype=object),
+        "rating_indexes": np.arange(4, dtype=np.intp),
+        "rating_names": TAG_NAMES[:4],
+        "general_indexes": np.arange(4, 8, dtype=np.intp),
+        "character_indexes": np.array([8], dtype=np.intp),
+        "general_index_cache": {},
+    }
+
+
+class TagConfig:
+    """Minimal tagging config; anything not set here falls back to config.settings."""
+    TAG_MODEL_NAME = "fake-model"
+    TAG_GENERAL_THRESHOLD = 0.35
+    TAG_CHARACTER_THRESHOLD = 0.85
+    TAG_BATCH_SIZE = 2
+    TAG_IO_WORKERS = 2
+    TAG_QUANTIZED_MODEL_DIR = None
+    TAG_ENABLE_PHASH_CACHE = False
+    TAG_EXCLUDED_TAGS = []
+    TAG_CUSTOM_CHARACTER_TAG = ""
+    TAG_CUSTOM_ARTIST_NAME = ""
+    TAG_ENABLE_WILDCARD = False
+    TAG_PREPEND_TAGS = ""
+    TAG_APPEND_TAGS = ""
+    TAG_AUTO_SAVE_TO_FILE = True
+    TAG_OUTPUT_DIR = None
+    TAG_CACHE_PATH = None
+
+
+class TestTagService(unittest.TestCase):
+
+    def setUp(self):
+        """Create a fresh image directory and fake tagger for each test."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_dir = os.path.join(self.temp_dir.name, "images")
+        os.makedirs(self.image_dir)
+        for index, color in enumerate([(0, 0, 0), (255, 255, 255), (128, 128, 128)]):
+            Image.new("RGB", (32, 24), color).save(os.path.join(self.image_dir, f"{index}.png"))
+
+        self.session = FakeSession()
+        patcher = patch.object(tag_service, "_get_tagger", side_effect=lambda *args: make_tagger(self.session))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tag_service._phash_cache.clear()
+
+        class Config(TagConfig):
+            TAG_CACHE_PATH = os.path.join(self.temp_dir.name, "cache", "tags.sqlite")
+        self.config = Config
+
+    def tearDown(self):
+        tag_service._phash_cache.clear()
+        self.temp_dir.cleanup()
+
+    def _cached_rows(self):
+        with sqlite3.connect(self.config.TAG_CACHE_PATH) as connection:
+            return connection.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+
+    def test_select_tags_orders_and_escapes(self):
+        class Config(TagConfig):
+            TAG_PREPEND_TAGS = "masterpiece"
+            TAG_APPEND_TAGS = "highres"
+            TAG_CUSTOM_ARTIST_NAME = "someone"
+            TAG_EXCLUDED_TAGS = ["Long_Hair"]
+        tag_config = _resolve_tag_config(Config)
+        features = {"smile": 0.5, "hat_(object)": 0.9, "1girl": 0.8, "long_hair": 0.99, "blush": 0.5}
+        chars = {"hatsune_miku": 0.9}
+
+        tags = _flatten_tags(_select_tags(features, chars, tag_config))
+
+        # 優先標籤移到最前面；通用標籤依機率排序 (同分依名稱)，括號加上跳脫；排除標籤不分大小寫
+        self.assertEqual(tags, ["1girl", "masterpiece", "hatsune miku", "by someone",
+                                "hat \\(object\\)", "blush", "smile", "highres"])
+
+    def test_select_tags_uses_custom_character_tags_without_detected_characters(self):
+        class Config(TagConfig):
+            TAG_CUSTOM_CHARACTER_TAG = "solo, original"
+        selection = _select_tags({"smile": 0.5}, {}, _resolve_tag_config(Config))
+
+        self.assertEqual(selection.priority, ("solo",))
+        self.assertEqual(selection.characters, ("original",))
+
+    def test_threshold_tags_matches_per_row_reference(self):
+        rng = np.random.default_rng(0)
+        threshold = 0.7
+        names = [f"tag_{index}" for index in range(40)]
+        tagger = {"tag_names": np.asarray(names, dtype=object)}
+        indexes = np.arange(3, 37, dtype=np.intp)
+
+        for empty_rows in ([0, 4, 11], [5, 6], [11], []):
+            preds = rng.random((12, len(names)))
+            preds[empty_rows] *= threshold  # 這些列沒有任何標籤超過閾值
+            expected = [{names[i]: row[i] for i in indexes if row[i] > threshold} for row in preds]
+
+            result = tag_service._threshold_tags(tagger, preds, indexes, threshold)
+
+            self.assertEqual(result, expected)
+            # 每列的標籤維持標籤索引順序
+            self.assertEqual([list(tags) for tags in result], [list(tags) for tags in expected])
+            for row in empty_rows:
+                self.assertEqual(result[row], {})
+
+        self.assertEqual(tag_service._threshold_tags(tagger, np.empty((0, len(names))), indexes, threshold), [])
+
+    def test_tag_cache_hit_and_miss(self):
+        success, _, results = tag_batch_images(self.image_dir, logger, self.config)
+        self.assertTrue(success)
+        self.assertEqual(results["successful_tags"], 3)
+        self.assertEqual(sum(self.session.batch_sizes), 3)
+        self.assertEqual(self._cached_rows(), 3)
+        with open(os.path.join(self.image_dir, "1.txt"), encoding="utf-8") as f:
+            first_tags = f.read()
+
+        # 第二次全部命中快取，不執行推論，輸出的標籤檔內容相同
+        self.session.batch_sizes.clear()
+        os.remove(os.path.join(self.image_dir, "1.txt"))
+        _, _, results = tag_batch_images(self.image_dir, logger, self.config)
+        self.assertEqual(self.session.batch_sizes, [])
+        self.assertEqual(results["successful_tags"], 3)
+        with open(os.path.join(self.image_dir, "1.txt"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), first_tags)
+
+        # 新增的圖片沒有快取，只有它需要推論
+        Image.new("RGB", (20, 30), (10, 200, 10)).save(os.path.join(self.image_dir, "3.png"))
+        tag_batch_images(self.image_dir, logger, self.config)
+        self.assertEqual(self.session.batch_sizes, [1])
+        self.assertEqual(self._cached_rows(), 4)
+
+    def test_tag_cache_fingerprint_tracks_tagging_settings(self):
+        cache_path = self.config.TAG_CACHE_PATH
+
+        def namespace(**overrides):
+            config = type("Config", (TagConfig,), overrides)
+            tag_cache = _TagCache(cache_path, _resolve_tag_config(config))
+            tag_cache.close()
+            return tag_cache.namespace
+
+        base = namespace(TAG_EXCLUDED_TAGS=["smile", "hat_(object)"])
+        # 影響輸出的設定變更時指紋不同
+        self.assertNotEqual(base, namespace(TAG_EXCLUDED_TAGS=["smile"]))
+        self.assertNotEqual(base, namespace(TAG_EXCLUDED_TAGS=["smile", "hat_(object)"], TAG_GENERAL_THRESHOLD=0.5))
+        self.assertNotEqual(base, namespace(TAG_EXCLUDED_TAGS=["smile", "hat_(object)"], TAG_CHARACTER_THRESHOLD=0.5))
+        # 排除標籤的順序、批次大小與 GPU 編號不影響輸出
+        self.assertEqual(base, namespace(TAG_EXCLUDED_TAGS=["hat_(object)", "smile"], TAG_BATCH_SIZE=16, TAG_DEVICE_ID=1))
+
+    def test_tag_cache_fingerprint_tracks_quantized_model(self):
+        quantized_dir = os.path.join(self.temp_dir.name, "quantized")
+        os.makedirs(quantized_dir)
+        open(tag_service._quantized_model_path(quantized_dir, TagConfig.TAG_MODEL_NAME), "wb").close()
+
+        class Config(TagConfig):
+            TAG_QUANTIZED_MODEL_DIR = quantized_dir
+
+        def namespace(provider):
+            with patch.object(tag_service, "_resolve_tagger_provider", return_value=provider):
+                tag_cache = _TagCache(self.config.TAG_CACHE_PATH, _resolve_tag_config(Config))
+            tag_cache.close()
+            return tag_cache.namespace
+
+        plain = _TagCache(self.config.TAG_CACHE_PATH, _resolve_tag_config(TagConfig))
+        plain.close()
+        # CUDA 上不載入 INT8 模型，與未設定量化目錄相同；CPU 上使用 INT8 模型則指紋不同
+        self.assertEqual(namespace("CUDAExecutionProvider"), plain.namespace)
+        self.assertNotEqual(namespace("CPUExecutionProvider"), plain.namespace)
+
+    def test_tag_cache_invalidated_when_threshold_changes(self):
+        tag_batch_images(self.image_dir, logger, self.config)
+
+        class StricterConfig(self.config):
+            TAG_GENERAL_THRESHOLD = 0.8
+        self.session.batch_sizes.clear()
+        tag_batch_images(self.image_dir, logger, StricterConfig)
+
+        self.assertEqual(sum(self.session.batch_sizes), 3)
+        with open(os.path.join(self.image_dir, "0.txt"), encoding="utf-8") as f:
+            self.assertNotIn("long hair", f.read())
+
+    def test_failed_results_are_not_cached(self):
+        self.session.fail = True
+        _, _, results = tag_batch_images(self.image_dir, logger, self.config)
+        self.assertEqual(results["failed_tags"], 3)
+        self.assertEqual(self._cached_rows(), 0)
+
+        # 失敗後恢復正常時重新推論，而不是讀到空的快取結果
+        self.session.fail = False
+        self.session.batch_sizes.clear()
+        _, _, results = tag_batch_images(self.image_dir, logger, self.config)
+        self.assertEqual(sum(self.session.batch_sizes), 3)
+        self.assertEqual(results["successful_tags"], 3)
+
+    def test_phash_cache_reuses_near_identical_images(self):
+        class Config(TagConfig):
+            TAG_ENABLE_PHASH_CACHE = True
+            TAG_PHASH_MAX_DISTANCE = 0
+        gradient = np.tile(np.linspace(0, 255, 64, dtype=np.uint8), (48, 1))
+        image = Image.fromarray(np.stack([gradient] * 3, axis=-1))
+        resized = image.resize((32, 24), Image.BICUBIC)
+        other = Image.fromarray(np.ascontiguousarray(np.stack([gradient[:, ::-1]] * 3, axis=-1)))
+        self.assertEqual(_image_dhash(image), _image_dhash(resized))
+        self.assertNotEqual(_image_dhash(image), _image_dhash(other))
+
+        first = _tag_images_results([image], logger, Config)
+        self.assertEqual(self.session.batch_sizes, [1])
+
+        # 縮放後的相同圖片沿用快取結果，不同的圖片仍然推論
+        second = _tag_images_results([resized, other], logger, Config)
+        self.assertEqual(self.session.batch_sizes, [1, 1])
+        self.assertEqual(second[0].tag_list, first[0].tag_list)
+        self.assertIsInstance(second[1], _TagResult)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,7 @@ from PIL import Image
 import tempfile
 from unittest.mock import patch, MagicMock
 
-from services.upscale_service import upscale_image_service, upscale_image_service_entry
+from services.upscale_service import upscale_image_service, upscale_image_service_entry, _TileBatcher, _pil_resize_image
 from config import settings
 from utils.logger_config import setup_logging
 from services.file_service import FileService
@@ -197,6 +197,98 @@ class TestUpscaleService(unittest.TestCase):
             mock_upscale.assert_called_once()
             logger.info("test_upscale_service_with_model_error completed successfully.")
 
+    def test_upscale_entry_uses_jpeg_draft(self):
+        """Test that JPEGs are draft-decoded only down to the target size, never below it."""
+        large_path = self._create_dummy_image("large_input.jpg", (1000, 800), "JPEG")
+        small_path = self._create_dummy_image("small_input.jpg", (300, 240), "JPEG")
+
+        class DraftConfig:
+            UPSCALE_MODEL_NAME = "HGSR-MHR-anime-aug_X4_320"
+            UPSCALE_TARGET_WIDTH = 200
+            UPSCALE_TARGET_HEIGHT = 200
+            UPSCALE_MIN_SIZE_THRESHOLD = None
+
+        with patch('services.upscale_service.upscale_with_cdc') as mock_upscale:
+            mock_upscale.side_effect = lambda image, **kwargs: image.resize((image.width * 4, image.height * 4))
+
+            # 1/4 draft scale: 1000x800 -> 250x200, still covering the 200x200 target
+            result_image, _, _ = upscale_image_service_entry(large_path, logger, config=DraftConfig())
+            self.assertEqual(mock_upscale.call_args[0][0].size, (250, 200))
+            self.assertEqual(result_image.size, (200, 200))
+
+            # Less than twice the target: decoded at full resolution
+            upscale_image_service_entry(small_path, logger, config=DraftConfig())
+            self.assertEqual(mock_upscale.call_args[0][0].size, (300, 240))
+
+    def test_resize_with_center_crop_matches_resize_then_crop(self):
+        """Test that the fused resize + center crop keeps the same pixels as resizing and then cropping."""
+        import numpy as np
+
+        image = Image.effect_noise((300, 200), 64).convert('RGB')
+        fused = _pil_resize_image(image, 512, 512, True, logger, center_crop=True)
+        self.assertEqual(fused.size, (512, 512))
+
+        # Cover scale 512/200 -> 768x512, then crop 128px from the left
+        expected = image.resize((768, 512), Image.BICUBIC).crop((128, 0, 640, 512))
+        difference = np.abs(np.asarray(fused, dtype=np.int16) - np.asarray(expected, dtype=np.int16))
+        self.assertLessEqual(difference.max(), 2)
+
+    def test_resize_skipped_when_already_target_size(self):
+        """Test that resizing to the image's own size returns the image without resampling."""
+        image = Image.new('RGB', (256, 128), color='blue')
+        self.assertIs(_pil_resize_image(image, 256, 128, False, logger), image)
+        self.assertIs(_pil_resize_image(image, 256, 128, True, logger, center_crop=True), image)
+
+    def test_tile_batcher_packs_tiles_across_threads(self):
+        """Test that tiles submitted from several threads are batched together and returned to their owners."""
+        import threading
+        import time
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+
+        class FakeSession:
+            def __init__(self):
+                self.batch_sizes = []
+                self.batch_sources = []
+                self.first_batch = threading.Event()
+                self.release = threading.Event()
+
+            def run(self, output_names, feeds):
+                tiles = feeds['input']
+                self.batch_sizes.append(len(tiles))
+                self.batch_sources.append(set(np.unique(tiles).tolist()))
+                if len(self.batch_sizes) == 1:
+                    # Hold the first batch until every thread has queued its tiles
+                    self.first_batch.set()
+                    self.release.wait(5)
+                # (N, 3, h, w) -> (N, 3, scale, h, scale, w) like the CDC model, with scale 2
+                return [np.repeat(np.repeat(tiles[:, :, None, :, None, :], 2, axis=2), 2, axis=4) + 1.0]
+
+        session = FakeSession()
+        batcher = _TileBatcher(session, 2, batch_size=4)
+        inputs = [np.full((3, 3, 16, 16), index, dtype=np.float32) for index in range(5)]
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(batcher.run, tiles) for tiles in inputs]
+            self.assertTrue(session.first_batch.wait(5))
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                with batcher.condition:
+                    if len(batcher.pending) + session.batch_sizes[0] == 15:
+                        break
+                time.sleep(0.001)
+            session.release.set()
+            outputs = [future.result(timeout=5) for future in futures]
+
+        for index, output in enumerate(outputs):
+            self.assertEqual(output.shape, (3, 3, 2, 16, 2, 16))
+            self.assertTrue(np.all(output == index + 1.0))
+        self.assertEqual(sum(session.batch_sizes), 15)
+        self.assertLessEqual(max(session.batch_sizes), 4)
+        # Each input has only 3 tiles, so a full batch of 4 must mix tiles from different images
+        self.assertIn(4, session.batch_sizes)
+        self.assertTrue(any(len(sources) > 1 for sources in session.batch_sources))
+
     def test_upscale_service_entry_with_invalid_path(self):
         """Test upscaling with an invalid image path."""
         invalid_path = "non_existent_image.png"
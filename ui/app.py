@@ -533,6 +533,7 @@ if __name__ == "__main__":
     app_instance.launch(
         server_name=server_name,
         server_port=server_port, 
-        share=share_option
+        share=share_option,
+        allowed_paths=[getattr(current_settings, 'PREVIEW_TMPFS_DIR', '/dev/shm/waifuc_previews')] if getattr(current_settings, 'PREVIEW_USE_TMPFS', False) else None
     )
     logger_for_standalone.info("UI (standalone): Gradio app finished.")
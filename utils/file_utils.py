@@ -1,4 +1,5 @@
 # utils/file_utils.py
+import hashlib
 import os
 import shutil
 import uuid
@@ -243,7 +244,38 @@ def is_path_safe_for_gradio(path, allowed_paths=None):
             return True
     return False
 
-def scan_directory_for_images(directory_path, recursive=True, supported_extensions=None):
+def file_digest(file_path):
+    """
+    檔案內容的雜湊值 (blake2b，以 1 MB 區塊讀取)，用於快取鍵與重複檔案偵測。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _iter_image_files(directory, extensions, skip_dir_names, recursive):
+    """
+    以 os.scandir 掃描目錄 (檔案類型直接取自目錄列表，不需逐一 stat)
+    與 os.walk 相同：不進入符號連結的目錄，無法讀取的目錄直接略過
+    """
+    sub_dirs = []
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir():
+                if recursive and entry.name not in skip_dir_names and not entry.is_symlink():
+                    sub_dirs.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in extensions:
+                yield entry.path
+
+    for sub_dir in sub_dirs:
+        yield from _iter_image_files(sub_dir, extensions, skip_dir_names, recursive)
+
+def scan_directory_for_images(directory_path, recursive=True, supported_extensions=None, skip_dir_names=()):
     """
     掃描目錄中的所有圖片文件，支援遞歸掃描子目錄。
     
@@ -251,6 +283,7 @@ def scan_directory_for_images(directory_path, recursive=True, supported_extensio
         directory_path (str): 要掃描的目錄路徑
         recursive (bool): 是否遞歸掃描子目錄
         supported_extensions (list): 支援的圖片副檔名列表
+        skip_dir_names (Iterable[str]): 遞歸掃描時略過的子目錄名稱 (例如輸出目錄)
         
     Returns:
         list: 找到的圖片文件路徑列表
@@ -264,18 +297,8 @@ def scan_directory_for_images(directory_path, recursive=True, supported_extensio
         return image_files
     
     try:
-        if recursive:
-            # 遞歸掃描所有子目錄
-            for root, dirs, files in os.walk(directory_path):
-                for file in files:
-                    if any(file.lower().endswith(ext) for ext in supported_extensions):
-                        image_files.append(os.path.join(root, file))
-        else:
-            # 只掃描當前目錄
-            for file in os.listdir(directory_path):
-                file_path = os.path.join(directory_path, file)
-                if os.path.isfile(file_path) and any(file.lower().endswith(ext) for ext in supported_extensions):
-                    image_files.append(file_path)
+        extensions = frozenset(ext.lower() for ext in supported_extensions)
+        image_files.extend(_iter_image_files(directory_path, extensions, frozenset(skip_dir_names), recursive))
                     
         # 按文件名排序以確保處理順序一致
         image_files.sort()